@@ -0,0 +1,108 @@
+"""Счётчики обращений, промахов, вмешательств и инвалидаций по адресам оперативной
+памяти и по наборам кэшей. Копятся в массивах по событиям шины и нужны для тепловой
+карты, на которой видны горячие адреса и наборы, где строки постоянно вытесняют
+друг друга."""
+
+from __future__ import annotations
+from array import array
+from typing import Dict
+
+from events import EventKind
+from protocol import CacheController
+
+METRICS = ("accesses", "misses", "interventions", "invalidations")
+
+
+class AccessCounters:
+    """Для каждой метрики хранит массив по адресам памяти (ram[metric]) и массив
+    по наборам кэшей всех процессоров (sets[metric], индекс
+    cpu_index * lines_count + номер набора). version растёт при каждом изменении,
+    чтобы перерисовывать карту только когда есть что показать.
+
+    Если передан memory (байтовый буфер размера memory_size(), например общая
+    память), массивы размещаются в нём, а не создаются отдельно."""
+
+    def __init__(self, cache_controller: CacheController, memory: memoryview = None):
+        self.cache_controller = cache_controller
+        self.lines_count = cache_controller.cach_lines_count
+        self.ram_size = cache_controller.ram.size
+        self.cpu_count = len(cache_controller.cpus)
+        self.memory = memory
+        self.version = 0
+        self.reset()
+
+        events = cache_controller.events
+        events.subscribe(EventKind.OPERATION, self._on_operation)
+        events.subscribe(EventKind.ADDRESS_BUS, self._on_address_bus)
+        events.subscribe(EventKind.INTERVENTION, self._on_intervention)
+        events.subscribe(EventKind.INVALIDATION, self._on_invalidation)
+
+    def close(self):
+        events = self.cache_controller.events
+        events.unsubscribe(EventKind.OPERATION, self._on_operation)
+        events.unsubscribe(EventKind.ADDRESS_BUS, self._on_address_bus)
+        events.unsubscribe(EventKind.INTERVENTION, self._on_intervention)
+        events.unsubscribe(EventKind.INVALIDATION, self._on_invalidation)
+
+        if self.memory is not None:
+            # Иначе буфер, например общую память, нельзя будет закрыть
+            for view in list(self.ram.values()) + list(self.sets.values()):
+                view.release()
+            self.memory.release()
+
+    @staticmethod
+    def memory_size(ram_size: int, cpu_count: int, lines_count: int) -> int:
+        """Размер буфера в байтах для всех массивов счётчиков."""
+        return array("L").itemsize * len(METRICS) * (ram_size + cpu_count * lines_count)
+
+    def reset(self):
+        sets_count = self.cpu_count * self.lines_count
+        if self.memory is None:
+            self.ram: Dict[str, array] = {
+                metric: array("L", bytes(array("L").itemsize * self.ram_size))
+                for metric in METRICS
+            }
+            self.sets: Dict[str, array] = {
+                metric: array("L", bytes(array("L").itemsize * sets_count))
+                for metric in METRICS
+            }
+        else:
+            self.memory[:] = bytes(len(self.memory))
+            self.ram, self.sets = split_counters(
+                self.memory, self.ram_size, self.cpu_count, self.lines_count
+            )
+        self.version += 1
+
+    def _count(self, metric: str, cpu_index: int, address: int):
+        self.ram[metric][address] += 1
+        set_index = cpu_index * self.lines_count + address % self.lines_count
+        self.sets[metric][set_index] += 1
+        self.version += 1
+
+    def _on_operation(self, cpu_index, address, is_write):
+        self._count("accesses", cpu_index, address)
+
+    def _on_address_bus(self, cpu_index, address, read_miss):
+        if read_miss:
+            self._count("misses", cpu_index, address)
+
+    def _on_intervention(self, cpu_index, address, dirty):
+        self._count("interventions", cpu_index, address)
+
+    def _on_invalidation(self, cpu_index, address, source_cpu_index):
+        self._count("invalidations", cpu_index, address)
+
+
+def split_counters(memory: memoryview, ram_size: int, cpu_count: int, lines_count: int):
+    """Разбивает байтовый буфер на массивы счётчиков в том же порядке, что
+    и AccessCounters. Возвращает словари ram и sets."""
+    values = memory.cast("L")
+    sets_count = cpu_count * lines_count
+    ram, sets = {}, {}
+    offset = 0
+    for metric in METRICS:
+        ram[metric] = values[offset : offset + ram_size]
+        offset += ram_size
+        sets[metric] = values[offset : offset + sets_count]
+        offset += sets_count
+    return ram, sets
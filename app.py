@@ -1,23 +1,38 @@
-"""Основной файл приложения. Тут визуализация объединяется с логикой."""
+"""Основной файл приложения. Тут визуализация объединяется с логикой.
 
-from functools import partial
-from typing import List
+Модель работает в отдельном процессе (simulation_worker.py), а интерфейс раз
+в TICK_MS читает из общей памяти только изменившиеся строки кэшей и адреса памяти.
+События запросов пользователя рабочий процесс присылает обратно, и они
+проигрываются на локальной шине событий для анимации шин.
+
+Кнопка Step back откатывает последний такт, а Jump переходит к введённому такту
+по журналу отмены рабочего процесса.
+
+Если в settings задан PROFILE_OUTPUT, синхронизация и обработчики событий
+интерфейса профилируются (profiling.py), отчёт пишется в файлы
+<PROFILE_OUTPUT>.app.*, а отчёт рабочего процесса - в <PROFILE_OUTPUT>.worker.*.
+
+Запуск:
+python app.py
+python app.py 1000000  - сразу прогнать столько случайных запросов
+"""
+
+import random
+import sys
 from collections import deque
 
 import settings
-from protocol import CPU, RAM, Cache, CacheController
-from visualization.cache_grid import CacheGrid
+from events import EventBus, EventKind
+from profiling import Profiler
+from simulation_worker import SimulationWorker
+from visualization.heatmap import HeatmapPanel
 from visualization.main_window import MainWindow
-from visualization.ram_grid import RAMGrid
-
-mw = MainWindow()
 
 index_dont = 0
 b2 = True
 
 # Инициализируем систему
 def cpu_read_callback(cpu_index, b):
-    print("cpu_read_callback")
     mw.cpu_to_cache_read_buses[cpu_index].run_arrow_up()
     global b2
     if b:
@@ -28,38 +43,25 @@ def cpu_read_callback(cpu_index, b):
     b2 = True
 
 
-def cpu_write_callback(cpu_index):
-    print("cpu_write_callback")
+def cpu_write_callback(cpu_index, address):
     mw.cpu_to_cache_read_buses[cpu_index].run_arrow_up()
     mw.cpu_to_cache_write_buses[cpu_index].run_arrow_up()
     global b2
     b2 = False
 
 
-def cache_read_callback(cpu_index,b):
-    pass
-
-
-def cache_write_callback(cpu_index):
-    pass
-
-
-def ram_read_callback():
-    print("ram_read_callback")
+def ram_read_callback(address):
     mw.root.after(4500, lambda: mw.ram_to_data_bus.run_arrow_up())
 
 
-def ram_write_callback():
-    print("ram_write_callback")
+def ram_write_callback(address, data):
     mw.root.after(1500, lambda: mw.cache_to_data_buses[index_dont].run_arrow_up())
     mw.root.after(3000, lambda: mw.data_bus.activate())
     mw.root.after(3000, lambda: mw.ram_to_address_bus.run_arrow_down())
     mw.root.after(3000, lambda: mw.ram_to_data_bus.run_arrow_down())
 
 
-def read_miss_callback(cpu_index, b = 0):
-    print("read_miss_callback")
-    
+def read_miss_callback(cpu_index, address, b = 0):
     mw.increment_counter()
     mw.root.after(3000, lambda: mw.address_bus.activate())
     
@@ -86,15 +88,13 @@ def read_miss_callback(cpu_index, b = 0):
         mw.root.after(6000, lambda: mw.cache_to_data_buses[cpu_index].run_arrow_down())
 
 
-def intervention_callback(cpu_index):
+def intervention_callback(cpu_index, address, dirty):
     ...
     #mw.data_bus.activate()
     #mw.cache_to_data_buses[cpu_index].run_arrow_up()
 
 
 def state_callback(cpu_index, list):
-    print("state_callback")
-
     mw.root.after(6000, lambda: mw.shared_bus.activate())
     for i, bus in enumerate(mw.cache_to_shared_buses):
         if i == cpu_index:
@@ -105,71 +105,59 @@ def state_callback(cpu_index, list):
             
 
 
-ram = RAM(
-    size=settings.RAM_SIZE,
-    read_callback=ram_read_callback,
-    write_callback=ram_write_callback,
-)
+def synchronize(worker: SimulationWorker):
+    """Переносит в визуализацию изменения состояния из рабочего процесса."""
+    ram_addresses, lines = worker.read_changes()
 
-cpus = []
+    for address in ram_addresses:
+        mw.ram_grid.write(value=worker.get_ram(address), address=address)
 
-for cpu_index in range(settings.CPU_COUNT):
-    cpu = CPU(
-        index=cpu_index,
-        read_callback=partial(cpu_read_callback, cpu_index),
-        write_callback=partial(cpu_write_callback, cpu_index),
-    )
-    cpu.cache = Cache(
-        settings.CACH_CACHLINES_COUNT,
-        settings.CACH_CHANNELS_COUNT,
-        partial(cache_read_callback, cpu_index),
-        partial(cache_write_callback, cpu_index),
-    )
-    cpus.append(cpu)
-
-cache_controller = CacheController(
-    ram,
-    cpus,
-    settings.CACH_CACHLINES_COUNT,
-    settings.CACH_CHANNELS_COUNT,
-    read_miss_callback,
-    intervention_callback,
-    state_callback,
-)
-
-
-def synchronize_caches(cpus: List[CPU], cache_grids: List[CacheGrid]):
-    """Синхронизирует состояние кэшей с визуализацией."""
-    for cpu_index in range(settings.CPU_COUNT):
-        for channel_index, channel in enumerate(cpus[cpu_index].cache.channels):
-            for cach_line_index, cach_line in enumerate(channel):
-                if cach_line.state is not None:
-                    address_to_bin = int(bin(cach_line.address)[2:])
-                    cache_grids[cpu_index].update_cache_line(
-                        channel_index=channel_index,
-                        cache_line_index=cach_line_index,
-                        state=cach_line.state,
-                        address=address_to_bin,
-                        data=cach_line.data,
-                        policy_counter=cach_line.not_used_counter,
-                    )
-
-
-def synchronize_ram(ram: RAM, ram_grid: RAMGrid):
-    """Синхронизирует состояние оперативной памяти с визуализацией."""
-    for i, v in enumerate(ram.data):
-        ram_grid.write(value=v, address=i)
+    for cpu_index, row in lines:
+        cach_line = worker.get_line(cpu_index, row)
+        if cach_line is not None:
+            state, address, data, policy_counter = cach_line
+            channel_index, cach_line_index = divmod(row, settings.CACH_CACHLINES_COUNT)
+            address_to_bin = int(bin(address)[2:])
+            mw.cache_grids[cpu_index].update_cache_line(
+                channel_index=channel_index,
+                cache_line_index=cach_line_index,
+                state=state,
+                address=address_to_bin,
+                data=data,
+                policy_counter=policy_counter,
+            )
+
+    mw.set_tick(worker.tick)
 
 
 def reset():
-    for cpu in cpus:
-        cpu.cache.reset()
-    ram.reset()
+    worker.reset()
 
     mw.reset()
 
 
-mw.set_reset_callback(reset)
+def step_back():
+    mw.reset_buses()
+    worker.step_back()
+
+
+def jump(tick: int):
+    mw.reset_buses()
+    worker.jump_to(tick)
+
+
+# Функции этого файла, которые профилируются при заданном PROFILE_OUTPUT
+PROFILED_FUNCTIONS = [
+    "tick",
+    "synchronize",
+    "cpu_read_callback",
+    "cpu_write_callback",
+    "ram_read_callback",
+    "ram_write_callback",
+    "read_miss_callback",
+    "intervention_callback",
+    "state_callback",
+]
 
 
 # Обрабатываем пользовательский ввод
@@ -187,15 +175,17 @@ def tick():
         operation_type, cpu_index, address = task_queue.popleft()
 
         if operation_type == "R":
-            #print(f"READ: {cpu_index = }, {address = }")
-            cpus[cpu_index].read(address)
+            worker.read(cpu_index, address)
 
         elif operation_type == "W":
-            #print(f"WRITE: {cpu_index = }, {address = }")
-            cpus[cpu_index].increment(address)
+            worker.increment(cpu_index, address)
 
-        synchronize_caches(cpus, mw.cache_grids)
-        synchronize_ram(ram, mw.ram_grid)
+    # Проигрываем события выполненных запросов для анимации
+    for kind, args in worker.poll_events():
+        if events.handlers[kind]:
+            events.emit(kind, *args)
+
+    synchronize(worker)
 
     mw.root.after(settings.TICK_MS, tick)
 
@@ -212,11 +202,76 @@ def write_callback(cpu_index: int, address: int):
     task_queue.append(("W", cpu_index, address))
 
 
-# Привязываем нажатие на кнопки к колбэкам
-for cpu_index, cpu_btn in enumerate(mw.cpu_btns):
-    cpu_btn.read_callback = partial(read_callback, cpu_index)
-    cpu_btn.write_callback = partial(write_callback, cpu_index)
+def run_random_batch(operations_count: int):
+    """Отправляет рабочему процессу пакет случайных запросов."""
+    count = operations_count
+    cpu_indexes = [random.randrange(settings.CPU_COUNT) for _ in range(count)]
+    operations = [random.randrange(2) for _ in range(count)]
+    addresses = [random.randrange(settings.RAM_SIZE) for _ in range(count)]
+    worker.run_batch(cpu_indexes, operations, addresses)
+
+
+# Рабочий процесс при запуске методом spawn заново импортирует этот файл, поэтому
+# окно и сам процесс создаются только при прямом запуске
+if __name__ == "__main__":
+    mw = MainWindow()
+
+    # Обёртки ставятся до подписки обработчиков и первого вызова tick, иначе
+    # туда попадут исходные функции
+    profiler = None
+    if settings.PROFILE_OUTPUT is not None:
+        # Функции интерфейса вызываются редко, поэтому замеряется каждый вызов
+        profiler = Profiler(sample_every=1)
+        module = sys.modules[__name__]
+        profiler.install([(module, name, f"app.{name}") for name in PROFILED_FUNCTIONS])
+        profile_output = f"{settings.PROFILE_OUTPUT}.worker"
+    else:
+        profile_output = None
+
+    events = EventBus()
+    events.subscribe(EventKind.CPU_READ, cpu_read_callback)
+    events.subscribe(EventKind.CPU_WRITE, cpu_write_callback)
+    events.subscribe(EventKind.RAM_READ, ram_read_callback)
+    events.subscribe(EventKind.RAM_WRITE, ram_write_callback)
+    events.subscribe(EventKind.ADDRESS_BUS, read_miss_callback)
+    events.subscribe(EventKind.INTERVENTION, intervention_callback)
+    events.subscribe(EventKind.STATE_CHANGE, state_callback)
+
+    worker = SimulationWorker(
+        settings.RAM_SIZE,
+        settings.CPU_COUNT,
+        settings.CACH_CACHLINES_COUNT,
+        settings.CACH_CHANNELS_COUNT,
+        victim_lines_count=settings.CACH_VICTIM_LINES_COUNT,
+        profile_output=profile_output,
+    )
+    worker.start()
+
+    heatmap = HeatmapPanel(
+        mw.root,
+        settings.TOP_LEFT_CORNER[0],
+        settings.HEATMAP_Y_COORD,
+        *settings.HEATMAP_SIZE,
+        worker.counters,
+        interval_ms=settings.HEATMAP_REDRAW_MS,
+    )
+
+    mw.set_reset_callback(reset)
+    mw.set_journal_callbacks(step_back, jump)
+
+    # Привязываем нажатие на кнопки к колбэкам
+    mw.set_cpu_callbacks(read_callback, write_callback)
 
-# Запускаем приложение
-mw.root.after(settings.TICK_MS, tick)
-mw.mainloop()
+    if len(sys.argv) > 1:
+        run_random_batch(int(sys.argv[1]))
+
+    # Запускаем приложение
+    mw.root.after(settings.TICK_MS, tick)
+    heatmap.start()
+    try:
+        mw.mainloop()
+    finally:
+        worker.close()
+        if profiler is not None:
+            profiler.uninstall()
+            profiler.dump(f"{settings.PROFILE_OUTPUT}.app")
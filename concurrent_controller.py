@@ -0,0 +1,170 @@
+"""Кэш контроллер, который можно вызывать из нескольких потоков одновременно,
+например по потоку на каждый моделируемый процессор (выигрыш от потоков будет
+на CPython без GIL).
+
+Запрос к адресу меняет строки только в наборе address % lines_count всех кэшей
+и сам адрес в памяти, поэтому запросы к разным наборам не пересекаются по данным.
+Наборы делятся на полосы (stripes), у каждой полосы своя блокировка, и запрос
+выполняется под блокировкой полосы своего набора. Общий такт - точка глобального
+упорядочивания: номер запроса выдаётся под отдельной короткой блокировкой, пока
+полоса уже захвачена, так что для каждого набора порядок номеров совпадает
+с порядком, в котором запросы прошли по шине.
+
+Ограничения:
+    - счётчики MRU увеличиваются только внутри набора (Cache.set_local_counters),
+      решения о замещении те же, но значения счётчиков отличаются от обычного
+      режима;
+    - буфер вытесненных строк общий для всех наборов кэша, поэтому с ним этот
+      режим не работает;
+    - подписчики шины событий вызываются из разных потоков и должны быть
+      потокобезопасными сами.
+
+Демо:
+python concurrent_controller.py 200000
+"""
+
+from __future__ import annotations
+import sys
+import threading
+from contextlib import ExitStack
+from typing import Dict, List
+
+from events import EventBus
+from protocol import CPU, RAM, SOURCE_CACHE, CacheController
+
+
+class ConcurrentCacheController(CacheController):
+    def __init__(
+        self,
+        ram: RAM,
+        cpus: List[CPU],
+        cach_lines_count: int,
+        cach_channels_count: int,
+        events: EventBus = None,
+        stripes_count: int = None,
+    ):
+        # last_source и номер последнего запроса у каждого потока свои
+        self._local = threading.local()
+        super().__init__(ram, cpus, cach_lines_count, cach_channels_count, events)
+
+        for cpu in self.cpus:
+            if cpu.cache.victim_lines:
+                raise ValueError(
+                    "victim buffer is shared by all sets and cannot be striped"
+                )
+            cpu.cache.set_local_counters = True
+
+        if stripes_count is None:
+            stripes_count = cach_lines_count
+        # RLock, потому что инкремент держит полосу, пока выполняет чтение и запись
+        self.stripes = [threading.RLock() for _ in range(stripes_count)]
+        self.order_lock = threading.Lock()
+
+    @property
+    def last_source(self) -> int:
+        return getattr(self._local, "last_source", SOURCE_CACHE)
+
+    @last_source.setter
+    def last_source(self, source: int):
+        self._local.last_source = source
+
+    @property
+    def last_tick(self) -> int:
+        """Номер последнего запроса текущего потока в глобальном порядке."""
+        return getattr(self._local, "tick", 0)
+
+    def locked(self, address: int):
+        return self.stripes[address % self.cach_lines_count % len(self.stripes)]
+
+    def _advance_tick(self):
+        with self.order_lock:
+            self.tick += 1
+            self._local.tick = self.tick
+
+    def _all_locked(self) -> ExitStack:
+        """Захватывает все полосы по порядку (без взаимных блокировок)."""
+        stack = ExitStack()
+        for stripe in self.stripes:
+            stack.enter_context(stripe)
+        return stack
+
+    def _read(self, source_cpu: CPU, address: int) -> int:
+        with self.locked(address):
+            return super()._read(source_cpu, address)
+
+    def write(self, source_cpu: CPU, data, address: int):
+        with self.locked(address):
+            super().write(source_cpu, data, address)
+
+    def _read_modify_write(self, source_cpu: CPU, address: int, modify) -> int:
+        with self.locked(address):
+            return super()._read_modify_write(source_cpu, address, modify)
+
+    def fast_forward(self, cpu_indexes, operations, addresses, until_tick=None):
+        with self._all_locked():
+            return super().fast_forward(cpu_indexes, operations, addresses, until_tick)
+
+    def reset(self):
+        with self._all_locked():
+            super().reset()
+
+    def snapshot(self) -> Dict:
+        with self._all_locked():
+            return super().snapshot()
+
+    def restore(self, snapshot: Dict):
+        with self._all_locked():
+            super().restore(snapshot)
+
+
+if __name__ == "__main__":
+    import random
+    import time
+    from array import array
+
+    from invariants import CoherenceChecker
+
+    operations_count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    cpu_count = 4
+    lines_count = 4
+    ram_size = 64
+
+    def make_trace(cpu_index, seed):
+        """Каждый процессор работает со своим набором, общих наборов нет."""
+        generator = random.Random(seed)
+        count = operations_count // cpu_count
+        addresses = array(
+            "q",
+            (
+                generator.randrange(ram_size // lines_count) * lines_count + cpu_index
+                for _ in range(count)
+            ),
+        )
+        operations = array("b", (generator.randrange(2) for _ in range(count)))
+        return array("b", [cpu_index] * count), operations, addresses
+
+    traces = [make_trace(cpu_index, cpu_index) for cpu_index in range(cpu_count)]
+
+    for threads_count in (1, cpu_count):
+        ram = RAM(ram_size)
+        cpus = [CPU(cpu_index) for cpu_index in range(cpu_count)]
+        cache_controller = ConcurrentCacheController(ram, cpus, lines_count, 4)
+
+        def run(cpu_indexes):
+            for cpu_index in cpu_indexes:
+                cache_controller.run_batch(*traces[cpu_index])
+
+        groups = [range(i, cpu_count, threads_count) for i in range(threads_count)]
+        threads = [threading.Thread(target=run, args=(group,)) for group in groups]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        CoherenceChecker(cache_controller).check_all()
+        print(
+            f"{threads_count} threads: {operations_count / elapsed:.0f} ops/s, "
+            f"tick {cache_controller.tick}"
+        )
@@ -0,0 +1,211 @@
+"""Двоичный журнал транзакций на шинах и его экспорт в формат Chrome Trace Event,
+который открывается в https://ui.perfetto.dev или chrome://tracing.
+
+Демо:
+python event_log.py events.bin trace.json
+"""
+
+from __future__ import annotations
+import json
+import struct
+import sys
+from typing import Iterator, Tuple
+
+from events import EventKind
+from protocol import CacheController
+
+# Запись журнала: такт, вид события, процессор, источник данных, адрес, данные.
+# Процессор и источник 16-битные, чтобы хватало на сотни процессоров (-1 - нет
+# источника), данные 64-битные: после долгих серий инкрементов значения растут
+RECORD = struct.Struct("<QBhhiq")
+
+LOGGED_EVENTS = (
+    EventKind.ADDRESS_BUS,
+    EventKind.DATA_BUS,
+    EventKind.SHARED_LINE,
+    EventKind.INTERVENTION,
+    EventKind.COPY_BACK,
+    EventKind.INVALIDATION,
+)
+
+# Длительность одного такта на временной шкале в микросекундах
+TRACE_TICK_US = 1000
+
+
+class EventLogWriter:
+    """Подписывается на транзакции на шинах и пишет их в двоичный файл. Записи
+    копятся в буфере на buffer_records записей и сбрасываются на диск целиком."""
+
+    def __init__(
+        self, path: str, cache_controller: CacheController, buffer_records=1 << 16
+    ):
+        self.cache_controller = cache_controller
+        self.file = open(path, "wb")
+        self.buffer = bytearray(RECORD.size * buffer_records)
+        self.offset = 0
+        self.records_count = 0
+
+        events = cache_controller.events
+        events.subscribe(EventKind.ADDRESS_BUS, self._on_address_bus)
+        events.subscribe(EventKind.DATA_BUS, self._on_data_bus)
+        events.subscribe(EventKind.SHARED_LINE, self._on_shared_line)
+        events.subscribe(EventKind.INTERVENTION, self._on_intervention)
+        events.subscribe(EventKind.COPY_BACK, self._on_copy_back)
+        events.subscribe(EventKind.INVALIDATION, self._on_invalidation)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _append(self, kind, cpu_index, source, address, data):
+        RECORD.pack_into(
+            self.buffer,
+            self.offset,
+            self.cache_controller.tick,
+            kind,
+            cpu_index,
+            source,
+            address,
+            data,
+        )
+        self.offset += RECORD.size
+        self.records_count += 1
+        if self.offset == len(self.buffer):
+            self.flush()
+
+    def _on_address_bus(self, cpu_index, address, read_miss):
+        self._append(EventKind.ADDRESS_BUS, cpu_index, -1, address, int(read_miss))
+
+    def _on_data_bus(self, cpu_index, address, data, source_cpu_index):
+        self._append(EventKind.DATA_BUS, cpu_index, source_cpu_index, address, data)
+
+    def _on_shared_line(self, cpu_index, address):
+        self._append(EventKind.SHARED_LINE, cpu_index, -1, address, 0)
+
+    def _on_intervention(self, cpu_index, address, dirty):
+        self._append(EventKind.INTERVENTION, cpu_index, cpu_index, address, int(dirty))
+
+    def _on_copy_back(self, cpu_index, address, data):
+        self._append(EventKind.COPY_BACK, cpu_index, -1, address, data)
+
+    def _on_invalidation(self, cpu_index, address, source_cpu_index):
+        self._append(EventKind.INVALIDATION, cpu_index, source_cpu_index, address, 0)
+
+    def flush(self):
+        self.file.write(memoryview(self.buffer)[: self.offset])
+        self.offset = 0
+
+    def close(self):
+        """Сбрасывает буфер и отписывается от шины событий."""
+        if self.file.closed:
+            return
+
+        self.flush()
+        self.file.close()
+
+        events = self.cache_controller.events
+        events.unsubscribe(EventKind.ADDRESS_BUS, self._on_address_bus)
+        events.unsubscribe(EventKind.DATA_BUS, self._on_data_bus)
+        events.unsubscribe(EventKind.SHARED_LINE, self._on_shared_line)
+        events.unsubscribe(EventKind.INTERVENTION, self._on_intervention)
+        events.unsubscribe(EventKind.COPY_BACK, self._on_copy_back)
+        events.unsubscribe(EventKind.INVALIDATION, self._on_invalidation)
+
+
+def read_event_log(
+    path: str, chunk_records=1 << 16
+) -> Iterator[Tuple[int, EventKind, int, int, int, int]]:
+    """Читает журнал по частям и возвращает записи вида
+    (tick, kind, cpu_index, source, address, data)."""
+    with open(path, "rb") as file:
+        while True:
+            chunk = file.read(RECORD.size * chunk_records)
+            if not chunk:
+                return
+            for tick, kind, cpu_index, source, address, data in RECORD.iter_unpack(
+                chunk
+            ):
+                yield tick, EventKind(kind), cpu_index, source, address, data
+
+
+def _source_name(source: int) -> str:
+    return "RAM" if source < 0 else f"CPU {source}"
+
+
+def _trace_event_name(kind, cpu_index, source, address, data) -> str:
+    if kind == EventKind.ADDRESS_BUS:
+        request = "READ MISS" if data else "INVALIDATE"
+        return f"{request} #{address} CPU {cpu_index}"
+    if kind == EventKind.DATA_BUS:
+        return f"#{address}={data} {_source_name(source)} -> CPU {cpu_index}"
+    if kind == EventKind.SHARED_LINE:
+        return f"SHARED #{address} CPU {cpu_index}"
+    if kind == EventKind.INTERVENTION:
+        intervention = "DIRTY" if data else "SHARED"
+        return f"{intervention} INTERVENTION #{address} CPU {cpu_index}"
+    if kind == EventKind.COPY_BACK:
+        return f"COPY-BACK #{address}={data} CPU {cpu_index}"
+    return f"INVALID #{address} CPU {cpu_index} BY {_source_name(source)}"
+
+
+def export_chrome_trace(log_path: str, trace_path: str):
+    """Преобразует двоичный журнал в JSON формата Chrome Trace Event. Каждый вид
+    транзакций выводится на отдельной дорожке, события одного такта идут друг
+    за другом и поровну делят этот такт, сколько бы их ни было."""
+    with open(trace_path, "w") as file:
+        file.write('{"displayTimeUnit":"ms","traceEvents":[\n')
+        separator = ""
+
+        for kind in LOGGED_EVENTS:
+            metadata = {
+                "name": "thread_name",
+                "ph": "M",
+                "pid": 0,
+                "tid": int(kind),
+                "args": {"name": kind.name},
+            }
+            file.write(separator + json.dumps(metadata))
+            separator = ",\n"
+
+        # События одного такта идут в журнале подряд. Они копятся, пока такт
+        # не сменится, чтобы знать, на сколько частей делить такт
+        tick_records = []
+        for record in read_event_log(log_path):
+            if tick_records and record[0] != tick_records[0][0]:
+                _write_tick(file, tick_records)
+                tick_records = []
+            tick_records.append(record)
+        if tick_records:
+            _write_tick(file, tick_records)
+
+        file.write("\n]}\n")
+
+
+def _write_tick(file, tick_records):
+    step = TRACE_TICK_US / len(tick_records)
+    for position, (tick, kind, cpu_index, source, address, data) in enumerate(
+        tick_records
+    ):
+        trace_event = {
+            "name": _trace_event_name(kind, cpu_index, source, address, data),
+            "cat": kind.name,
+            "ph": "X",
+            "ts": tick * TRACE_TICK_US + position * step,
+            "dur": step,
+            "pid": 0,
+            "tid": int(kind),
+            "args": {
+                "tick": tick,
+                "cpu": cpu_index,
+                "source": source,
+                "address": address,
+                "data": data,
+            },
+        }
+        file.write(",\n" + json.dumps(trace_event))
+
+
+if __name__ == "__main__":
+    export_chrome_trace(sys.argv[1], sys.argv[2])
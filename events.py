@@ -0,0 +1,108 @@
+"""Шина событий системы. Компоненты модели (RAM, Cache, CPU, CacheController)
+сообщают через неё о том, что происходит внутри, а визуализация, логгеры и прочие
+наблюдатели подписываются на интересующие их виды событий.
+
+Событие отправляется только если на него кто-то подписан, поэтому без подписчиков
+шина практически ничего не стоит."""
+
+from __future__ import annotations
+from enum import IntEnum
+from typing import Callable, List
+
+
+class EventKind(IntEnum):
+    """Виды событий. В комментариях указаны аргументы, с которыми вызывается
+    подписчик."""
+
+    RAM_READ = 0  # (address)
+    RAM_WRITE = 1  # (address, data)
+    CACHE_READ = 2  # (cpu_index, address)
+    CACHE_WRITE = 3  # (cpu_index, address)
+    CPU_READ = 4  # (cpu_index, miss), miss = -1 для чтения внутри инкремента
+    CPU_WRITE = 5  # (cpu_index, address)
+    # Транзакции на шинах. source_cpu_index = -1 означает оперативную память
+    ADDRESS_BUS = 6  # (cpu_index, address, read_miss), False при инвалидации
+    INTERVENTION = 7  # (cpu_index, address, dirty)
+    STATE_CHANGE = 8  # (cpu_index, source_cpu_indexes)
+    DATA_BUS = 9  # (cpu_index, address, data, source_cpu_index)
+    SHARED_LINE = 10  # (cpu_index, address)
+    COPY_BACK = 11  # (cpu_index, address, data)
+    INVALIDATION = 12  # (cpu_index, address, source_cpu_index)
+    # Запрос процессора полностью обработан кэш контроллером. У атомарных
+    # операций is_write равен protocol.ATOMIC_WRITE
+    OPERATION = 13  # (cpu_index, address, is_write)
+    # Запрос процессора поступил в кэш контроллер, состояние ещё не менялось
+    REQUEST = 14  # (cpu_index, address, is_write)
+
+
+class _BatchHandler:
+    """Копит аргументы событий и передаёт подписчику сразу пачку из batch_size
+    событий. Нужен для подписчиков, которым не важна мгновенная реакция."""
+
+    def __init__(self, handler: Callable, batch_size: int):
+        self.handler = handler
+        self.batch_size = batch_size
+        self.batch = []
+
+    def __call__(self, *args):
+        self.batch.append(args)
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.batch:
+            batch = self.batch
+            self.batch = []
+            self.handler(batch)
+
+
+class EventBus:
+    """Шина событий. Список подписчиков хранится отдельно для каждого вида событий,
+    а компоненты перед отправкой проверяют, что он не пуст:
+
+        if self.events.handlers[EventKind.RAM_READ]:
+            self.events.emit(EventKind.RAM_READ, address)
+
+    Так аргументы события даже не создаются, если событие никому не нужно."""
+
+    def __init__(self):
+        self.handlers: List[List[Callable]] = [[] for _ in EventKind]
+        self._batch_handlers: List[_BatchHandler] = []
+
+    def subscribe(self, kind: EventKind, handler: Callable, batch_size: int = None):
+        """Подписывает обработчик на события указанного вида. Если задан batch_size,
+        обработчик получает список кортежей аргументов, когда их накопится
+        batch_size штук, либо при вызове flush()."""
+        if batch_size is not None:
+            batch_handler = _BatchHandler(handler, batch_size)
+            self._batch_handlers.append(batch_handler)
+            self.handlers[kind].append(batch_handler)
+        else:
+            self.handlers[kind].append(handler)
+
+    def unsubscribe(self, kind: EventKind, handler: Callable):
+        """Отписывает обработчик. Накопленная для него пачка событий доставляется.
+
+        Обработчики сравниваются через ==, а не is: при каждом обращении
+        к self._on_event создаётся новый объект связанного метода."""
+        for subscribed in self.handlers[kind]:
+            if subscribed == handler or (
+                isinstance(subscribed, _BatchHandler) and subscribed.handler == handler
+            ):
+                self.handlers[kind].remove(subscribed)
+                if isinstance(subscribed, _BatchHandler):
+                    subscribed.flush()
+                    self._batch_handlers.remove(subscribed)
+                return
+
+    def emit(self, kind: EventKind, *args):
+        for handler in self.handlers[kind]:
+            handler(*args)
+
+    def has_subscribers(self, kind: EventKind) -> bool:
+        return bool(self.handlers[kind])
+
+    def flush(self):
+        """Доставляет подписчикам все накопленные пачки событий."""
+        for batch_handler in self._batch_handlers:
+            batch_handler.flush()
@@ -0,0 +1,470 @@
+"""Перебор всех порядков на шине для небольших сценариев с одновременными запросами.
+
+В приложении запросы разных процессоров выполняются в том порядке, в котором их
+поставила task_queue. Здесь для каждого процессора задаётся своя программа -
+последовательность (OP_READ или OP_WRITE, адрес), и перебираются все порядки,
+в которых запросы процессоров могут попасть на шину (порядок внутри программы
+одного процессора сохраняется). Для каждого достижимого конечного состояния
+памяти и кэшей сообщается один порядок, который к нему приводит.
+
+Шаг перебора - одна транзакция шины, то есть один запрос к кэш контроллеру.
+Инкремент (OP_WRITE) по умолчанию, как и на настоящей машине без блокировки,
+состоит из двух шагов: чтения в регистр процессора и записи значения регистра
+плюс один. Между ними могут вклиниться запросы других процессоров, так что видны
+гонки вроде потерянного обновления. Если к моменту записи строку успели
+инвалидировать, запись выполняется как чтение с намерением изменить (строка
+заново читается и сразу записывается одним шагом): промаха при записи модель
+протокола не поддерживает. С atomic_increments=True инкремент - один шаг, как
+в CPU.increment под блокировкой.
+
+Чтобы перебор оставался небольшим:
+    - уже посещённые состояния (память, кэши, программы процессоров) не
+      обходятся повторно. Такт в состояние не входит, а счётчики MRU без буфера
+      вытесненных строк заменяются рангами внутри набора: замещение зависит
+      только от их порядка;
+    - используется редукция частичного порядка (sleep sets): запросы разных
+      процессоров к разным наборам кэша меняют непересекающиеся части системы
+      и перестановочны, поэтому из их порядков перебирается только один. Буфер
+      вытесненных строк общий для всех наборов, с ним редукция отключается;
+    - верхние уровни дерева раскрываются в основном процессе, а поддеревья
+      обходятся в пуле процессов.
+
+Если check_coherence=True, после каждого шага проверяются инварианты RT-MESI
+(invariants.py). Нарушения попадают в результат вместе с порядком, который к ним
+привёл.
+
+Демо:
+python explorer.py
+"""
+
+from __future__ import annotations
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, FrozenSet, List, Sequence, Set, Tuple
+
+import settings
+from invariants import CoherenceChecker, CoherenceError
+from protocol import CPU, OP_WRITE, RAM, CacheController
+
+# Виды шагов программы процессора
+STEP_READ = "read"
+STEP_LOAD = "load"  # чтение инкремента в регистр
+STEP_STORE = "store"  # запись регистра плюс один
+STEP_INCREMENT = "increment"  # атомарный инкремент
+
+# Во сколько раз поддеревьев должно быть больше, чем процессов в пуле
+SUBTREES_PER_PROCESS = 4
+
+
+class Outcome:
+    """Конечное состояние системы после выполнения всех программ.
+
+    ram - содержимое оперативной памяти;
+    caches[cpu_index] - (состояние, адрес, данные) каждой строки кэша по строкам
+        и каналам, затем буфера вытесненных строк (None - пустая строка, у строк
+        в состоянии I адрес и данные не указываются);
+    reads[cpu_index] - значения, которые процессор получил при чтениях (OP_READ);
+    schedule - один из порядков шагов, приводящих к этому состоянию, в виде
+        (cpu_index, вид шага, адрес)."""
+
+    def __init__(self, ram, caches, reads, schedule):
+        self.ram: Tuple[int, ...] = ram
+        self.caches: Tuple[Tuple, ...] = caches
+        self.reads: Tuple[Tuple[int, ...], ...] = reads
+        self.schedule: List[Tuple[int, str, int]] = schedule
+
+    def key(self) -> Tuple:
+        return self.ram, self.caches, self.reads
+
+    def value(self, address: int) -> int:
+        """Значение адреса, которое увидит следующий читатель: из действительной
+        строки кэша, если она есть, иначе из оперативной памяти."""
+        for cache in self.caches:
+            for cache_line in cache:
+                if (
+                    cache_line is not None
+                    and cache_line[0] != "I"
+                    and cache_line[1] == address
+                ):
+                    return cache_line[2]
+        return self.ram[address]
+
+    def __repr__(self):
+        return f"Outcome(reads={self.reads}, schedule={self.schedule})"
+
+
+class ExplorationResult:
+    """Результат explore_interleavings.
+
+    outcomes - различные конечные состояния;
+    violations - пары (порядок шагов, текст CoherenceError);
+    states_count - число различных обойденных состояний (поддеревья в разных
+        процессах могут обходить одни и те же состояния, они считаются несколько
+        раз);
+    transitions_count - число выполненных шагов."""
+
+    def __init__(self):
+        self.outcomes: Dict[Tuple, Outcome] = {}
+        self.violations: List[Tuple[List, str]] = []
+        self.states_count = 0
+        self.transitions_count = 0
+
+    def merge(self, other: ExplorationResult):
+        for key, outcome in other.outcomes.items():
+            self.outcomes.setdefault(key, outcome)
+        self.violations.extend(other.violations)
+        self.states_count += other.states_count
+        self.transitions_count += other.transitions_count
+
+    def values(self, address: int) -> Set[int]:
+        """Все значения, которые адрес может иметь в конце."""
+        return {outcome.value(address) for outcome in self.outcomes.values()}
+
+    def witness(self, address: int, value: int) -> None | Outcome:
+        """Конечное состояние, в котором адрес имеет значение value."""
+        for outcome in self.outcomes.values():
+            if outcome.value(address) == value:
+                return outcome
+        return None
+
+
+def _outcome_line(cache_line) -> None | Tuple:
+    if cache_line.state is None:
+        return None
+    if cache_line.state == "I":
+        # Устаревшие адрес и данные инвалидированной строки не важны
+        return "I", None, None
+    return cache_line.state, cache_line.address, cache_line.data
+
+
+class _Node:
+    """Точка перебора: снимок системы, состояние программ и sleep set."""
+
+    __slots__ = ("snapshot", "pcs", "registers", "reads", "schedule", "sleep")
+
+    def __init__(self, snapshot, pcs, registers, reads, schedule, sleep):
+        self.snapshot: Dict = snapshot
+        self.pcs: Tuple[int, ...] = pcs
+        self.registers: Tuple = registers
+        self.reads: Tuple[Tuple[int, ...], ...] = reads
+        self.schedule: List[Tuple[int, str, int]] = schedule
+        self.sleep: FrozenSet[int] = sleep
+
+
+def compile_programs(
+    programs: Sequence[Sequence[Tuple[int, int]]], atomic_increments: bool = False
+) -> List[List[Tuple[str, int]]]:
+    """Превращает программы процессоров в последовательности шагов шины."""
+    compiled = []
+    for program in programs:
+        steps = []
+        for operation, address in program:
+            if operation != OP_WRITE:
+                steps.append((STEP_READ, address))
+            elif atomic_increments:
+                steps.append((STEP_INCREMENT, address))
+            else:
+                steps.append((STEP_LOAD, address))
+                steps.append((STEP_STORE, address))
+        compiled.append(steps)
+    return compiled
+
+
+class _Explorer:
+    """Обход в глубину в одном процессе. Состояние системы между ветвями
+    восстанавливается из снимков."""
+
+    def __init__(self, steps: List[List[Tuple[str, int]]], configuration: Dict):
+        self.steps = steps
+        self.configuration = configuration
+        self.ram = RAM(configuration["ram_size"])
+        self.cpus = [CPU(cpu_index) for cpu_index in range(len(steps))]
+        self.cache_controller = CacheController(
+            self.ram,
+            self.cpus,
+            configuration["lines_count"],
+            configuration["channels_count"],
+            victim_lines_count=configuration["victim_lines_count"],
+        )
+        self.checker = None
+        if configuration["check_coherence"]:
+            self.checker = CoherenceChecker(self.cache_controller)
+
+        self.reduction = configuration["victim_lines_count"] == 0
+        self.visited: Dict[bytes, FrozenSet[int]] = {}
+        self.result = ExplorationResult()
+
+    def root(self) -> _Node:
+        cpu_count = len(self.cpus)
+        return _Node(
+            self.cache_controller.snapshot(),
+            (0,) * cpu_count,
+            (None,) * cpu_count,
+            ((),) * cpu_count,
+            [],
+            frozenset(),
+        )
+
+    def _line_key(self, cache_line, rank) -> Tuple:
+        if cache_line.state is None:
+            return (None,)
+        if cache_line.state == "I":
+            # Адрес, данные и счётчик инвалидированной строки ни на что не влияют
+            return ("I",)
+        return cache_line.state, cache_line.address, cache_line.data, rank
+
+    def _cache_key(self, cache) -> Tuple:
+        key = []
+        for cache_set in cache.sets:
+            if self.reduction:
+                counters = sorted(
+                    {
+                        cache_line.not_used_counter
+                        for cache_line in cache_set
+                        if cache_line.state not in {None, "I"}
+                    }
+                )
+                ranks = {counter: rank for rank, counter in enumerate(counters)}
+            for cache_line in cache_set:
+                counter = cache_line.not_used_counter
+                if self.reduction:
+                    counter = ranks.get(counter)
+                key.append(self._line_key(cache_line, counter))
+        for cache_line in cache.victim_lines:
+            key.append(self._line_key(cache_line, cache_line.not_used_counter))
+        return tuple(key)
+
+    def state_hash(self, node: _Node) -> bytes:
+        """Канонический хеш текущего состояния системы и программ."""
+        key = (
+            tuple(self.ram.data),
+            tuple(self._cache_key(cpu.cache) for cpu in self.cpus),
+            node.pcs,
+            node.registers,
+            node.reads,
+        )
+        return hashlib.blake2b(repr(key).encode(), digest_size=16).digest()
+
+    def _set_index(self, cpu_index: int, pc: int) -> int:
+        address = self.steps[cpu_index][pc][1]
+        return address % self.cache_controller.cach_lines_count
+
+    def _independent(self, node: _Node, cpu_index: int, other_index: int) -> bool:
+        return self.reduction and self._set_index(
+            cpu_index, node.pcs[cpu_index]
+        ) != self._set_index(other_index, node.pcs[other_index])
+
+    def _execute(self, cpu_index: int, kind: str, address: int, register):
+        """Выполняет шаг. Возвращает новое значение регистра и прочитанное
+        значение (None, если шаг ничего не читает)."""
+        cache_controller = self.cache_controller
+        cpu = self.cpus[cpu_index]
+
+        if kind == STEP_READ:
+            return register, cache_controller._read(cpu, address)
+
+        if kind == STEP_LOAD:
+            return cache_controller._read(cpu, address), None
+
+        if kind == STEP_STORE:
+            if cpu.cache.get_cache_line_by_address(address) is None:
+                # Чтение с намерением изменить: промах при записи модель не умеет
+                cache_controller._read(cpu, address)
+            cache_controller.write(cpu, register + 1, address)
+            return None, None
+
+        data = cache_controller._read(cpu, address)
+        cache_controller.write(cpu, data + 1, address)
+        return register, None
+
+    def expand(self, node: _Node) -> List[_Node]:
+        """Раскрывает точку перебора. Возвращает потомков, которых ещё надо
+        обойти; конечные состояния и нарушения сразу попадают в result."""
+        cache_controller = self.cache_controller
+        cache_controller.restore(node.snapshot)
+
+        digest = self.state_hash(node)
+        sleep = node.sleep
+        visited_sleep = self.visited.get(digest)
+        if visited_sleep is None:
+            self.result.states_count += 1
+        elif visited_sleep <= sleep:
+            return []
+        else:
+            # Нужно обойти то, что в прошлый раз пропустили из-за sleep set
+            sleep = sleep & visited_sleep
+        self.visited[digest] = sleep
+
+        enabled = [
+            cpu_index
+            for cpu_index, pc in enumerate(node.pcs)
+            if pc < len(self.steps[cpu_index])
+        ]
+        if not enabled:
+            self._record_outcome(node)
+            return []
+
+        children = []
+        done: List[int] = []
+        for cpu_index in enabled:
+            if cpu_index in sleep:
+                done.append(cpu_index)
+                continue
+
+            kind, address = self.steps[cpu_index][node.pcs[cpu_index]]
+            schedule = node.schedule + [(cpu_index, kind, address)]
+            cache_controller.restore(node.snapshot)
+            self.result.transitions_count += 1
+            try:
+                register, data = self._execute(
+                    cpu_index, kind, address, node.registers[cpu_index]
+                )
+            except CoherenceError as error:
+                self.result.violations.append((schedule, str(error)))
+                done.append(cpu_index)
+                continue
+
+            pcs = list(node.pcs)
+            pcs[cpu_index] += 1
+            registers = list(node.registers)
+            registers[cpu_index] = register
+            reads = node.reads
+            if data is not None:
+                reads = list(reads)
+                reads[cpu_index] = reads[cpu_index] + (data,)
+                reads = tuple(reads)
+
+            # Шаги, перестановочные с выполненным, в потомке обходить не нужно
+            child_sleep = frozenset(
+                other_index
+                for other_index in list(sleep) + done
+                if pcs[other_index] < len(self.steps[other_index])
+                and self._independent(node, cpu_index, other_index)
+            )
+            children.append(
+                _Node(
+                    cache_controller.snapshot(),
+                    tuple(pcs),
+                    tuple(registers),
+                    reads,
+                    schedule,
+                    child_sleep,
+                )
+            )
+            done.append(cpu_index)
+
+        return children
+
+    def _record_outcome(self, node: _Node):
+        caches = tuple(
+            tuple(
+                _outcome_line(cache_line)
+                for cache_line in [
+                    line for channel in cpu.cache.channels for line in channel
+                ]
+                + cpu.cache.victim_lines
+            )
+            for cpu in self.cpus
+        )
+        outcome = Outcome(tuple(self.ram.data), caches, node.reads, node.schedule)
+        self.result.outcomes.setdefault(outcome.key(), outcome)
+
+    def explore(self, node: _Node) -> ExplorationResult:
+        stack = [node]
+        while stack:
+            # Потомки кладутся в обратном порядке, чтобы обход шёл как рекурсивный
+            stack.extend(reversed(self.expand(stack.pop())))
+        return self.result
+
+
+def _explore_subtrees(steps, configuration, nodes: List[_Node]) -> ExplorationResult:
+    """Часть перебора в процессе пула: обходит поддеревья с общим множеством
+    посещённых состояний."""
+    explorer = _Explorer(steps, configuration)
+    for node in nodes:
+        explorer.explore(node)
+    return explorer.result
+
+
+def explore_interleavings(
+    programs: Sequence[Sequence[Tuple[int, int]]],
+    atomic_increments: bool = False,
+    check_coherence: bool = True,
+    processes: int = 1,
+    ram_size: int = settings.RAM_SIZE,
+    lines_count: int = settings.CACH_CACHLINES_COUNT,
+    channels_count: int = settings.CACH_CHANNELS_COUNT,
+    victim_lines_count: int = 0,
+) -> ExplorationResult:
+    """Перебирает все порядки шагов программ programs[cpu_index] - списков
+    (OP_READ или OP_WRITE, адрес). При processes > 1 (или None - по числу ядер)
+    поддеревья обходятся в пуле процессов."""
+    steps = compile_programs(programs, atomic_increments)
+    configuration = {
+        "ram_size": ram_size,
+        "lines_count": lines_count,
+        "channels_count": channels_count,
+        "victim_lines_count": victim_lines_count,
+        "check_coherence": check_coherence,
+    }
+    explorer = _Explorer(steps, configuration)
+    root = explorer.root()
+    if processes == 1:
+        return explorer.explore(root)
+
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        subtrees_count = executor._max_workers * SUBTREES_PER_PROCESS
+
+        # Раскрываем дерево в ширину, пока поддеревьев не хватит на все процессы
+        frontier = [root]
+        while frontier and len(frontier) < subtrees_count:
+            next_frontier = []
+            for node in frontier:
+                next_frontier.extend(explorer.expand(node))
+            frontier = next_frontier
+
+        result = explorer.result
+        chunks = [frontier[i::subtrees_count] for i in range(subtrees_count)]
+        futures = [
+            executor.submit(_explore_subtrees, steps, configuration, chunk)
+            for chunk in chunks
+            if chunk
+        ]
+        for future in futures:
+            result.merge(future.result())
+
+    return result
+
+
+if __name__ == "__main__":
+    import time
+
+    from protocol import OP_READ
+
+    # Три процессора увеличивают общий счётчик, четвёртый читает его
+    programs = [
+        [(OP_WRITE, 0), (OP_READ, 1)],
+        [(OP_WRITE, 0), (OP_WRITE, 1)],
+        [(OP_WRITE, 0), (OP_READ, 2)],
+        [(OP_READ, 0), (OP_READ, 0)],
+    ]
+
+    for atomic_increments in (False, True):
+        for processes in (1, None):
+            start = time.perf_counter()
+            result = explore_interleavings(
+                programs, atomic_increments=atomic_increments, processes=processes
+            )
+            print(
+                f"atomic={atomic_increments} processes={processes}: "
+                f"{time.perf_counter() - start:.2f} s, "
+                f"{result.states_count} states, "
+                f"{result.transitions_count} transitions, "
+                f"{len(result.outcomes)} outcomes, "
+                f"{len(result.violations)} violations, "
+                f"final #0 in {sorted(result.values(0))}"
+            )
+
+    result = explore_interleavings(programs, processes=1)
+    lost_update = result.witness(0, min(result.values(0)))
+    print("lost update:", lost_update.schedule)
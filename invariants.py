@@ -0,0 +1,122 @@
+"""Проверка инвариантов RT-MESI во время работы модели. После каждого запроса
+процессора проверяется только тот адрес, к которому он обращался (и адрес
+вытесненной строки, если была выгрузка в память), поэтому проверка стоит столько же,
+сколько один snoop, и её можно держать включённой на длинных прогонах."""
+
+from __future__ import annotations
+import random
+from typing import List
+
+from events import EventKind
+from protocol import CacheController
+
+# Состояния, в которых у адреса может быть только один владелец
+OWNER_STATES = {"M", "E", "T", "R"}
+# Состояния, в которых данные в кэше могут отличаться от оперативной памяти
+DIRTY_STATES = {"M", "T"}
+
+
+class CoherenceError(Exception):
+    """Нарушен один из инвариантов протокола когерентности."""
+
+
+class CoherenceChecker:
+    """Подписывается на завершение запросов в кэш контроллере и проверяет
+    инварианты для затронутых адресов. При sample_rate < 1 проверяется только
+    соответствующая доля запросов, выбранных случайно."""
+
+    def __init__(
+        self, cache_controller: CacheController, sample_rate: float = 1.0, seed=None
+    ):
+        self.cache_controller = cache_controller
+        self.sample_rate = sample_rate
+        self.random = random.Random(seed)
+        self.checks_count = 0
+        self._copied_back_addresses: List[int] = []
+
+        events = cache_controller.events
+        events.subscribe(EventKind.OPERATION, self._on_operation)
+        events.subscribe(EventKind.COPY_BACK, self._on_copy_back)
+
+    def close(self):
+        events = self.cache_controller.events
+        events.unsubscribe(EventKind.OPERATION, self._on_operation)
+        events.unsubscribe(EventKind.COPY_BACK, self._on_copy_back)
+
+    def _on_copy_back(self, cpu_index, address, data):
+        self._copied_back_addresses.append(address)
+
+    def _on_operation(self, cpu_index, address, is_write):
+        copied_back_addresses = self._copied_back_addresses
+        if copied_back_addresses:
+            self._copied_back_addresses = []
+
+        if self.sample_rate < 1 and self.random.random() >= self.sample_rate:
+            return
+
+        self.check_address(address)
+        for copied_back_address in copied_back_addresses:
+            self.check_address(copied_back_address)
+
+    def check_address(self, address: int):
+        """Проверяет инварианты для одного адреса. Бросает CoherenceError."""
+        self.checks_count += 1
+        cache_controller = self.cache_controller
+        address_lines = cache_controller._get_address_lines(address)
+
+        for cpu in cache_controller.cpus:
+            copies = [
+                cache_line
+                for cache_line in cpu.cache._get_set(address)
+                if cache_line.state != "I" and cache_line.address == address
+            ]
+            if len(copies) > 1:
+                raise CoherenceError(
+                    f"#{address}: {len(copies)} valid lines in CACHE {cpu.index}"
+                )
+
+        if not address_lines:
+            return
+
+        owners = [
+            cpu_index
+            for cpu_index, cache_line in address_lines
+            if cache_line.state in OWNER_STATES
+        ]
+        if len(owners) > 1:
+            raise CoherenceError(f"#{address}: several owners {self._describe(address)}")
+
+        for cpu_index, cache_line in address_lines:
+            if cache_line.state in {"M", "E"} and len(address_lines) > 1:
+                raise CoherenceError(
+                    f"#{address}: {cache_line.state} in CACHE {cpu_index} is not "
+                    f"exclusive {self._describe(address)}"
+                )
+
+        data = address_lines[0][1].data
+        if any(cache_line.data != data for _, cache_line in address_lines):
+            raise CoherenceError(
+                f"#{address}: copies hold different data {self._describe(address)}"
+            )
+
+        dirty = any(cache_line.state in DIRTY_STATES for _, cache_line in address_lines)
+        if not dirty and cache_controller.ram.data[address] != data:
+            raise CoherenceError(
+                f"#{address}: RAM holds {cache_controller.ram.data[address]}, "
+                f"clean copies hold {data} {self._describe(address)}"
+            )
+
+    def check_all(self):
+        """Полная проверка всех адресов оперативной памяти."""
+        for address in range(self.cache_controller.ram.size):
+            self.check_address(address)
+
+    def _describe(self, address: int) -> str:
+        return str(
+            [
+                f"CACHE {cpu_index}: {cache_line.state}={cache_line.data}"
+                for cpu_index, cache_line in self.cache_controller._get_address_lines(
+                    address
+                )
+            ]
+        )
@@ -0,0 +1,273 @@
+"""Журнал отмены для шага назад и перехода к такту без повторного прогона.
+
+Для каждого запроса к кэш контроллеру (одного такта) записывается состояние до
+и после него: строки набора запрошенного адреса во всех кэшах, буферы вытесненных
+строк, изменённые ячейки памяти и сколько раз увеличивались счётчики MRU каждого
+кэша. Других изменений запрос не делает, поэтому по записи можно и откатить его,
+и пройти его снова.
+
+Каждые keyframe_interval тактов сохраняется полный снимок (ключевой кадр). При
+переходе к далёкому такту система восстанавливается из ближайшего к нему кадра,
+и применяется не больше keyframe_interval / 2 записей. Журнал хранит не больше
+max_history тактов, старые записи и кадры выбрасываются. Новый запрос после
+отката отбрасывает записи, по которым можно было пройти вперёд.
+
+Демо:
+python journal.py 100000
+"""
+
+from __future__ import annotations
+import sys
+from collections import deque
+from itertools import chain
+from operator import attrgetter
+from typing import Dict, List, Tuple
+
+import settings
+from events import EventKind
+from protocol import CacheController, CacheLine
+
+# Поля кэш строки в записи журнала
+LINE_FIELDS = ("state", "address", "data", "not_used_counter")
+
+
+class _Entry:
+    """Изменения одного запроса: состояние до него и после него."""
+
+    __slots__ = (
+        "address",
+        "before",
+        "after",
+        "increments",
+        "ram_before",
+        "ram_after",
+    )
+
+    def __init__(self, address: int, before: Tuple, cpu_count: int):
+        self.address = address
+        # Поля строк набора адреса и буфера вытесненных строк всех кэшей подряд
+        self.before: Tuple = before
+        self.after: Tuple = None
+        # Сколько раз за запрос увеличились счётчики MRU каждого кэша
+        self.increments: List[int] = [0] * cpu_count
+        # Пары (адрес, значение) до записи в порядке записи и после запроса
+        self.ram_before: List[Tuple[int, int]] = []
+        self.ram_after: List[Tuple[int, int]] = None
+
+
+# Состояние снимается при каждом запросе, поэтому поля читаются за один вызов
+_line_state = attrgetter(*LINE_FIELDS)
+
+
+class UndoJournal:
+    def __init__(
+        self,
+        cache_controller: CacheController,
+        keyframe_interval: int = settings.JOURNAL_KEYFRAME_INTERVAL,
+        max_history: int = settings.JOURNAL_MAX_HISTORY,
+    ):
+        self.cache_controller = cache_controller
+        self.keyframe_interval = keyframe_interval
+        self.max_history = max_history
+        self.clear()
+
+        events = cache_controller.events
+        events.subscribe(EventKind.REQUEST, self._on_request)
+        events.subscribe(EventKind.CACHE_READ, self._on_cache_access)
+        events.subscribe(EventKind.CACHE_WRITE, self._on_cache_access)
+        events.subscribe(EventKind.OPERATION, self._on_operation)
+        # У памяти может быть своя шина событий
+        cache_controller.ram.events.subscribe(EventKind.RAM_WRITE, self._on_ram_write)
+
+    def close(self):
+        events = self.cache_controller.events
+        events.unsubscribe(EventKind.REQUEST, self._on_request)
+        events.unsubscribe(EventKind.CACHE_READ, self._on_cache_access)
+        events.unsubscribe(EventKind.CACHE_WRITE, self._on_cache_access)
+        events.unsubscribe(EventKind.OPERATION, self._on_operation)
+        ram_events = self.cache_controller.ram.events
+        ram_events.unsubscribe(EventKind.RAM_WRITE, self._on_ram_write)
+
+    def clear(self):
+        """Забывает историю, например после сброса системы."""
+        # entries[i] переводит систему с такта first_tick + i на следующий
+        self.entries: deque[_Entry] = deque()
+        self.first_tick = self.cache_controller.tick
+        self.keyframes: Dict[int, Dict] = {}
+        self._current: _Entry = None
+
+    @property
+    def earliest_tick(self) -> int:
+        """Самый ранний такт, на который можно вернуться."""
+        return self.first_tick
+
+    @property
+    def latest_tick(self) -> int:
+        """Самый поздний такт, на который можно пройти вперёд."""
+        return self.first_tick + len(self.entries)
+
+    def _lines(self, address: int) -> List[CacheLine]:
+        """Строки, которые может изменить запрос к адресу, в порядке записи."""
+        lines = []
+        for cpu in self.cache_controller.cpus:
+            lines += cpu.cache._get_set(address)
+            lines += cpu.cache.victim_lines
+        return lines
+
+    def _capture(self, address: int) -> Tuple:
+        # Один плоский кортеж из чисел и строк: сборщик мусора перестаёт его
+        # отслеживать, и длинная история не замедляет сборку
+        return tuple(chain.from_iterable(map(_line_state, self._lines(address))))
+
+    def _on_request(self, cpu_index, address, is_write):
+        # Такт уже увеличен контроллером
+        tick = self.cache_controller.tick - 1
+        if tick != self.latest_tick:
+            # Новый запрос после отката: прежнее будущее больше не наступит
+            while self.entries and self.latest_tick > tick:
+                self.entries.pop()
+            for keyframe_tick in [t for t in self.keyframes if t > tick]:
+                del self.keyframes[keyframe_tick]
+            if tick != self.latest_tick:
+                # Такт изменили в обход журнала (например restore)
+                self.clear()
+                self.first_tick = tick
+        self._current = _Entry(
+            address, self._capture(address), len(self.cache_controller.cpus)
+        )
+
+    def _on_cache_access(self, cpu_index, address):
+        if self._current is not None:
+            self._current.increments[cpu_index] += 1
+
+    def _on_ram_write(self, address, data):
+        # Событие приходит до записи, так что в памяти ещё старое значение
+        if self._current is not None:
+            ram = self.cache_controller.ram
+            self._current.ram_before.append((address, ram.data[address]))
+
+    def _on_operation(self, cpu_index, address, is_write):
+        entry = self._current
+        if entry is None:
+            return
+        self._current = None
+
+        ram = self.cache_controller.ram
+        entry.after = self._capture(entry.address)
+        entry.ram_after = [
+            (address, ram.data[address]) for address, _ in entry.ram_before
+        ]
+        self.entries.append(entry)
+
+        tick = self.cache_controller.tick
+        if tick % self.keyframe_interval == 0:
+            self.keyframes[tick] = self.cache_controller.snapshot()
+
+        if len(self.entries) > self.max_history:
+            self.entries.popleft()
+            self.first_tick += 1
+            self.keyframes.pop(self.first_tick - 1, None)
+
+    def _apply(self, entry: _Entry, forward: bool):
+        cache_controller = self.cache_controller
+        states = entry.after if forward else entry.before
+
+        # Счётчики строк считаются по часам кэша, так что достаточно перевести их.
+        # Строки набора потом получают записанные значения уже по новым часам
+        for cpu, increments in zip(cache_controller.cpus, entry.increments):
+            if increments:
+                clock = cpu.cache._get_clock(entry.address)
+                clock[0] += increments if forward else -increments
+
+        fields = iter(states)
+        for cpu in cache_controller.cpus:
+            cache = cpu.cache
+            for cache_line in cache._get_set(entry.address) + cache.victim_lines:
+                cache_line.state = next(fields)
+                cache_line.address = next(fields)
+                cache_line.data = next(fields)
+                cache_line.not_used_counter = next(fields)
+                cache.refresh_line(cache_line)
+
+        if forward:
+            for address, value in entry.ram_after:
+                cache_controller.ram.data[address] = value
+            cache_controller.tick += 1
+        else:
+            for address, value in reversed(entry.ram_before):
+                cache_controller.ram.data[address] = value
+            cache_controller.tick -= 1
+
+    def step_back(self) -> bool:
+        """Откатывает последний запрос. Возвращает False, если откатывать нечего."""
+        position = self.cache_controller.tick - self.first_tick
+        if position <= 0:
+            return False
+        self._apply(self.entries[position - 1], forward=False)
+        return True
+
+    def step_forward(self) -> bool:
+        """Повторяет откаченный запрос. Возвращает False, если повторять нечего."""
+        position = self.cache_controller.tick - self.first_tick
+        if position >= len(self.entries):
+            return False
+        self._apply(self.entries[position], forward=True)
+        return True
+
+    def jump_to(self, tick: int) -> int:
+        """Переходит к такту tick в пределах истории и возвращает такт, на котором
+        оказалась система. Если ключевой кадр ближе к цели, чем текущий такт,
+        система сначала восстанавливается из него."""
+        cache_controller = self.cache_controller
+        tick = max(self.earliest_tick, min(tick, self.latest_tick))
+
+        if self.keyframes:
+            keyframe_tick = min(self.keyframes, key=lambda t: abs(t - tick))
+            if abs(keyframe_tick - tick) < abs(cache_controller.tick - tick):
+                cache_controller.restore(self.keyframes[keyframe_tick])
+
+        while cache_controller.tick > tick and self.step_back():
+            pass
+        while cache_controller.tick < tick and self.step_forward():
+            pass
+
+        return cache_controller.tick
+
+
+if __name__ == "__main__":
+    import random
+    import time
+
+    from protocol import CPU, RAM
+
+    operations_count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+
+    ram = RAM(64)
+    cpus = [CPU(cpu_index) for cpu_index in range(4)]
+    cache_controller = CacheController(ram, cpus, 4, 4)
+    journal = UndoJournal(cache_controller)
+
+    generator = random.Random(0)
+    snapshots = {}
+    for _ in range(operations_count):
+        cpu = cpus[generator.randrange(4)]
+        address = generator.randrange(64)
+        if generator.randrange(2):
+            cpu.increment(address)
+        else:
+            cpu.read(address)
+        if generator.random() < 0.001:
+            snapshots[cache_controller.tick] = cache_controller.snapshot()
+
+    final_snapshot = cache_controller.snapshot()
+    for tick, snapshot in sorted(snapshots.items(), reverse=True)[:5]:
+        start = time.perf_counter()
+        journal.jump_to(tick)
+        elapsed = time.perf_counter() - start
+        print(
+            f"jump to {tick}: {elapsed * 1000:.1f} ms, "
+            f"state matches: {cache_controller.snapshot() == snapshot}"
+        )
+
+    journal.jump_to(final_snapshot["tick"])
+    print("back to the end:", cache_controller.snapshot() == final_snapshot)
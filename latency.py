@@ -0,0 +1,180 @@
+"""Модель стоимости обращений к памяти. Каждый запрос к кэш контроллеру получает
+стоимость в тактах в зависимости от того, откуда пришли данные, было ли вытеснение
+грязной строки и понадобилась ли инвалидация чужих копий. По стоимостям считается
+среднее время доступа к памяти (AMAT) по процессорам и гистограмма задержек.
+
+Демо:
+python latency.py
+"""
+
+from __future__ import annotations
+from collections import Counter
+from typing import Dict, List
+
+import settings
+from events import EventKind
+from protocol import (
+    ATOMIC_WRITE,
+    SOURCE_CACHE,
+    SOURCE_DIRTY_INTERVENTION,
+    SOURCE_RAM,
+    SOURCE_SHARED_INTERVENTION,
+    CacheController,
+)
+
+
+class LatencyModel:
+    """Задержки отдельных действий в тактах. По умолчанию берутся из settings."""
+
+    def __init__(
+        self,
+        l1_hit: int = settings.LATENCY_L1_HIT,
+        shared_intervention: int = settings.LATENCY_SHARED_INTERVENTION,
+        dirty_intervention: int = settings.LATENCY_DIRTY_INTERVENTION,
+        ram_read: int = settings.LATENCY_RAM_READ,
+        copy_back: int = settings.LATENCY_COPY_BACK,
+        invalidation: int = settings.LATENCY_INVALIDATION,
+    ):
+        self.l1_hit = l1_hit
+        self.copy_back = copy_back
+        self.invalidation = invalidation
+        self.source_costs = {
+            SOURCE_CACHE: l1_hit,
+            SOURCE_SHARED_INTERVENTION: shared_intervention,
+            SOURCE_DIRTY_INTERVENTION: dirty_intervention,
+            SOURCE_RAM: ram_read,
+        }
+
+    def read_cost(self, source: int, copy_backs: int = 0) -> int:
+        """Стоимость чтения с источником данных source (SOURCE_*)."""
+        return self.source_costs[source] + copy_backs * self.copy_back
+
+    def write_cost(self, invalidation: bool) -> int:
+        """Стоимость записи в строку, которая уже есть в кэше."""
+        return self.l1_hit + (self.invalidation if invalidation else 0)
+
+    def atomic_cost(self, source: int, copy_backs: int, invalidation: bool) -> int:
+        """Стоимость атомарной операции: данные берутся как при чтении, а чужие
+        копии, если они были, инвалидируются."""
+        return self.read_cost(source, copy_backs) + (
+            self.invalidation if invalidation else 0
+        )
+
+
+class LatencyTracker:
+    """Подписывается на события кэш контроллера и назначает стоимость каждому
+    запросу на чтение или запись. last_cost - стоимость последнего запроса."""
+
+    def __init__(self, cache_controller: CacheController, model: LatencyModel = None):
+        self.cache_controller = cache_controller
+        self.model = model if model is not None else LatencyModel()
+        self.reset()
+
+        events = cache_controller.events
+        events.subscribe(EventKind.ADDRESS_BUS, self._on_address_bus)
+        events.subscribe(EventKind.COPY_BACK, self._on_copy_back)
+        events.subscribe(EventKind.INVALIDATION, self._on_invalidation)
+        events.subscribe(EventKind.OPERATION, self._on_operation)
+
+    def close(self):
+        events = self.cache_controller.events
+        events.unsubscribe(EventKind.ADDRESS_BUS, self._on_address_bus)
+        events.unsubscribe(EventKind.COPY_BACK, self._on_copy_back)
+        events.unsubscribe(EventKind.INVALIDATION, self._on_invalidation)
+        events.unsubscribe(EventKind.OPERATION, self._on_operation)
+
+    def reset(self):
+        cpu_count = len(self.cache_controller.cpus)
+        self.cycles: List[int] = [0] * cpu_count
+        self.operations: List[int] = [0] * cpu_count
+        self.histograms: List[Counter] = [Counter() for _ in range(cpu_count)]
+        self.last_cost = 0
+
+        self._copy_backs = 0
+        self._invalidation = False
+
+    def _on_address_bus(self, cpu_index, address, read_miss):
+        if not read_miss:
+            self._invalidation = True
+
+    def _on_copy_back(self, cpu_index, address, data):
+        self._copy_backs += 1
+
+    def _on_invalidation(self, cpu_index, address, source_cpu_index):
+        # Промах атомарной операции инвалидирует копии без отдельной транзакции
+        self._invalidation = True
+
+    def _on_operation(self, cpu_index, address, is_write):
+        if is_write == ATOMIC_WRITE:
+            cost = self.model.atomic_cost(
+                self.cache_controller.last_source, self._copy_backs, self._invalidation
+            )
+        elif is_write:
+            cost = self.model.write_cost(self._invalidation)
+        else:
+            cost = self.model.read_cost(
+                self.cache_controller.last_source, self._copy_backs
+            )
+        self._copy_backs = 0
+        self._invalidation = False
+
+        self.last_cost = cost
+        self.cycles[cpu_index] += cost
+        self.operations[cpu_index] += 1
+        self.histograms[cpu_index][cost] += 1
+
+    def amat(self, cpu_index: int = None) -> float:
+        """Среднее время доступа к памяти в тактах для процессора cpu_index или,
+        если он не указан, для всех процессоров вместе."""
+        if cpu_index is None:
+            cycles, operations = sum(self.cycles), sum(self.operations)
+        else:
+            cycles, operations = self.cycles[cpu_index], self.operations[cpu_index]
+        return cycles / operations if operations else 0.0
+
+    def histogram(self, cpu_index: int = None) -> Dict[int, int]:
+        """Число запросов с каждой стоимостью, по возрастанию стоимости."""
+        if cpu_index is None:
+            histogram = sum(self.histograms, Counter())
+        else:
+            histogram = self.histograms[cpu_index]
+        return dict(sorted(histogram.items()))
+
+    def report(self) -> Dict:
+        return {
+            "amat": self.amat(),
+            "cpus": [
+                {
+                    "operations": self.operations[cpu_index],
+                    "cycles": self.cycles[cpu_index],
+                    "amat": self.amat(cpu_index),
+                }
+                for cpu_index in range(len(self.cycles))
+            ],
+            "histogram": self.histogram(),
+        }
+
+
+if __name__ == "__main__":
+    import random
+
+    from protocol import CPU, RAM
+
+    ram = RAM(64)
+    cpus = [CPU(cpu_index) for cpu_index in range(4)]
+    cache_controller = CacheController(ram, cpus, 4, 4)
+    tracker = LatencyTracker(cache_controller)
+
+    for _ in range(10000):
+        cpu = random.choice(cpus)
+        address = random.randrange(8) if cpu.index == 0 else random.randrange(64)
+        if random.random() < 0.3:
+            cpu.increment(address)
+        else:
+            cpu.read(address)
+
+    for cpu_index in range(len(cpus)):
+        print(f"CPU {cpu_index}: AMAT {tracker.amat(cpu_index):.2f}")
+    print(f"All: AMAT {tracker.amat():.2f}")
+    for cost, count in tracker.histogram().items():
+        print(f"{cost:>5} {count}")
@@ -0,0 +1,303 @@
+"""Временная модель неблокирующих кэшей поверх функциональной модели протокола.
+
+CacheController выполняет запрос целиком, поэтому у процессора не бывает больше
+одного незавершённого промаха. Здесь каждый кэш получает регистры незавершённых
+промахов (MSHR): при промахе процессор не ждёт данных и продолжает выдавать
+запросы, пока есть свободный регистр. Повторный промах по адресу, для которого
+регистр уже занят, сливается с ним и завершается вместе с первым.
+
+Шина с расщеплёнными транзакциями: запрос занимает шину адреса на
+BUS_REQUEST_CYCLES тактов, ответ - шину данных на BUS_RESPONSE_CYCLES тактов,
+а между ними шина свободна для других запросов. Задержка между запросом и ответом
+берётся из LatencyModel по источнику данных.
+
+Состояния строк по-прежнему меняются сразу в момент выдачи запроса. Запросы
+каждого процессора выполняются в порядке его программы, но общий порядок
+запросов разных процессоров определяется временем на шине, а не порядком во
+входных массивах. Поэтому попадания и итоговые состояния могут отличаться от
+последовательного прогона той же трассы через run_batch.
+
+Демо:
+python nonblocking.py 20000
+"""
+
+from __future__ import annotations
+import heapq
+import sys
+from typing import Dict, List, Sequence
+
+import settings
+from events import EventKind
+from latency import LatencyModel
+from protocol import OP_WRITE, SOURCE_CACHE, CacheController
+
+
+class MSHRFile:
+    """Регистры незавершённых промахов одного кэша: адрес -> такт готовности."""
+
+    def __init__(self, entries_count: int):
+        self.entries_count = entries_count
+        self.entries: Dict[int, int] = {}
+
+    def retire(self, time: int):
+        """Освобождает регистры, данные для которых пришли к такту time."""
+        for address in [a for a, ready in self.entries.items() if ready <= time]:
+            del self.entries[address]
+
+    def is_full(self) -> bool:
+        return len(self.entries) >= self.entries_count
+
+    def earliest_ready(self) -> int:
+        return min(self.entries.values())
+
+
+class SplitTransactionBus:
+    """Шина, у которой фазы запроса и ответа занимают разные линии и не обязаны
+    идти подряд."""
+
+    def __init__(
+        self,
+        request_cycles: int = settings.BUS_REQUEST_CYCLES,
+        response_cycles: int = settings.BUS_RESPONSE_CYCLES,
+    ):
+        self.request_cycles = request_cycles
+        self.response_cycles = response_cycles
+        self.reset()
+
+    def reset(self):
+        self.address_free_at = 0
+        self.data_free_at = 0
+        self.address_busy_cycles = 0
+        self.data_busy_cycles = 0
+        self.transactions = 0
+
+    def request(self, time: int) -> int:
+        """Передаёт запрос не раньше такта time. Возвращает такт окончания."""
+        start = max(time, self.address_free_at)
+        self.address_free_at = start + self.request_cycles
+        self.address_busy_cycles += self.request_cycles
+        self.transactions += 1
+        return self.address_free_at
+
+    def respond(self, time: int) -> int:
+        """Передаёт ответ (или вытесняемые данные) не раньше такта time.
+        Возвращает такт окончания."""
+        start = max(time, self.data_free_at)
+        self.data_free_at = start + self.response_cycles
+        self.data_busy_cycles += self.response_cycles
+        return self.data_free_at
+
+
+class NonBlockingStats:
+    """Статистика прогона по процессорам.
+
+    MLP (memory-level parallelism) - среднее число одновременно незавершённых
+    промахов за время, когда был хотя бы один."""
+
+    def __init__(self, cpu_count: int):
+        self.operations = [0] * cpu_count
+        self.primary_misses = [0] * cpu_count
+        self.secondary_misses = [0] * cpu_count
+        self.stall_cycles = [0] * cpu_count
+        self.finish_time = [0] * cpu_count
+        # Суммарная длительность промахов и длина их объединения по времени
+        self.miss_cycles = [0] * cpu_count
+        self.outstanding_cycles = [0] * cpu_count
+        self.bus: SplitTransactionBus = None
+
+    def mlp(self, cpu_index: int) -> float:
+        outstanding = self.outstanding_cycles[cpu_index]
+        return self.miss_cycles[cpu_index] / outstanding if outstanding else 0.0
+
+    def cycles(self) -> int:
+        return max(self.finish_time, default=0)
+
+    def throughput(self) -> float:
+        """Запросов за такт по всей системе."""
+        cycles = self.cycles()
+        return sum(self.operations) / cycles if cycles else 0.0
+
+    def summary(self) -> Dict:
+        cycles = self.cycles()
+        return {
+            "cycles": cycles,
+            "throughput": self.throughput(),
+            "address_bus_utilization": (
+                self.bus.address_busy_cycles / cycles if cycles else 0.0
+            ),
+            "data_bus_utilization": (
+                self.bus.data_busy_cycles / cycles if cycles else 0.0
+            ),
+            "cpus": [
+                {
+                    "operations": self.operations[cpu_index],
+                    "primary_misses": self.primary_misses[cpu_index],
+                    "secondary_misses": self.secondary_misses[cpu_index],
+                    "stall_cycles": self.stall_cycles[cpu_index],
+                    "mlp": self.mlp(cpu_index),
+                }
+                for cpu_index in range(len(self.operations))
+            ],
+        }
+
+
+class NonBlockingSimulator:
+    def __init__(
+        self,
+        cache_controller: CacheController,
+        mshr_count: int = settings.MSHR_COUNT,
+        model: LatencyModel = None,
+        bus: SplitTransactionBus = None,
+    ):
+        self.cache_controller = cache_controller
+        self.model = model if model is not None else LatencyModel()
+        self.bus = bus if bus is not None else SplitTransactionBus()
+        self.mshrs = [MSHRFile(mshr_count) for _ in cache_controller.cpus]
+        self._copy_backs = 0
+
+    def close(self):
+        self.cache_controller.events.unsubscribe(
+            EventKind.COPY_BACK, self._on_copy_back
+        )
+
+    def _on_copy_back(self, cpu_index, address, data):
+        self._copy_backs += 1
+
+    def run(
+        self,
+        cpu_indexes: Sequence[int],
+        operations: Sequence[int],
+        addresses: Sequence[int],
+    ) -> NonBlockingStats:
+        """Запросы каждого процессора выдаются по порядку, не чаще одного за такт.
+        Процессоры выполняются параллельно: следующим обрабатывается запрос того
+        процессора, у которого раньше всего наступает такт выдачи. Промах при
+        занятых регистрах откладывается до освобождения регистра, и состояние
+        системы он меняет только тогда, в порядке времени с запросами других
+        процессоров."""
+        cache_controller = self.cache_controller
+        cpus = cache_controller.cpus
+        self.bus.reset()
+        stats = NonBlockingStats(len(cpus))
+        stats.bus = self.bus
+        cache_controller.events.subscribe(EventKind.COPY_BACK, self._on_copy_back)
+        try:
+            self._run(stats, cpu_indexes, operations, addresses)
+        finally:
+            self.close()
+        return stats
+
+    def _run(
+        self,
+        stats: NonBlockingStats,
+        cpu_indexes: Sequence[int],
+        operations: Sequence[int],
+        addresses: Sequence[int],
+    ):
+        cache_controller = self.cache_controller
+        cpus = cache_controller.cpus
+        model = self.model
+        bus = self.bus
+
+        programs: List[List] = [[] for _ in cpus]
+        for cpu_index, operation, address in zip(cpu_indexes, operations, addresses):
+            programs[cpu_index].append((operation, address))
+
+        positions = [0] * len(cpus)
+        covered_until = [0] * len(cpus)
+        queue = [
+            (0, cpu_index) for cpu_index in range(len(cpus)) if programs[cpu_index]
+        ]
+        heapq.heapify(queue)
+
+        while queue:
+            time, cpu_index = heapq.heappop(queue)
+            operation, address = programs[cpu_index][positions[cpu_index]]
+
+            cpu = cpus[cpu_index]
+            mshrs = self.mshrs[cpu_index]
+            mshrs.retire(time)
+
+            miss = cpu.cache.get_cache_line_by_address(address) is None
+            if miss and mshrs.is_full():
+                # Запрос выдаётся снова, когда освободится регистр
+                stall_until = mshrs.earliest_ready()
+                stats.stall_cycles[cpu_index] += stall_until - time
+                heapq.heappush(queue, (stall_until, cpu_index))
+                continue
+            positions[cpu_index] += 1
+
+            self._copy_backs = 0
+            data = cache_controller._read(cpu, address)
+            source = cache_controller.last_source
+
+            if source == SOURCE_CACHE:
+                ready = mshrs.entries.get(address)
+                if ready is not None:
+                    # Вторичный промах: ждём данные уже запрошенной строки
+                    stats.secondary_misses[cpu_index] += 1
+                    done = ready
+                else:
+                    done = time + model.l1_hit
+            else:
+                requested = bus.request(time)
+                done = bus.respond(requested + model.source_costs[source])
+                # Вытесненная грязная строка уходит в память отдельной транзакцией
+                for _ in range(self._copy_backs):
+                    bus.respond(bus.request(time))
+                mshrs.entries[address] = done
+
+                stats.primary_misses[cpu_index] += 1
+                stats.miss_cycles[cpu_index] += done - time
+                stats.outstanding_cycles[cpu_index] += max(
+                    0, done - max(time, covered_until[cpu_index])
+                )
+                covered_until[cpu_index] = max(covered_until[cpu_index], done)
+
+            if operation == OP_WRITE:
+                invalidation = _is_shared(cpu, address)
+                cache_controller.write(cpu, data + 1, address)
+                if invalidation:
+                    done = max(done, bus.request(time) + model.invalidation)
+
+            stats.operations[cpu_index] += 1
+            stats.finish_time[cpu_index] = max(stats.finish_time[cpu_index], done)
+
+            if positions[cpu_index] < len(programs[cpu_index]):
+                heapq.heappush(queue, (time + 1, cpu_index))
+
+
+def _is_shared(cpu, address: int) -> bool:
+    """Нужна ли инвалидация чужих копий для записи в строку."""
+    cache_line = cpu.cache.get_cache_line_by_address(address)
+    return cache_line is not None and cache_line.state in {"T", "R", "S"}
+
+
+if __name__ == "__main__":
+    from protocol import CPU, RAM
+
+    operations_count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+
+    # Потоковое чтение: каждый процессор последовательно читает свою область
+    ram_size = 4096
+    cpu_count = 4
+    region = ram_size // cpu_count
+    trace = [
+        (cpu_index, 0, cpu_index * region + i % region)
+        for i in range(operations_count // cpu_count)
+        for cpu_index in range(cpu_count)
+    ]
+    cpu_indexes, operations, addresses = zip(*trace)
+
+    for mshr_count in (1, 2, 4, 8):
+        ram = RAM(ram_size)
+        cpus = [CPU(cpu_index) for cpu_index in range(cpu_count)]
+        cache_controller = CacheController(ram, cpus, 4, 4)
+        simulator = NonBlockingSimulator(cache_controller, mshr_count)
+        summary = simulator.run(cpu_indexes, operations, addresses).summary()
+        mlp = summary["cpus"][0]["mlp"]
+        print(
+            f"MSHR {mshr_count}: {summary['cycles']} cycles, "
+            f"throughput {summary['throughput']:.3f}, MLP {mlp:.2f}, "
+            f"data bus {summary['data_bus_utilization']:.2f}"
+        )
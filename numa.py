@@ -0,0 +1,226 @@
+"""Режим с несколькими узлами памяти (NUMA). Память по-прежнему одна для кэш
+контроллера, но каждый адрес принадлежит узлу, а каждый процессор - своему
+домашнему узлу. Чтение памяти и вытеснение грязной строки считаются локальными,
+если узел адреса совпадает с домашним узлом процессора, и удалёнными иначе.
+
+Адреса распределяются по узлам одним из способов:
+    line        - соседние адреса на соседних узлах;
+    page        - по страницам из page_size адресов;
+    first_touch - страница попадает на домашний узел процессора, который первым
+                  промахнулся по ней.
+
+Отдельно считаются вмешательства: если данные пришли из чужого кэша, а узел адреса
+удалённый для запросившего процессора, вмешательство сэкономило удалённое чтение.
+
+Демо:
+python numa.py 100000
+"""
+
+from __future__ import annotations
+import sys
+from collections import Counter
+from typing import Dict, List, Sequence
+
+import settings
+from events import EventBus, EventKind
+from protocol import CacheController, RAM
+
+INTERLEAVE_MODES = ("line", "page", "first_touch")
+
+
+class NUMAMemory(RAM):
+    """Память из нескольких узлов. node_latencies - задержка чтения каждого узла
+    для своих процессоров, к удалённым добавляется hop_latency."""
+
+    def __init__(
+        self,
+        size: int,
+        nodes_count: int = settings.NUMA_NODES_COUNT,
+        interleave: str = settings.NUMA_INTERLEAVE,
+        page_size: int = settings.NUMA_PAGE_SIZE,
+        node_latencies: Sequence[int] = None,
+        hop_latency: int = settings.LATENCY_NUMA_HOP,
+        events: EventBus = None,
+    ):
+        if interleave not in INTERLEAVE_MODES:
+            raise ValueError(f"unknown interleave mode: {interleave}")
+
+        self.nodes_count = nodes_count
+        self.interleave = interleave
+        self.page_size = page_size
+        if node_latencies is None:
+            node_latencies = [settings.LATENCY_RAM_READ] * nodes_count
+        self.node_latencies = list(node_latencies)
+        self.hop_latency = hop_latency
+        # Узлы страниц для first_touch
+        self.page_nodes: Dict[int, int] = {}
+        super().__init__(size, events)
+
+    def reset(self):
+        super().reset()
+        self.page_nodes = {}
+
+    def node_of(self, address: int) -> int:
+        """Узел, которому принадлежит адрес (-1 для ещё не тронутой страницы
+        в режиме first_touch)."""
+        if self.interleave == "line":
+            return address % self.nodes_count
+        page = address // self.page_size
+        if self.interleave == "page":
+            return page % self.nodes_count
+        return self.page_nodes.get(page, -1)
+
+    def touch(self, address: int, node: int):
+        """Закрепляет страницу адреса за узлом, если она ещё не закреплена."""
+        if self.interleave == "first_touch":
+            self.page_nodes.setdefault(address // self.page_size, node)
+
+    def latency(self, node: int, address: int) -> int:
+        """Задержка чтения адреса процессором с домашним узлом node."""
+        address_node = self.node_of(address)
+        latency = self.node_latencies[address_node]
+        return latency if address_node == node else latency + self.hop_latency
+
+
+class NUMAStats:
+    """Подписывается на события кэш контроллера и разделяет обращения к памяти на
+    локальные и удалённые. Память контроллера должна быть NUMAMemory и отправлять
+    события в ту же шину, что и контроллер.
+
+    home_nodes[cpu_index] - домашний узел процессора, по умолчанию процессоры
+    распределяются по узлам блоками."""
+
+    def __init__(self, cache_controller: CacheController, home_nodes: List[int] = None):
+        self.cache_controller = cache_controller
+        self.memory: NUMAMemory = cache_controller.ram
+        cpu_count = len(cache_controller.cpus)
+        if home_nodes is None:
+            nodes_count = self.memory.nodes_count
+            home_nodes = [
+                cpu_index * nodes_count // cpu_count for cpu_index in range(cpu_count)
+            ]
+        self.home_nodes = list(home_nodes)
+        self.reset()
+
+        events = cache_controller.events
+        events.subscribe(EventKind.ADDRESS_BUS, self._on_address_bus)
+        events.subscribe(EventKind.RAM_READ, self._on_ram_read)
+        events.subscribe(EventKind.COPY_BACK, self._on_copy_back)
+        events.subscribe(EventKind.INTERVENTION, self._on_intervention)
+
+    def close(self):
+        events = self.cache_controller.events
+        events.unsubscribe(EventKind.ADDRESS_BUS, self._on_address_bus)
+        events.unsubscribe(EventKind.RAM_READ, self._on_ram_read)
+        events.unsubscribe(EventKind.COPY_BACK, self._on_copy_back)
+        events.unsubscribe(EventKind.INTERVENTION, self._on_intervention)
+
+    def reset(self):
+        cpu_count = len(self.home_nodes)
+        nodes_count = self.memory.nodes_count
+        self.local_reads = [0] * cpu_count
+        self.remote_reads = [0] * cpu_count
+        self.local_copy_backs = [0] * cpu_count
+        self.remote_copy_backs = [0] * cpu_count
+        self.memory_cycles = [0] * cpu_count
+        self.node_reads = [0] * nodes_count
+        self.node_writes = [0] * nodes_count
+        # Вмешательства по состоянию строки у поставщика данных (E, R, M, T)
+        self.interventions = Counter()
+        # Те из них, что заменили чтение с удалённого узла
+        self.saved_remote_reads = Counter()
+        # Процессор, чей промах сейчас обрабатывается
+        self._cpu_index = -1
+
+    def _on_address_bus(self, cpu_index, address, read_miss):
+        if read_miss:
+            self._cpu_index = cpu_index
+            self.memory.touch(address, self.home_nodes[cpu_index])
+
+    def _on_ram_read(self, address):
+        cpu_index = self._cpu_index
+        node = self.memory.node_of(address)
+        self.node_reads[node] += 1
+        if node == self.home_nodes[cpu_index]:
+            self.local_reads[cpu_index] += 1
+        else:
+            self.remote_reads[cpu_index] += 1
+        self.memory_cycles[cpu_index] += self.memory.latency(
+            self.home_nodes[cpu_index], address
+        )
+
+    def _on_copy_back(self, cpu_index, address, data):
+        node = self.memory.node_of(address)
+        self.node_writes[node] += 1
+        if node == self.home_nodes[cpu_index]:
+            self.local_copy_backs[cpu_index] += 1
+        else:
+            self.remote_copy_backs[cpu_index] += 1
+
+    def _on_intervention(self, cpu_index, address, dirty):
+        # Событие приходит до того, как строка поставщика перейдёт в S
+        owner_cache = self.cache_controller.cpus[cpu_index].cache
+        state = owner_cache.get_cache_line_by_address(address).state
+        self.interventions[state] += 1
+        if self.memory.node_of(address) != self.home_nodes[self._cpu_index]:
+            self.saved_remote_reads[state] += 1
+
+    def summary(self) -> Dict:
+        local_reads = sum(self.local_reads)
+        remote_reads = sum(self.remote_reads)
+        reads = local_reads + remote_reads
+        return {
+            "local_reads": local_reads,
+            "remote_reads": remote_reads,
+            "remote_read_ratio": remote_reads / reads if reads else 0.0,
+            "local_copy_backs": sum(self.local_copy_backs),
+            "remote_copy_backs": sum(self.remote_copy_backs),
+            "average_memory_latency": (
+                sum(self.memory_cycles) / reads if reads else 0.0
+            ),
+            "node_reads": list(self.node_reads),
+            "node_writes": list(self.node_writes),
+            "interventions": dict(self.interventions),
+            "saved_remote_reads": dict(self.saved_remote_reads),
+            # Экономия именно от владельцев R и T, ради которых они и нужны
+            "saved_by_r_t_owners": (
+                self.saved_remote_reads["R"] + self.saved_remote_reads["T"]
+            ),
+        }
+
+
+if __name__ == "__main__":
+    import random
+
+    from protocol import CPU
+
+    operations_count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    cpu_count = 4
+    ram_size = 256
+
+    # Каждый процессор в основном работает со своей четвертью памяти
+    generator = random.Random(0)
+    region = ram_size // cpu_count
+    trace = []
+    for _ in range(operations_count):
+        cpu_index = generator.randrange(cpu_count)
+        if generator.random() < 0.9:
+            address = cpu_index * region + generator.randrange(region)
+        else:
+            address = generator.randrange(ram_size)
+        trace.append((cpu_index, generator.randrange(2), address))
+    cpu_indexes, operations, addresses = zip(*trace)
+
+    for interleave in INTERLEAVE_MODES:
+        events = EventBus()
+        ram = NUMAMemory(ram_size, interleave=interleave, page_size=16, events=events)
+        cpus = [CPU(cpu_index, events=events) for cpu_index in range(cpu_count)]
+        cache_controller = CacheController(ram, cpus, 4, 4, events=events)
+        stats = NUMAStats(cache_controller)
+        cache_controller.run_batch(cpu_indexes, operations, addresses)
+        summary = stats.summary()
+        print(
+            f"{interleave:>11}: remote reads {summary['remote_read_ratio']:.2f}, "
+            f"latency {summary['average_memory_latency']:.1f}, "
+            f"saved remote reads {summary['saved_remote_reads']}"
+        )
@@ -0,0 +1,280 @@
+"""Профилирование горячих мест модели: сколько раз вызывается и сколько времени
+занимает каждая фаза обработки запроса - сам запрос, опрос чужих кэшей (snoop),
+запись в кэш, вытеснение и счётчики MRU, обработчики событий и синхронизация
+интерфейса.
+
+Profiler подменяет перечисленные методы классов (или функции модулей) обёртками
+только на время install() ... uninstall(), поэтому без профилирования модель
+работает без всяких накладных расходов. Вызовы считаются всегда, а время
+замеряется выборочно: у каждого sample_every-го вызова верхнего уровня (вызова
+обёрнутой функции не изнутри другой обёрнутой) замеряется всё дерево вложенных
+фаз целиком, остальные деревья только считаются. Время фазы оценивается по
+замеренным вызовам и числу всех вызовов.
+
+Собственное время фаз по стекам пишется в файл свёрнутых стеков (формат
+flamegraph.pl, speedscope и inferno, значения в микросекундах замеренных
+вызовов), а с cprofile=True профилировщик дополнительно ведёт cProfile и
+пишет файл pstats.
+
+Обёртка стоит около 0.3 мкс на вызов (из них около 0.2 мкс - сам лишний вызов
+функции), а запрос проходит примерно через шесть обёрнутых функций. Запрос
+обрабатывается за несколько микросекунд почти независимо от размера кэша, так
+что и на кэше 2 x 2, и на кэше 16 x 16 прогон под профилировщиком идёт на
+20-30% дольше. cProfile замедляет прогон в разы.
+
+Профилировщик рассчитан на один поток (рабочий процесс и интерфейс так и
+работают). Из нескольких потоков модель работает правильно, но стеки фаз
+перемешиваются, и времена получаются неточными.
+
+Демо:
+python profiling.py 100000 profile
+"""
+
+from __future__ import annotations
+import cProfile
+import functools
+import sys
+from collections import defaultdict
+from time import perf_counter
+from typing import Callable, Dict, List, Sequence, Tuple
+
+import settings
+from events import EventBus
+from protocol import Cache, CacheController
+
+# (класс или модуль, имя атрибута, фаза)
+Target = Tuple[object, str, str]
+
+# Горячие места модели. CPU.read и run_batch с detailed=True идут через _read,
+# поэтому оборачивается он, а не read
+CONTROLLER_TARGETS: List[Target] = [
+    (CacheController, "_read", "controller.read"),
+    (CacheController, "write", "controller.write"),
+    (CacheController, "_read_modify_write", "controller.atomic"),
+    (CacheController, "_get_address_states", "snoop.states"),
+    (CacheController, "_get_address_lines", "snoop.lines"),
+    (CacheController, "_make_address_shared", "snoop.share"),
+    (CacheController, "_get_data_from_m_or_t", "snoop.intervention_dirty"),
+    (CacheController, "_get_data_from_e_or_r", "snoop.intervention_clean"),
+    (CacheController, "_make_address_invalid", "snoop.invalidate"),
+    (Cache, "write", "cache.write"),
+    (Cache, "_choose_line_to_replace", "cache.replace"),
+    (Cache, "_cache_lines_counter_increment", "cache.mru_counters"),
+    (EventBus, "emit", "events.emit"),
+]
+
+
+class PhaseStats:
+    """Вызовы одной фазы: calls - все, sampled_calls - замеренные. total_time
+    и self_time (без вложенных фаз) - секунды замеренных вызовов."""
+
+    __slots__ = ("phase", "calls", "sampled_calls", "total_time", "self_time")
+
+    def __init__(self, phase: str):
+        self.phase = phase
+        self.calls = 0
+        self.sampled_calls = 0
+        self.total_time = 0.0
+        self.self_time = 0.0
+
+    def estimate(self, seconds: float) -> float:
+        """Переносит время замеренных вызовов на все вызовы фазы."""
+        if not self.sampled_calls:
+            return 0.0
+        return seconds * self.calls / self.sampled_calls
+
+
+class _State:
+    def __init__(self):
+        # Кадры замеряемого дерева: [путь фаз через ";", время вложенных фаз]
+        self.stack: List[List] = []
+        # Вызов верхнего уровня не замеряется, и вложенные тоже
+        self.skipping = False
+        self.roots = 0
+
+
+class Profiler:
+    def __init__(
+        self,
+        sample_every: int = settings.PROFILE_SAMPLE_EVERY,
+        cprofile: bool = False,
+    ):
+        self.sample_every = sample_every
+        self.cprofile = cProfile.Profile() if cprofile else None
+        # (владелец, имя, был ли атрибут у самого владельца, исходное значение)
+        self._originals: List[Tuple[object, str, bool, object]] = []
+        self.phases: Dict[str, PhaseStats] = {}
+        # Собственное время по путям фаз для свёрнутых стеков
+        self.folded: Dict[str, float] = defaultdict(float)
+        self._state = _State()
+
+    def reset(self):
+        """Обнуляет собранную статистику, обёртки остаются на месте."""
+        for stats in self.phases.values():
+            stats.__init__(stats.phase)
+        self.folded.clear()
+        # Обёртки держат ссылку на этот объект, поэтому он обнуляется на месте
+        self._state.__init__()
+
+    @property
+    def installed(self) -> bool:
+        return bool(self._originals)
+
+    def install(self, targets: Sequence[Target] = CONTROLLER_TARGETS):
+        """Подменяет атрибуты targets обёртками. Можно вызывать несколько раз
+        с разными целями."""
+        for owner, name, phase in targets:
+            own = name in vars(owner)
+            original = getattr(owner, name)
+            self._originals.append((owner, name, own, original))
+            setattr(owner, name, self._wrap(original, phase))
+        if self.cprofile is not None:
+            self.cprofile.enable()
+
+    def uninstall(self):
+        """Возвращает исходные атрибуты в обратном порядке подмены."""
+        if self.cprofile is not None:
+            self.cprofile.disable()
+        while self._originals:
+            owner, name, own, original = self._originals.pop()
+            if own:
+                setattr(owner, name, original)
+            else:
+                # Атрибут был унаследован, обёртка его только заслоняла
+                delattr(owner, name)
+
+    def __enter__(self):
+        if not self.installed:
+            self.install()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.uninstall()
+
+    def _wrap(self, function: Callable, phase: str) -> Callable:
+        stats = self.phases.setdefault(phase, PhaseStats(phase))
+        folded = self.folded
+        state = self._state
+        profiler = self
+
+        # Большая часть вызовов приходится на незамеряемые деревья, поэтому
+        # этот путь проверяется первым и читает только переменные замыкания
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            stats.calls += 1
+            if state.skipping:
+                return function(*args, **kwargs)
+            stack = state.stack
+            if stack:
+                key = f"{stack[-1][0]};{phase}"
+            else:
+                state.roots += 1
+                if state.roots % profiler.sample_every:
+                    state.skipping = True
+                    try:
+                        return function(*args, **kwargs)
+                    finally:
+                        state.skipping = False
+                key = phase
+
+            frame = [key, 0.0]
+            stack.append(frame)
+            start = perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                elapsed = perf_counter() - start
+                stack.pop()
+                if stack:
+                    stack[-1][1] += elapsed
+                stats.sampled_calls += 1
+                stats.total_time += elapsed
+                stats.self_time += elapsed - frame[1]
+                folded[key] += elapsed - frame[1]
+
+        return wrapper
+
+    def report(self) -> List[Dict]:
+        """Фазы по убыванию оценки собственного времени. Времена в секундах
+        оценены на все вызовы фазы."""
+        rows = []
+        for stats in self.phases.values():
+            if not stats.calls:
+                continue
+            total = stats.estimate(stats.total_time)
+            rows.append(
+                {
+                    "phase": stats.phase,
+                    "calls": stats.calls,
+                    "sampled": stats.sampled_calls,
+                    "total": total,
+                    "self": stats.estimate(stats.self_time),
+                    "per_call": total / stats.calls,
+                }
+            )
+        rows.sort(key=lambda row: row["self"], reverse=True)
+        return rows
+
+    def format_report(self) -> str:
+        lines = [
+            f"{'phase':<28}{'calls':>10}{'sampled':>10}"
+            f"{'total ms':>12}{'self ms':>12}{'us/call':>10}"
+        ]
+        for row in self.report():
+            lines.append(
+                f"{row['phase']:<28}{row['calls']:>10}{row['sampled']:>10}"
+                f"{row['total'] * 1e3:>12.1f}{row['self'] * 1e3:>12.1f}"
+                f"{row['per_call'] * 1e6:>10.2f}"
+            )
+        return "\n".join(lines)
+
+    def dump_folded(self, path: str):
+        """Пишет свёрнутые стеки: "фаза;вложенная фаза микросекунды"."""
+        with open(path, "w") as file:
+            for key, seconds in sorted(self.folded.items()):
+                microseconds = round(seconds * 1e6)
+                if microseconds:
+                    file.write(f"{key} {microseconds}\n")
+
+    def dump(self, prefix: str):
+        """Пишет отчёт в prefix.txt, стеки в prefix.folded и, если ведётся
+        cProfile, его статистику в prefix.pstats."""
+        with open(f"{prefix}.txt", "w") as file:
+            file.write(self.format_report() + "\n")
+        self.dump_folded(f"{prefix}.folded")
+        if self.cprofile is not None:
+            self.cprofile.dump_stats(f"{prefix}.pstats")
+
+
+if __name__ == "__main__":
+    import random
+
+    from protocol import CPU, RAM
+
+    operations_count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    prefix = sys.argv[2] if len(sys.argv) > 2 else None
+
+    ram = RAM(1024)
+    cpus = [CPU(cpu_index) for cpu_index in range(4)]
+    cache_controller = CacheController(ram, cpus, 16, 16, victim_lines_count=2)
+    generator = random.Random(0)
+    cpu_indexes = [generator.randrange(4) for _ in range(operations_count)]
+    operations = [generator.randrange(2) for _ in range(operations_count)]
+    addresses = [generator.randrange(1024) for _ in range(operations_count)]
+
+    start = perf_counter()
+    cache_controller.run_batch(cpu_indexes, operations, addresses, detailed=True)
+    print(f"without profiler: {perf_counter() - start:.2f} s")
+
+    cache_controller.reset()
+    with Profiler(cprofile=prefix is not None) as profiler:
+        start = perf_counter()
+        cache_controller.run_batch(
+            cpu_indexes, operations, addresses, detailed=True
+        )
+        print(f"with profiler: {perf_counter() - start:.2f} s")
+
+    print(profiler.format_report())
+    if prefix is not None:
+        profiler.dump(prefix)
+        print(f"written {prefix}.txt, {prefix}.folded, {prefix}.pstats")
@@ -2,31 +2,54 @@
 и сама логика взаимодействия всех компонентов."""
 
 from __future__ import annotations
+from array import array
+from contextlib import nullcontext
 from copy import copy
-from typing import List
+from heapq import heappop, heappush
+from typing import Callable, Dict, List, Sequence
+
+from events import EventBus, EventKind
+
+# Коды операций для пакетной обработки запросов. Запись, как и в CPU.increment,
+# означает чтение с последующей записью увеличенного на единицу значения
+OP_READ = 0
+OP_WRITE = 1
+
+# Значение is_write в событиях REQUEST и OPERATION атомарной операции: истинно,
+# как у записи, но по нему атомарную операцию можно отличить от обычной записи
+ATOMIC_WRITE = 2
+
+# Откуда были получены данные при чтении
+SOURCE_CACHE = 0
+SOURCE_RAM = 1
+SOURCE_SHARED_INTERVENTION = 2
+SOURCE_DIRTY_INTERVENTION = 3
+
+# Коды состояний кэш строки для пакетной обработки
+STATES = "IMESRT"
+STATE_CODES = {state: code for code, state in enumerate(STATES)}
+
+# Пустой контекст для CacheController.locked: в однопоточном режиме блокировок нет
+_NO_LOCK = nullcontext()
 
 
 class RAM:
-    def __init__(
-        self,
-        size,
-        read_callback=lambda: print("RAM READ"),
-        write_callback=lambda: print("RAM WRITE"),
-    ):
+    def __init__(self, size, events: EventBus = None):
         self.size = size
-        self.read_callback = read_callback
-        self.write_callback = write_callback
+        self.events = events if events is not None else EventBus()
         self.reset()
 
     def reset(self):
         self.data = [0] * self.size
 
     def read(self, address: int):
-        self.read_callback()
+        if self.events.handlers[EventKind.RAM_READ]:
+            self.events.emit(EventKind.RAM_READ, address)
         return self.data[address]
 
     def write(self, data, address: int):
-        self.write_callback()
+        if self.events.handlers[EventKind.RAM_WRITE]:
+            self.events.emit(EventKind.RAM_WRITE, address, data)
         self.data[address] = data
 
 
@@ -43,17 +66,19 @@ class CacheController:
         cpus: List[CPU],
         cach_lines_count: int,
         cach_channels_count: int,
-        read_miss_callback=lambda cpu_index: print(f"READ MISS {cpu_index}"),
-        intervention_callback=lambda cpu_index: print(f"INTERVENTION {cpu_index}"),
-        state_callback=lambda cpu_index: print(f"CHANGE STATES {cpu_index}"),
+        events: EventBus = None,
+        victim_lines_count: int = 0,
     ):
         self.ram = ram
         self.cpus: List[CPU] = []
         self.cach_lines_count = cach_lines_count
         self.cach_channels_count = cach_channels_count
-        self.read_miss_callback = read_miss_callback
-        self.intervention_callback = intervention_callback
-        self.state_callback = state_callback
+        self.victim_lines_count = victim_lines_count
+        self.events = events if events is not None else EventBus()
+        # Такт машинного времени, увеличивается на каждый запрос процессора
+        self.tick = 0
+        # Откуда были получены данные при последнем чтении
+        self.last_source = SOURCE_CACHE
 
         for cpu in cpus:
             self._add_cpu(cpu)
@@ -63,7 +88,93 @@ class CacheController:
         self.cpus.append(cpu)
         cpu.cache_controller = self
         if cpu.cache is None:
-            cpu.cache = Cache(self.cach_lines_count, self.cach_channels_count)
+            cpu.cache = Cache(
+                self.cach_lines_count,
+                self.cach_channels_count,
+                events=self.events,
+                index=cpu.index,
+                victim_lines_count=self.victim_lines_count,
+            )
+        elif cpu.cache.index is None:
+            cpu.cache.index = cpu.index
+
+    def locked(self, address: int):
+        """Контекст, внутри которого запросы к адресу не перемешиваются с запросами
+        других потоков. Здесь потоков нет, см. ConcurrentCacheController."""
+        return _NO_LOCK
+
+    def _advance_tick(self):
+        self.tick += 1
+
+    def reset(self):
+        """Возвращает систему в начальное состояние: кэши пусты, память обнулена."""
+        for cpu in self.cpus:
+            cpu.cache.reset()
+        self.ram.reset()
+        self.tick = 0
+
+    def snapshot(self) -> Dict:
+        """Снимок состояния системы из простых типов, пригодный для JSON."""
+        return {
+            "tick": self.tick,
+            "ram": list(self.ram.data),
+            "caches": [
+                [
+                    [
+                        [
+                            cache_line.state,
+                            cache_line.address,
+                            cache_line.data,
+                            cache_line.not_used_counter,
+                        ]
+                        for cache_line in channel
+                    ]
+                    for channel in cpu.cache.channels
+                ]
+                for cpu in self.cpus
+            ],
+            "victims": [
+                [
+                    [
+                        cache_line.state,
+                        cache_line.address,
+                        cache_line.data,
+                        cache_line.not_used_counter,
+                    ]
+                    for cache_line in cpu.cache.victim_lines
+                ]
+                for cpu in self.cpus
+            ],
+        }
+
+    def restore(self, snapshot: Dict):
+        """Восстанавливает состояние из снимка, сделанного snapshot()."""
+        self.tick = snapshot["tick"]
+        self.ram.data[:] = snapshot["ram"]
+
+        for cpu, cache_snapshot in zip(self.cpus, snapshot["caches"]):
+            for channel, channel_snapshot in zip(cpu.cache.channels, cache_snapshot):
+                for cache_line, line_snapshot in zip(channel, channel_snapshot):
+                    (
+                        cache_line.state,
+                        cache_line.address,
+                        cache_line.data,
+                        cache_line.not_used_counter,
+                    ) = line_snapshot
+
+        for cpu, victims_snapshot in zip(self.cpus, snapshot.get("victims", ())):
+            for cache_line, line_snapshot in zip(
+                cpu.cache.victim_lines, victims_snapshot
+            ):
+                (
+                    cache_line.state,
+                    cache_line.address,
+                    cache_line.data,
+                    cache_line.not_used_counter,
+                ) = line_snapshot
+
+        for cpu in self.cpus:
+            cpu.cache.rebuild_index()
 
     def _get_address_states(self, address: int):
         """Ищет адрес во всех кэшах и возвращает список его состояний.
@@ -74,9 +185,23 @@ class CacheController:
             cach_line = cpu.cache.get_cache_line_by_address(address)
             if cach_line is not None:
                 address_states.append(cach_line.state)
+                if self.events.handlers[EventKind.SHARED_LINE]:
+                    self.events.emit(EventKind.SHARED_LINE, cpu.index, address)
 
         return address_states
 
+    def _get_address_lines(self, address: int):
+        """Ищет адрес во всех кэшах и возвращает список пар (индекс процессора,
+        кэш строка). Состояние I игнорируется."""
+        address_lines = []
+
+        for cpu in self.cpus:
+            cach_line = cpu.cache.get_cache_line_by_address(address)
+            if cach_line is not None:
+                address_lines.append((cpu.index, cach_line))
+
+        return address_lines
+
     def _make_address_shared(self, address: int):
         """Ищет адрес во всех кэшах и присваивает ему состояние S."""
         for cpu in self.cpus:
@@ -93,7 +218,8 @@ class CacheController:
             cpu = self.cpus[i]
             cach_line = cpu.cache.get_cache_line_by_address(address)
             if cach_line is not None and cach_line.state in {"M", "T"}:
-                self.intervention_callback(cpu.index)
+                if self.events.handlers[EventKind.INTERVENTION]:
+                    self.events.emit(EventKind.INTERVENTION, cpu.index, address, True)
                 cach_line.state = "S"
                 list.append(i)
                 cach_line_returned.append(cach_line)
@@ -108,36 +234,63 @@ class CacheController:
             cpu = self.cpus[i]
             cach_line = cpu.cache.get_cache_line_by_address(address)
             if cach_line is not None and cach_line.state in {"E", "R"}:
-                self.intervention_callback(cpu.index)
+                if self.events.handlers[EventKind.INTERVENTION]:
+                    self.events.emit(EventKind.INTERVENTION, cpu.index, address, False)
                 cach_line.state = "S"
                 list.append(i)
                 cach_line_returned.append(cach_line)
         return [cach_line_returned, list]
 
-    def _make_address_invalid(self, address: int):
+    def _make_address_invalid(self, address: int, source_cpu_index: int = -1):
         """Ищет адрес во всех кэшах и устанавливает в состояниe I."""
         for cpu in self.cpus:
             cach_line = cpu.cache.get_cache_line_by_address(address)
             if cach_line is not None:
-                cach_line.state = "I"
+                cpu.cache.invalidate(cach_line)
+                if (
+                    cpu.index != source_cpu_index
+                    and self.events.handlers[EventKind.INVALIDATION]
+                ):
+                    self.events.emit(
+                        EventKind.INVALIDATION, cpu.index, address, source_cpu_index
+                    )
 
     def read(self, source_cpu: CPU, address: int) -> int:
-        """Обрабатывает запрос процессора на чтение данных по указанному адресу."""
-        b = True
+        """Обрабатывает запрос процессора на чтение данных по указанному адресу.
+        Возвращает данные и признак промаха."""
+        data = self._read(source_cpu, address)
+        return [data, self.last_source != SOURCE_CACHE]
+
+    def _read(self, source_cpu: CPU, address: int) -> int:
+        """Обрабатывает запрос на чтение и возвращает данные. Источник данных
+        сохраняется в last_source."""
+        self._advance_tick()
+        if self.events.handlers[EventKind.REQUEST]:
+            self.events.emit(EventKind.REQUEST, source_cpu.index, address, False)
 
         # READ HIT - данные есть в кэше процессора, состояния никак не меняются
         cache_line = source_cpu.cache.get_cache_line_by_address(address)
         if cache_line is not None:
-            return [source_cpu.cache.read(address), False]
+            data = source_cpu.cache.read(address)
+            self.last_source = SOURCE_CACHE
+            if self.events.handlers[EventKind.OPERATION]:
+                self.events.emit(EventKind.OPERATION, source_cpu.index, address, False)
+            return data
 
         # READ MISS
+        if self.events.handlers[EventKind.ADDRESS_BUS]:
+            self.events.emit(EventKind.ADDRESS_BUS, source_cpu.index, address, True)
+
         address_states = self._get_address_states(address)
+        data_source = -1
+
         if not address_states:
             # Данных нет в других кэшах, а значит они не являются разделяемыми
             state = "E"
 
             # Берём данные из оперативной памяти
             data = self.ram.read(address)
+            self.last_source = SOURCE_RAM
 
         elif "M" in address_states or "T" in address_states:
             # Данные есть в других кэшах
@@ -145,8 +298,11 @@ class CacheController:
 
             # Dirty Intervention
             list = self._get_data_from_m_or_t(address)
-            self.state_callback(source_cpu.index,list[1])
+            if self.events.handlers[EventKind.STATE_CHANGE]:
+                self.events.emit(EventKind.STATE_CHANGE, source_cpu.index, list[1])
             data = list[0][0].data
+            data_source = self.cpus[list[1][0]].index
+            self.last_source = SOURCE_DIRTY_INTERVENTION
 
         elif "E" in address_states or "R" in address_states:
             # Данные есть в других кэшах
@@ -154,8 +310,11 @@ class CacheController:
 
             # Shared Intervention
             list = self._get_data_from_e_or_r(address)
-            self.state_callback(source_cpu.index,list[1])
+            if self.events.handlers[EventKind.STATE_CHANGE]:
+                self.events.emit(EventKind.STATE_CHANGE, source_cpu.index, list[1])
             data = list[0][0].data
+            data_source = self.cpus[list[1][0]].index
+            self.last_source = SOURCE_SHARED_INTERVENTION
 
         elif "S" in address_states:
             # Данные есть в других кэшах только в состоянии S
@@ -163,21 +322,43 @@ class CacheController:
 
             # Берём данные из оперативной памяти
             data = self.ram.read(address)
+            self.last_source = SOURCE_RAM
 
-        self.read_miss_callback(source_cpu.index,b)
+        if self.events.handlers[EventKind.DATA_BUS]:
+            self.events.emit(
+                EventKind.DATA_BUS, source_cpu.index, address, data, data_source
+            )
 
         # Записываем в кэш процессора
+        self._fill(source_cpu, state, data, address)
+
+        if self.events.handlers[EventKind.OPERATION]:
+            self.events.emit(EventKind.OPERATION, source_cpu.index, address, False)
+
+        # Возвращаем запрашиваемые данные процессору
+        return data
+
+    def _fill(self, source_cpu: CPU, state: str, data, address: int):
+        """Записывает строку в кэш процессора. Если при этом замещается строка
+        в состоянии M или T, её данные выгружаются в память."""
         replaced_cache_line = source_cpu.cache.write(state, data, address)
 
         if replaced_cache_line is not None and replaced_cache_line.state in {"T", "M"}:
             # Copy-Back
+            if self.events.handlers[EventKind.COPY_BACK]:
+                self.events.emit(
+                    EventKind.COPY_BACK,
+                    source_cpu.index,
+                    replaced_cache_line.address,
+                    replaced_cache_line.data,
+                )
             self.ram.write(replaced_cache_line.data, replaced_cache_line.address)
 
-        # Возвращаем запрашиваемые данные процессору
-        return [data, True]
-
     def write(self, source_cpu: CPU, data, address: int):
         """Обрабатывает запрос процессора на запись данных по указанному адресу."""
+        self._advance_tick()
+        if self.events.handlers[EventKind.REQUEST]:
+            self.events.emit(EventKind.REQUEST, source_cpu.index, address, True)
 
         # WRITE HIT - данные есть в кэше процессора
         cach_line = source_cpu.cache.get_cache_line_by_address(address)
@@ -187,10 +368,15 @@ class CacheController:
                 source_cpu.cache.write("M", data, address)
 
             elif cach_line.state in {"T", "R", "S"}:
-                self._make_address_invalid(address)
-                self.read_miss_callback(source_cpu.index, 0)
+                if self.events.handlers[EventKind.ADDRESS_BUS]:
+                    self.events.emit(
+                        EventKind.ADDRESS_BUS, source_cpu.index, address, False
+                    )
+                self._make_address_invalid(address, source_cpu.index)
                 source_cpu.cache.write("M", data, address)
 
+            if self.events.handlers[EventKind.OPERATION]:
+                self.events.emit(EventKind.OPERATION, source_cpu.index, address, True)
             return
 
         # WRITE MISS
@@ -201,121 +387,654 @@ class CacheController:
 
         raise NotImplementedError
 
+    def fetch_and_add(self, source_cpu: CPU, address: int, value: int = 1) -> int:
+        """Атомарно прибавляет value. Возвращает старое значение."""
+        return self._read_modify_write(source_cpu, address, lambda data: data + value)
+
+    def compare_and_swap(
+        self, source_cpu: CPU, address: int, expected: int, data: int
+    ) -> int:
+        """Атомарно записывает data, если по адресу лежит expected. Возвращает
+        старое значение: обмен удался, если оно равно expected. Как и lock cmpxchg,
+        строка забирается в исключительное владение даже при неудаче."""
+        return self._read_modify_write(
+            source_cpu, address, lambda old: data if old == expected else old
+        )
+
+    def test_and_set(self, source_cpu: CPU, address: int) -> int:
+        """Атомарно записывает 1. Возвращает старое значение."""
+        return self._read_modify_write(source_cpu, address, lambda old: 1)
+
+    def exchange(self, source_cpu: CPU, address: int, data: int) -> int:
+        """Атомарно записывает data. Возвращает старое значение."""
+        return self._read_modify_write(source_cpu, address, lambda old: data)
+
+    def _read_modify_write(
+        self, source_cpu: CPU, address: int, modify: Callable[[int], int]
+    ) -> int:
+        """Атомарная операция одной заблокированной транзакцией шины. Строка
+        забирается в исключительное владение: при промахе данные берутся так же,
+        как при чтении, а все остальные копии инвалидируются. В кэш процессора
+        записывается modify(старое значение) в состоянии M. Возвращает старое
+        значение, источник данных сохраняется в last_source."""
+        self._advance_tick()
+        if self.events.handlers[EventKind.REQUEST]:
+            self.events.emit(
+                EventKind.REQUEST, source_cpu.index, address, ATOMIC_WRITE
+            )
 
-class CPU:
-    def __init__(
+        cache_line = source_cpu.cache.get_cache_line_by_address(address)
+
+        if cache_line is not None:
+            # HIT - в состояниях M и E шина не нужна
+            data = cache_line.data
+            self.last_source = SOURCE_CACHE
+            if cache_line.state in {"T", "R", "S"}:
+                if self.events.handlers[EventKind.ADDRESS_BUS]:
+                    self.events.emit(
+                        EventKind.ADDRESS_BUS, source_cpu.index, address, False
+                    )
+                self._make_address_invalid(address, source_cpu.index)
+            source_cpu.cache.write("M", modify(data), address)
+
+        else:
+            # MISS - чтение с намерением изменить
+            if self.events.handlers[EventKind.ADDRESS_BUS]:
+                self.events.emit(EventKind.ADDRESS_BUS, source_cpu.index, address, True)
+
+            data_source = -1
+            owners = [
+                (cpu_index, cache_line)
+                for cpu_index, cache_line in self._get_address_lines(address)
+                if cache_line.state in {"M", "T", "E", "R"}
+            ]
+            if owners:
+                # Владелец один, его данные актуальны
+                data_source, cache_line = owners[0]
+                dirty = cache_line.state in {"M", "T"}
+                if self.events.handlers[EventKind.INTERVENTION]:
+                    self.events.emit(
+                        EventKind.INTERVENTION, data_source, address, dirty
+                    )
+                data = cache_line.data
+                self.last_source = (
+                    SOURCE_DIRTY_INTERVENTION if dirty else SOURCE_SHARED_INTERVENTION
+                )
+            else:
+                data = self.ram.read(address)
+                self.last_source = SOURCE_RAM
+
+            if self.events.handlers[EventKind.DATA_BUS]:
+                self.events.emit(
+                    EventKind.DATA_BUS, source_cpu.index, address, data, data_source
+                )
+
+            # Грязные данные не выгружаются: ответственность за них переходит
+            # к новой строке в состоянии M
+            self._make_address_invalid(address, source_cpu.index)
+            self._fill(source_cpu, "M", modify(data), address)
+
+        if self.events.handlers[EventKind.OPERATION]:
+            self.events.emit(
+                EventKind.OPERATION, source_cpu.index, address, ATOMIC_WRITE
+            )
+
+        return data
+
+    def run_batch(
         self,
-        index,
-        read_callback=lambda: print("CPU READ"),
-        write_callback=lambda: print("CPU WRITE"),
-    ):
+        cpu_indexes: Sequence[int],
+        operations: Sequence[int],
+        addresses: Sequence[int],
+        detailed: bool = False,
+    ) -> BatchResult:
+        """Пакетно обрабатывает запросы: i-й запрос - операция operations[i]
+        (OP_READ или OP_WRITE) процессора cpu_indexes[i] по адресу addresses[i].
+        Подходят любые последовательности целых чисел, например array.array или
+        одномерные массивы NumPy. Запросы идут мимо CPU, поэтому события CPU_READ
+        и CPU_WRITE не отправляются, а результаты пишутся в заранее выделенные
+        массивы. Длины последовательностей должны совпадать, иначе бросается
+        ValueError.
+
+        Если событий никто не слушает и у кэшей нет буфера вытесненных строк,
+        запросы обрабатываются отдельным циклом (см. _run_quietly), который не
+        создаёт на запрос ни списков, ни кортежей, ни копий строк. Иначе, а также
+        с detailed=True (например, чтобы профилировать фазы запроса), каждый запрос
+        проходит через _read и write, как обычный. Результат в обоих случаях один
+        и тот же."""
+        count = len(addresses)
+        if len(cpu_indexes) != count or len(operations) != count:
+            raise ValueError(
+                f"cpu_indexes, operations and addresses must have the same length, "
+                f"got {len(cpu_indexes)}, {len(operations)} and {count}"
+            )
+        result = BatchResult(count)
+        if not detailed and not self._is_observed():
+            self._run_quietly(cpu_indexes, operations, addresses, result)
+            return result
+
+        hits = result.hits
+        sources = result.sources
+        states = result.states
+        cpus = self.cpus
+
+        for i, (cpu_index, operation, address) in enumerate(
+            zip(cpu_indexes, operations, addresses)
+        ):
+            cpu = cpus[cpu_index]
+            with self.locked(address):
+                data = self._read(cpu, address)
+                source = self.last_source
+
+                if operation == OP_WRITE:
+                    self.write(cpu, data + 1, address)
+
+                state = cpu.cache.get_cache_line_by_address(address).state
+
+            hits[i] = source == SOURCE_CACHE
+            sources[i] = source
+            states[i] = STATE_CODES[state]
+
+        return result
+
+    def _is_observed(self) -> bool:
+        """Нужен ли запросам полный путь: есть подписчики на события модели или
+        буфер вытесненных строк."""
+        buses = [self.events, self.ram.events]
+        for cpu in self.cpus:
+            if cpu.cache.victim_lines:
+                return True
+            buses.append(cpu.cache.events)
+        return any(any(bus.handlers) for bus in buses)
+
+    def _run_quietly(
+        self,
+        cpu_indexes: Sequence[int],
+        operations: Sequence[int],
+        addresses: Sequence[int],
+        result: BatchResult = None,
+        until_tick: int = None,
+    ) -> int:
+        """Обрабатывает запросы так же, как _read и write, но без событий и только
+        для кэшей без буфера вытесненных строк. Строки ищутся по индексу адресов
+        кэшей, входные последовательности индексируются напрямую, а признак
+        попадания, источник и состояние пишутся сразу в массивы result (если он
+        задан). Остановка по until_tick - как в fast_forward. Возвращает число
+        обработанных запросов."""
+        caches = [cpu.cache for cpu in self.cpus]
+        ram_data = self.ram.data
+        locked = self.locked
+        advance_tick = self._advance_tick
+        if result is not None:
+            hits = result.hits
+            sources = result.sources
+            states = result.states
+
+        def fill(cache: Cache, state: str, data, address: int) -> CacheLine:
+            """Cache.write для адреса, которого нет в кэше, вместе с copy-back."""
+            cache._cache_lines_counter_increment(address)
+            cache_line = cache._choose_same_or_empty_line(address)
+            if cache_line is None:
+                cache_line = cache._choose_line_to_replace(address)
+                if cache_line.state in {"T", "M"}:
+                    ram_data[cache_line.address] = cache_line.data
+            cache_line.state = state
+            cache_line.write(address, data)
+            cache._lines_by_address[address] = cache_line
+            cache._mark_used(cache_line)
+            return cache_line
+
+        processed = 0
+        source = self.last_source
+        for i in range(len(addresses)):
+            if until_tick is not None and self.tick >= until_tick:
+                break
+            address = addresses[i]
+            cache = caches[cpu_indexes[i]]
+
+            with locked(address):
+                # Чтение
+                advance_tick()
+                cache_line = cache.get_cache_line_by_address(address)
+                if cache_line is not None:
+                    cache._cache_lines_counter_increment(address)
+                    cache._mark_used(cache_line)
+                    data = cache_line.read()
+                    source = SOURCE_CACHE
+                else:
+                    # Первые владельцы данных в порядке процессоров, как в _read
+                    dirty_line = None
+                    clean_line = None
+                    shared = False
+                    for other_cache in caches:
+                        other_line = other_cache.get_cache_line_by_address(address)
+                        if other_line is None:
+                            continue
+                        if other_line.state in {"M", "T"}:
+                            if dirty_line is None:
+                                dirty_line = other_line
+                        elif other_line.state in {"E", "R"}:
+                            if clean_line is None:
+                                clean_line = other_line
+                        else:
+                            shared = True
+
+                    if dirty_line is not None:
+                        # Dirty Intervention
+                        state = "T"
+                        data = dirty_line.data
+                        source = SOURCE_DIRTY_INTERVENTION
+                        for other_cache in caches:
+                            other_line = other_cache.get_cache_line_by_address(address)
+                            if other_line is None:
+                                continue
+                            if other_line.state in {"M", "T"}:
+                                other_line.state = "S"
+                    elif clean_line is not None:
+                        # Shared Intervention
+                        state = "R"
+                        data = clean_line.data
+                        source = SOURCE_SHARED_INTERVENTION
+                        for other_cache in caches:
+                            other_line = other_cache.get_cache_line_by_address(address)
+                            if other_line is None:
+                                continue
+                            if other_line.state in {"E", "R"}:
+                                other_line.state = "S"
+                    else:
+                        state = "R" if shared else "E"
+                        data = ram_data[address]
+                        source = SOURCE_RAM
+                    cache_line = fill(cache, state, data, address)
+
+                if operations[i] == OP_WRITE:
+                    # Запись увеличенного значения
+                    advance_tick()
+                    if cache_line.state in {"M", "E"}:
+                        cache._cache_lines_counter_increment(address)
+                        cache_line.state = "M"
+                        cache_line.write(address, data + 1)
+                        cache._mark_used(cache_line)
+                    else:
+                        # Инвалидация всех копий, включая свою, и запись в первую
+                        # свободную строку набора, как в write
+                        for other_cache in caches:
+                            other_line = other_cache.get_cache_line_by_address(address)
+                            if other_line is not None:
+                                other_cache.invalidate(other_line)
+                        cache_line = fill(cache, "M", data + 1, address)
+
+            if result is not None:
+                hits[i] = source == SOURCE_CACHE
+                sources[i] = source
+                states[i] = STATE_CODES[cache_line.state]
+            processed += 1
+
+        if result is not None:
+            self.last_source = source
+        return processed
+
+    def fast_forward(
+        self,
+        cpu_indexes: Sequence[int],
+        operations: Sequence[int],
+        addresses: Sequence[int],
+        until_tick: int = None,
+    ) -> int:
+        """Функциональный режим для прогрева кэшей: запросы меняют только теги,
+        состояния, данные, счётчики MRU и оперативную память, а события,
+        статистика и last_source не трогаются. Итоговое состояние (и такт) то же,
+        что после run_batch с теми же запросами.
+
+        Если задан until_tick, обработка останавливается, как только такт дойдёт
+        до until_tick (инкремент - два такта и не разрывается, поэтому такт может
+        оказаться на единицу больше). Возвращает число обработанных запросов:
+        с этого места можно продолжить подробный прогон.
+
+        С буфером вытесненных строк быстрого пути нет, и запросы обрабатываются
+        обычным образом."""
+        if any(cpu.cache.victim_lines for cpu in self.cpus):
+            return self._fast_forward_detailed(
+                cpu_indexes, operations, addresses, until_tick
+            )
+        return self._run_quietly(
+            cpu_indexes, operations, addresses, until_tick=until_tick
+        )
+
+    def _fast_forward_detailed(
+        self,
+        cpu_indexes: Sequence[int],
+        operations: Sequence[int],
+        addresses: Sequence[int],
+        until_tick: int = None,
+    ) -> int:
+        processed = 0
+        cpus = self.cpus
+        for cpu_index, operation, address in zip(cpu_indexes, operations, addresses):
+            if until_tick is not None and self.tick >= until_tick:
+                break
+            processed += 1
+            cpu = cpus[cpu_index]
+            with self.locked(address):
+                data = self._read(cpu, address)
+                if operation == OP_WRITE:
+                    self.write(cpu, data + 1, address)
+        return processed
+
+
+class BatchResult:
+    """Результат CacheController.run_batch. Для каждого запроса хранит признак
+    попадания, источник данных (SOURCE_*) и состояние строки после запроса
+    (индекс в STATES). Массивы поддерживают buffer protocol, так что их можно
+    без копирования обернуть в numpy.frombuffer."""
+
+    def __init__(self, count: int):
+        self.hits = array("b", bytes(count))
+        self.sources = array("b", bytes(count))
+        self.states = array("b", bytes(count))
+
+    def __len__(self):
+        return len(self.hits)
+
+    def summary(self) -> Dict[str, int]:
+        """Сводная статистика по пакету."""
+        return {
+            "operations": len(self.hits),
+            "hits": self.hits.count(1),
+            "misses": self.hits.count(0),
+            "ram": self.sources.count(SOURCE_RAM),
+            "shared_interventions": self.sources.count(SOURCE_SHARED_INTERVENTION),
+            "dirty_interventions": self.sources.count(SOURCE_DIRTY_INTERVENTION),
+        }
+
+
+class CPU:
+    def __init__(self, index, events: EventBus = None):
         self.index = index
-        self.read_callback = read_callback
-        self.write_callback = write_callback
+        self.events = events if events is not None else EventBus()
         self.cache_controller: CacheController = None
         self.cache: Cache = None
 
     def read(self, address: int, from_increment: bool = False) -> int:
         algoritm = self.cache_controller.read(self, address)
-        if from_increment:
-            self.read_callback(-1)
-        else:
-            self.read_callback(algoritm[1])
+        if self.events.handlers[EventKind.CPU_READ]:
+            if from_increment:
+                self.events.emit(EventKind.CPU_READ, self.index, -1)
+            else:
+                self.events.emit(EventKind.CPU_READ, self.index, algoritm[1])
         return algoritm[0]
 
     def write(self, data, address: int):
-        #self.write_callback()
         self.cache_controller.write(self, data, address)
 
     def increment(self, address):
-        self.write_callback()
-        data = self.read(address, from_increment=True)
-        data = data + 1
-        self.write(data, address)
+        if self.events.handlers[EventKind.CPU_WRITE]:
+            self.events.emit(EventKind.CPU_WRITE, self.index, address)
+        # Чтение и запись инкремента не должны разделяться запросами других потоков
+        with self.cache_controller.locked(address):
+            data = self.read(address, from_increment=True)
+            data = data + 1
+            self.write(data, address)
+
+    # Атомарные операции - одна транзакция шины, возвращают старое значение
+
+    def fetch_and_add(self, address: int, value: int = 1) -> int:
+        if self.events.handlers[EventKind.CPU_WRITE]:
+            self.events.emit(EventKind.CPU_WRITE, self.index, address)
+        return self.cache_controller.fetch_and_add(self, address, value)
+
+    def compare_and_swap(self, address: int, expected: int, data: int) -> int:
+        if self.events.handlers[EventKind.CPU_WRITE]:
+            self.events.emit(EventKind.CPU_WRITE, self.index, address)
+        return self.cache_controller.compare_and_swap(self, address, expected, data)
+
+    def test_and_set(self, address: int) -> int:
+        if self.events.handlers[EventKind.CPU_WRITE]:
+            self.events.emit(EventKind.CPU_WRITE, self.index, address)
+        return self.cache_controller.test_and_set(self, address)
+
+    def exchange(self, address: int, data: int) -> int:
+        if self.events.handlers[EventKind.CPU_WRITE]:
+            self.events.emit(EventKind.CPU_WRITE, self.index, address)
+        return self.cache_controller.exchange(self, address, data)
 
 
 class CacheLine:
     """Кэш строка - содержит состояние (одно из R, T, M, E, S или I), данные, адрес
     данных в оперативной памяти, а также счётчик, который показывает, как давно было
-    последний запрос на чтение или запись к этой кэш строке."""
+    последний запрос на чтение или запись к этой кэш строке.
+
+    Сам счётчик не хранится: clock - часы кэша (список из одного числа, общий для
+    строк), которые идут при каждом обращении к кэшу, а last_used - их показание
+    при последнем обращении к строке. Поэтому обращение к одной строке не трогает
+    остальные."""
 
-    def __init__(self):
+    def __init__(self, clock: List[int] = None):
         self.state: None | str = None
         self.data: None | int = None
         self.address: None | int = None
-        self.not_used_counter = 0
+        self.clock = clock if clock is not None else [0]
+        self.last_used = self.clock[0]
 
-    def increment_counter(self):
-        """Увеличивает счётчик. Функция должна вызываться, когда поступает запрос
-        на чтение или запись к другим кэш строкам того же кэша."""
-        self.not_used_counter += 1
+    @property
+    def not_used_counter(self) -> int:
+        return self.clock[0] - self.last_used
+
+    @not_used_counter.setter
+    def not_used_counter(self, counter: int):
+        self.last_used = self.clock[0] - counter
 
     def read(self) -> None | int:
         """Получает данные из кэш строки и обнуляет счётчик."""
-        self.not_used_counter = 0
+        self.last_used = self.clock[0]
         return self.data
 
     def write(self, address, data):
         """Записывает данные в кэш строку и обнуляет счётчик."""
-        self.not_used_counter = 0
+        self.last_used = self.clock[0]
         self.address = address
         self.data = data
 
 
 class Cache:
-    """Наборно-ассоциативный кэш процессора. В нём реализована политика замещения MRU."""
+    """Наборно-ассоциативный кэш процессора. В нём реализована политика замещения MRU.
+
+    Строки хранятся по каналам: channels[channel_index][line_index]. Набор адреса -
+    строки с номером address % lines_count во всех каналах (sets), так что наборов
+    lines_count, а ассоциативность равна channels_count.
+
+    Если victim_lines_count больше нуля, у кэша есть небольшой полностью
+    ассоциативный буфер вытесненных строк. Вытесненная строка попадает туда вместе
+    с состоянием, видна другим кэшам при опросе и при обращении к ней возвращается
+    в свой набор без обращения к шине. Из кэша окончательно уходит только строка,
+    вытесненная из буфера.
+
+    Чтобы поиск не зависел от ассоциативности, кэш ведёт индекс адрес -> строка
+    (в наборах и буфере) и для каждого набора кучу номеров свободных строк.
+    Индекс может ссылаться на строку, которая с тех пор получила другой адрес или
+    стала I, поэтому найденная строка проверяется, но действительная строка в нём
+    есть всегда. Свободная строка в куче тоже есть всегда, лишние номера
+    выбрасываются при поиске, а повторно один номер в кучу не попадает. Счётчики
+    MRU при обращении тоже не обходятся: идут только часы кэша (см. CacheLine),
+    а для каждого набора запоминается строка, к которой обращались последней, -
+    её MRU и замещает. Кэш сам поддерживает всё это при заполнении, вытеснении
+    и инвалидации (invalidate); после того как строки меняют в обход кэша, нужно
+    вызвать refresh_line или rebuild_index."""
 
     def __init__(
         self,
         lines_count: int,
         channels_count: int,
-        read_callback=lambda: print("CACHE READ"),
-        write_callback=lambda: print("CACHE WRITE"),
+        events: EventBus = None,
+        index: int = None,
+        victim_lines_count: int = 0,
     ):
         self.lines_count = lines_count
         self.channels_count = channels_count
-        self.read_callback = read_callback
-        self.write_callback = write_callback
+        self.events = events if events is not None else EventBus()
+        self.index = index
+        self.victim_lines_count = victim_lines_count
+        self._set_local_counters = False
 
         self.reset()
 
+    @property
+    def set_local_counters(self) -> bool:
+        """Если True, у каждого набора свои часы, и счётчики MRU увеличиваются
+        только в наборе запрошенного адреса. Выбор строки для замещения от этого
+        не меняется: порядок строк внутри набора тот же, зато разные наборы не
+        трогают общие данные."""
+        return self._set_local_counters
+
+    @set_local_counters.setter
+    def set_local_counters(self, set_local_counters: bool):
+        counters = [
+            [cache_line.not_used_counter for cache_line in cache_set]
+            for cache_set in self.sets
+        ]
+        self._set_local_counters = set_local_counters
+        self._clocks = self._make_clocks()
+        for cache_set, clock, set_counters in zip(self.sets, self._clocks, counters):
+            for cache_line, counter in zip(cache_set, set_counters):
+                cache_line.clock = clock
+                cache_line.not_used_counter = counter
+
+    def _make_clocks(self) -> List[List[int]]:
+        """Часы каждого набора. Без set_local_counters это одни часы на весь кэш."""
+        if self._set_local_counters:
+            return [[0] for _ in range(self.lines_count)]
+        return [[0]] * self.lines_count
+
     def reset(self):
+        self._clocks = self._make_clocks()
         self.channels = [
-            [CacheLine() for _ in range(self.lines_count)]
+            [CacheLine(clock) for clock in self._clocks]
             for _ in range(self.channels_count)
         ]
+        self.sets = [
+            [channel[line_index] for channel in self.channels]
+            for line_index in range(self.lines_count)
+        ]
+        # Буфер вытесненных строк, от старых к новым
+        self.victim_lines = [CacheLine() for _ in range(self.victim_lines_count)]
+        self.victim_hits = 0
+        self.victim_inserts = 0
+        self.victim_evictions = 0
+
+        # Строки наборов не переставляются, меняется только их содержимое
+        self._positions: Dict[CacheLine, tuple] = {
+            cache_line: (set_index, way)
+            for set_index, cache_set in enumerate(self.sets)
+            for way, cache_line in enumerate(cache_set)
+        }
+        self.rebuild_index()
+
+    def rebuild_index(self):
+        """Заново строит индекс адресов и списки свободных строк по содержимому
+        строк, например после восстановления снимка."""
+        self._lines_by_address: Dict[int, CacheLine] = {}
+        self._free_ways: List[List[int]] = []
+        # Какие номера сейчас лежат в куче набора
+        self._queued_ways: List[set] = []
+        # Номер строки набора, к которой обращались последней, None - неизвестен
+        self._mru_ways: List[None | int] = [None] * self.lines_count
+        for cache_set in self.sets:
+            free_ways = []
+            for way, cache_line in enumerate(cache_set):
+                if cache_line.data is None or cache_line.state == "I":
+                    free_ways.append(way)
+                else:
+                    self._lines_by_address[cache_line.address] = cache_line
+            # Номера идут по возрастанию, так что это уже куча
+            self._free_ways.append(free_ways)
+            self._queued_ways.append(set(free_ways))
+        for cache_line in self.victim_lines:
+            if cache_line.state not in {None, "I"}:
+                self._lines_by_address[cache_line.address] = cache_line
+
+    def refresh_line(self, cache_line: CacheLine):
+        """Учитывает в индексе строку, содержимое которой изменили напрямую."""
+        position = self._positions.get(cache_line)
+        if position is not None:
+            # Отметку строки могли поменять, последняя строка набора неизвестна
+            self._mru_ways[position[0]] = None
+        if cache_line.data is None or cache_line.state == "I":
+            self._queue_free_line(cache_line)
+        else:
+            self._lines_by_address[cache_line.address] = cache_line
+
+    def invalidate(self, cache_line: CacheLine):
+        """Переводит строку этого кэша в состояние I."""
+        if cache_line.state == "I":
+            return
+        cache_line.state = "I"
+        self._queue_free_line(cache_line)
 
-    def _cache_lines_counter_increment(self):
-        for channel in self.channels:
-            for cache_line in channel:
-                cache_line.increment_counter()
+    def _queue_free_line(self, cache_line: CacheLine):
+        """Кладёт номер освободившейся строки набора в кучу, если его там нет."""
+        position = self._positions.get(cache_line)
+        if position is None:
+            return
+        set_index, way = position
+        queued_ways = self._queued_ways[set_index]
+        if way not in queued_ways:
+            queued_ways.add(way)
+            heappush(self._free_ways[set_index], way)
+
+    def _cache_lines_counter_increment(self, address: int):
+        """Увеличивает счётчики MRU всех строк кэша (при set_local_counters - строк
+        набора), то есть переводит часы."""
+        self._clocks[address % self.lines_count][0] += 1
+
+    def _get_clock(self, address: int) -> List[int]:
+        """Часы набора, в который может попасть указанный адрес."""
+        return self._clocks[address % self.lines_count]
+
+    def _mark_used(self, cache_line: CacheLine):
+        """Запоминает строку набора как последнюю, к которой обращались."""
+        set_index, way = self._positions[cache_line]
+        self._mru_ways[set_index] = way
+
+    def _get_set(self, address: int) -> List[CacheLine]:
+        """Возвращает кэш строки, в которые может попасть указанный адрес."""
+        return self.sets[address % self.lines_count]
 
     def _choose_same_or_empty_line(self, address: int) -> None | CacheLine:
         """Возвращает кэш строку с указанным адресом, либо подбирает пустую или Invalid
         строку, если такого адреса в кэше нет. Если пустых строк нет, возвращает None.
         """
-        line_index = address % self.lines_count
-
-        for cache_line in self.channels[line_index]:
-
-            if (
-                cache_line.data is None
-                or cache_line.state == "I"
-                or cache_line.address == address
-            ):
+        cache_line = self.get_cache_line_by_address(address)
+        if cache_line is not None:
+            # Строку с тем же адресом надо переписать, а не заводить рядом копию
+            return cache_line
+
+        # Первая свободная строка набора. Строка сразу занимается, поэтому её
+        # номер из кучи убирается
+        cache_set = self._get_set(address)
+        set_index = address % self.lines_count
+        free_ways = self._free_ways[set_index]
+        queued_ways = self._queued_ways[set_index]
+        while free_ways:
+            way = heappop(free_ways)
+            queued_ways.discard(way)
+            cache_line = cache_set[way]
+            if cache_line.data is None or cache_line.state == "I":
                 return cache_line
 
         return None
 
     def _choose_line_to_replace(self, address: int) -> CacheLine:
         """Место для логики политики замещения. Сейчас это MRU."""
-        line_index = address % self.lines_count
-        choosen_line = self.channels[0][line_index]
-
-        for cache_line in self.channels[line_index]:
-
+        cache_set = self._get_set(address)
+        way = self._mru_ways[address % self.lines_count]
+        if way is not None:
             # MRU - выбираем строку, которая использовалась "наиболее недавно"
-            if cache_line.not_used_counter < choosen_line.not_used_counter:
+            return cache_set[way]
+
+        # Строки меняли в обход кэша: ищем наименьший счётчик, первый из равных
+        choosen_line = cache_set[0]
+        for cache_line in cache_set:
+            if cache_line.last_used > choosen_line.last_used:
                 choosen_line = cache_line
 
         return choosen_line
@@ -323,38 +1042,121 @@ class Cache:
     def read(self, address: int) -> int:
         """Обрабатывае запрос на чтение адреса из кэша. Подразумевается, что при вызове
         этой функции точно известно, что данные в кэше есть."""
+        if self.events.handlers[EventKind.CACHE_READ]:
+            self.events.emit(EventKind.CACHE_READ, self.index, address)
 
-        self._cache_lines_counter_increment()
-        cache_line = self.get_cache_line_by_address(address)
+        self._cache_lines_counter_increment(address)
+        cache_line = self._swap_back(address)
+        if cache_line is None:
+            cache_line = self.get_cache_line_by_address(address)
+        self._mark_used(cache_line)
         return cache_line.read()
 
     def write(self, state, data, address: int) -> None | CacheLine:
         """Записывает в кэш данные с указанным адресом и состоянием. Возвращает
         замещённую кэш строку, либо None, если не пришлось делать замещение."""
-        self.write_callback()
+        if self.events.handlers[EventKind.CACHE_WRITE]:
+            self.events.emit(EventKind.CACHE_WRITE, self.index, address)
 
-        self._cache_lines_counter_increment()
+        self._cache_lines_counter_increment(address)
 
-        cache_line = self._choose_same_or_empty_line(address)
+        cache_line = self._swap_back(address)
+        if cache_line is None:
+            cache_line = self._choose_same_or_empty_line(address)
         replaced_cache_line = None
 
         if cache_line is None:
             cache_line = self._choose_line_to_replace(address)
-            replaced_cache_line = copy(cache_line)
+            replaced_cache_line = self._park_victim(copy(cache_line))
 
         cache_line.state = state
         cache_line.write(address, data)
+        self._lines_by_address[address] = cache_line
+        self._mark_used(cache_line)
 
         return replaced_cache_line
 
+    def _get_victim_line(self, address: int) -> None | CacheLine:
+        cache_line = self._lines_by_address.get(address)
+        if (
+            cache_line is not None
+            and cache_line.state not in {None, "I"}
+            and cache_line.address == address
+            and cache_line not in self._positions
+        ):
+            return cache_line
+        return None
+
+    def _park_victim(self, cache_line: CacheLine) -> None | CacheLine:
+        """Кладёт вытесненную строку в буфер. Возвращает строку, которая покидает
+        кэш: её саму, если буфера нет, или самую старую строку буфера."""
+        if not self.victim_lines or cache_line.state in {None, "I"}:
+            return cache_line
+
+        # В буфере часы строки стоят, как раньше стоял её счётчик
+        cache_line.clock = [cache_line.clock[0]]
+        self.victim_inserts += 1
+        for slot in self.victim_lines:
+            if slot.state in {None, "I"}:
+                break
+        else:
+            slot = self.victim_lines[0]
+            self.victim_evictions += 1
+
+        evicted_line = copy(slot)
+        self.victim_lines.remove(slot)
+        if self._lines_by_address.get(slot.address) is slot:
+            del self._lines_by_address[slot.address]
+        self.victim_lines.append(cache_line)
+        self._lines_by_address[cache_line.address] = cache_line
+        return evicted_line
+
+    def _swap_back(self, address: int) -> None | CacheLine:
+        """Если адрес лежит в буфере вытесненных строк, возвращает строку в набор
+        (при необходимости меняя её местами с вытесняемой строкой набора) и
+        возвращает её. Иначе возвращает None."""
+        victim_line = self._get_victim_line(address) if self.victim_lines else None
+        if victim_line is None:
+            return None
+
+        self.victim_hits += 1
+        self.victim_lines.remove(victim_line)
+        del self._lines_by_address[address]
+
+        cache_line = self._choose_same_or_empty_line(address)
+        if cache_line is None:
+            cache_line = self._choose_line_to_replace(address)
+            # Вытесняемая строка меняется местами с вернувшейся
+            replaced_line = copy(cache_line)
+            replaced_line.clock = [cache_line.clock[0]]
+            self.victim_lines.append(replaced_line)
+            self._lines_by_address[replaced_line.address] = replaced_line
+        else:
+            self.victim_lines.insert(0, CacheLine())
+
+        (
+            cache_line.state,
+            cache_line.address,
+            cache_line.data,
+            cache_line.not_used_counter,
+        ) = (
+            victim_line.state,
+            victim_line.address,
+            victim_line.data,
+            victim_line.not_used_counter,
+        )
+        self._lines_by_address[address] = cache_line
+        return cache_line
+
     def get_cache_line_by_address(self, address: int) -> None | CacheLine:
         """Находит кэш строку по заданному адресу. Возвращает None, если адреса
         в кэше нет или он находится в состоянии I."""
-        line_index = address % self.lines_count
-
-        for cache_line in self.channels[line_index]:
-
-            if cache_line.state != "I" and address == cache_line.address:
-                return cache_line
+        cache_line = self._lines_by_address.get(address)
+        if (
+            cache_line is not None
+            and cache_line.state != "I"
+            and address == cache_line.address
+        ):
+            return cache_line
 
         return None
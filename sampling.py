@@ -0,0 +1,263 @@
+"""Приближённая симуляция больших трасс с доверительными интервалами.
+
+Выборка наборов: так как наборы кэша независимы, достаточно полностью прогнать
+запросы только к части наборов и оценить доли промахов и событий когерентности
+по ним.
+
+Выборка интервалов: трасса прогоняется целиком, но статистика собирается только
+в коротких подробных окнах, а между ними кэши прогреваются в функциональном
+режиме (CacheController.fast_forward).
+
+Демо:
+python sampling.py 1000000
+"""
+
+from __future__ import annotations
+import math
+import random
+import statistics
+import sys
+from array import array
+from typing import Iterable, List, Sequence, Tuple
+
+import settings
+from events import EventKind
+from protocol import CPU, RAM, CacheController
+
+
+class SamplingEstimate:
+    """Оценка долей промахов и событий когерентности (вмешательств и инвалидаций)
+    на один запрос вместе с доверительными интервалами."""
+
+    def __init__(
+        self,
+        miss_rate: float,
+        miss_rate_interval: Tuple[float, float],
+        coherence_rate: float,
+        coherence_rate_interval: Tuple[float, float],
+        sampled_operations: int,
+        total_operations: int,
+    ):
+        self.miss_rate = miss_rate
+        self.miss_rate_interval = miss_rate_interval
+        self.coherence_rate = coherence_rate
+        self.coherence_rate_interval = coherence_rate_interval
+        self.sampled_operations = sampled_operations
+        self.total_operations = total_operations
+
+    def __repr__(self):
+        return (
+            f"SamplingEstimate(miss_rate={self.miss_rate:.4f} "
+            f"[{self.miss_rate_interval[0]:.4f}, {self.miss_rate_interval[1]:.4f}], "
+            f"coherence_rate={self.coherence_rate:.4f} "
+            f"[{self.coherence_rate_interval[0]:.4f}, "
+            f"{self.coherence_rate_interval[1]:.4f}], "
+            f"sampled {self.sampled_operations} of {self.total_operations})"
+        )
+
+
+def _z(confidence: float) -> float:
+    return statistics.NormalDist().inv_cdf(0.5 + confidence / 2)
+
+
+def _build_system(cpu_count, lines_count, channels_count, ram_size) -> CacheController:
+    ram = RAM(ram_size)
+    cpus = [CPU(cpu_index) for cpu_index in range(cpu_count)]
+    return CacheController(ram, cpus, lines_count, channels_count)
+
+
+def _ratio_interval(
+    values: List[int], sizes: List[int], population: int, z: float
+) -> Tuple[float, Tuple[float, float]]:
+    """Оценка отношения sum(values) / sum(sizes) по кластерной выборке с поправкой
+    на конечность генеральной совокупности из population кластеров."""
+    total_size = sum(sizes)
+    if total_size == 0:
+        return 0.0, (0.0, 0.0)
+
+    ratio = sum(values) / total_size
+    count = len(sizes)
+    if count < 2:
+        # По одному кластеру разброс не оценить
+        return ratio, (ratio, ratio) if count == population else (0.0, math.inf)
+
+    mean_size = total_size / count
+    residuals = sum(
+        (value - ratio * size) ** 2 for value, size in zip(values, sizes)
+    ) / (count - 1)
+    correction = 1 - count / population
+    error = math.sqrt(correction * residuals / count) / mean_size
+    return ratio, (max(0.0, ratio - z * error), ratio + z * error)
+
+
+def _mean_interval(
+    samples: List[float], z: float
+) -> Tuple[float, Tuple[float, float]]:
+    if not samples:
+        return 0.0, (0.0, 0.0)
+
+    mean = statistics.fmean(samples)
+    if len(samples) < 2:
+        return mean, (mean, mean)
+
+    error = statistics.stdev(samples) / math.sqrt(len(samples))
+    return mean, (max(0.0, mean - z * error), mean + z * error)
+
+
+def sample_sets(
+    cpu_indexes: Sequence[int],
+    operations: Sequence[int],
+    addresses: Sequence[int],
+    sets: Iterable[int] = None,
+    sets_fraction: float = 0.25,
+    confidence: float = 0.95,
+    seed=None,
+    cpu_count: int = settings.CPU_COUNT,
+    lines_count: int = settings.CACH_CACHLINES_COUNT,
+    channels_count: int = settings.CACH_CHANNELS_COUNT,
+    ram_size: int = settings.RAM_SIZE,
+) -> SamplingEstimate:
+    """Прогоняет только запросы к выбранным наборам кэша. Если наборы не указаны,
+    случайно выбирается доля sets_fraction от всех наборов."""
+    if sets is None:
+        sets_count = max(1, round(lines_count * sets_fraction))
+        sets = random.Random(seed).sample(range(lines_count), sets_count)
+    sets = set(sets)
+
+    sampled_cpus = array("b")
+    sampled_operations = array("b")
+    sampled_addresses = array("q")
+    total_operations = 0
+
+    for cpu_index, operation, address in zip(cpu_indexes, operations, addresses):
+        total_operations += 1
+        if address % lines_count in sets:
+            sampled_cpus.append(cpu_index)
+            sampled_operations.append(operation)
+            sampled_addresses.append(address)
+
+    cache_controller = _build_system(cpu_count, lines_count, channels_count, ram_size)
+    set_coherence = dict.fromkeys(sets, 0)
+
+    def on_coherence_event(cpu_index, address, *args):
+        set_coherence[address % lines_count] += 1
+
+    cache_controller.events.subscribe(EventKind.INTERVENTION, on_coherence_event)
+    cache_controller.events.subscribe(EventKind.INVALIDATION, on_coherence_event)
+    result = cache_controller.run_batch(
+        sampled_cpus, sampled_operations, sampled_addresses
+    )
+
+    set_operations = dict.fromkeys(sets, 0)
+    set_misses = dict.fromkeys(sets, 0)
+    for hit, address in zip(result.hits, sampled_addresses):
+        set_index = address % lines_count
+        set_operations[set_index] += 1
+        set_misses[set_index] += not hit
+
+    sizes = [set_operations[set_index] for set_index in sets]
+    z = _z(confidence)
+    miss_rate, miss_rate_interval = _ratio_interval(
+        [set_misses[set_index] for set_index in sets], sizes, lines_count, z
+    )
+    coherence_rate, coherence_rate_interval = _ratio_interval(
+        [set_coherence[set_index] for set_index in sets], sizes, lines_count, z
+    )
+
+    return SamplingEstimate(
+        miss_rate,
+        miss_rate_interval,
+        coherence_rate,
+        coherence_rate_interval,
+        len(sampled_addresses),
+        total_operations,
+    )
+
+
+def sample_intervals(
+    cpu_indexes: Sequence[int],
+    operations: Sequence[int],
+    addresses: Sequence[int],
+    window: int = 1000,
+    period: int = 10000,
+    confidence: float = 0.95,
+    cpu_count: int = settings.CPU_COUNT,
+    lines_count: int = settings.CACH_CACHLINES_COUNT,
+    channels_count: int = settings.CACH_CHANNELS_COUNT,
+    ram_size: int = settings.RAM_SIZE,
+) -> SamplingEstimate:
+    """Каждые period запросов подробно прогоняет окно из window запросов, а остальные
+    запросы только прогревают кэши без сбора статистики. Нужно
+    0 < window <= period, иначе бросается ValueError."""
+    if not 0 < window <= period:
+        raise ValueError(
+            f"window and period must satisfy 0 < window <= period, "
+            f"got window={window}, period={period}"
+        )
+    cache_controller = _build_system(cpu_count, lines_count, channels_count, ram_size)
+    events = cache_controller.events
+    coherence_events_count = 0
+
+    def on_coherence_event(*args):
+        nonlocal coherence_events_count
+        coherence_events_count += 1
+
+    total_operations = len(addresses)
+    sampled_operations = 0
+    miss_rates = []
+    coherence_rates = []
+
+    for start in range(0, total_operations, period):
+        warmup_end = min(start + period - window, total_operations)
+        end = min(start + period, total_operations)
+
+        cache_controller.fast_forward(
+            cpu_indexes[start:warmup_end],
+            operations[start:warmup_end],
+            addresses[start:warmup_end],
+        )
+        if warmup_end == end:
+            continue
+
+        coherence_events_count = 0
+        events.subscribe(EventKind.INTERVENTION, on_coherence_event)
+        events.subscribe(EventKind.INVALIDATION, on_coherence_event)
+        result = cache_controller.run_batch(
+            cpu_indexes[warmup_end:end],
+            operations[warmup_end:end],
+            addresses[warmup_end:end],
+        )
+        events.unsubscribe(EventKind.INTERVENTION, on_coherence_event)
+        events.unsubscribe(EventKind.INVALIDATION, on_coherence_event)
+
+        sampled_operations += len(result)
+        miss_rates.append(result.hits.count(0) / len(result))
+        coherence_rates.append(coherence_events_count / len(result))
+
+    z = _z(confidence)
+    miss_rate, miss_rate_interval = _mean_interval(miss_rates, z)
+    coherence_rate, coherence_rate_interval = _mean_interval(coherence_rates, z)
+
+    return SamplingEstimate(
+        miss_rate,
+        miss_rate_interval,
+        coherence_rate,
+        coherence_rate_interval,
+        sampled_operations,
+        total_operations,
+    )
+
+
+if __name__ == "__main__":
+    operations_count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    generator = random.Random(0)
+    cpu_indexes = array(
+        "b", (generator.randrange(settings.CPU_COUNT) for _ in range(operations_count))
+    )
+    operations = array("b", (generator.randrange(2) for _ in range(operations_count)))
+    addresses = array(
+        "q", (generator.randrange(settings.RAM_SIZE) for _ in range(operations_count))
+    )
+
+    print(sample_sets(cpu_indexes, operations, addresses, sets_fraction=0.5, seed=0))
+    print(sample_intervals(cpu_indexes, operations, addresses))
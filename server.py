@@ -0,0 +1,365 @@
+"""Локальный HTTP сервис для программных запросов к модели. Держит пул заранее
+созданных кэш контроллеров и между сессиями не пересоздаёт их, а сбрасывает или
+восстанавливает из снимка.
+
+    POST   /sessions                 {"snapshot": {...}}  -> {"session": "..."}
+    POST   /sessions/<id>/run        {"ops": [[cpu, op, address], ...]}
+    GET    /sessions/<id>/snapshot                        -> snapshot()
+    DELETE /sessions/<id>                                 -> {"released": "..."}
+
+op - 0 или "R" для чтения, 1 или "W" для записи (инкремента). Ответ на /run
+приходит потоком JSON строк: по одной строке на каждые CHUNK_SIZE запросов
+с массивами hits, sources и states (см. CacheController.run_batch), и последней
+строкой с тактом и статистикой. Снимок и запросы проверяются до начала ответа,
+на неверные сервис отвечает 400.
+
+Одну сессию в каждый момент обрабатывает только один запрос: пока идёт /run,
+снимок или удаление той же сессии получают 409. Сессии, к которым не обращались
+дольше SESSION_IDLE_TIMEOUT секунд, возвращаются в пул при выдаче новой.
+
+Запуск:
+python server.py 8765
+"""
+
+from __future__ import annotations
+import json
+import queue
+import sys
+import threading
+import time
+import uuid
+from array import array
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict
+
+import settings
+from protocol import CPU, OP_READ, OP_WRITE, RAM, STATES, CacheController
+
+CHUNK_SIZE = 4096
+SESSION_IDLE_TIMEOUT = 600  # секунд без запросов, после которых сессия освобождается
+OPERATION_CODES = {"R": OP_READ, "W": OP_WRITE, OP_READ: OP_READ, OP_WRITE: OP_WRITE}
+
+
+def _is_int(value) -> bool:
+    # bool тоже int, но в снимке и запросах это наверняка ошибка
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _check_list(value, length: int, name: str):
+    if not isinstance(value, list) or len(value) != length:
+        raise ValueError(f"{name} must be a list of {length} items")
+
+
+def _check_line(line, name: str):
+    _check_list(line, 4, name)
+    state, address, data, not_used_counter = line
+    if state is not None and state not in STATES:
+        raise ValueError(f"{name}: unknown state {state!r}")
+    if address is not None and not (
+        _is_int(address) and 0 <= address < settings.RAM_SIZE
+    ):
+        raise ValueError(f"{name}: address out of range")
+    if data is not None and not _is_int(data):
+        raise ValueError(f"{name}: data must be an integer")
+    if not _is_int(not_used_counter):
+        raise ValueError(f"{name}: counter must be an integer")
+
+
+def validate_snapshot(snapshot):
+    """Проверяет, что снимок подходит контроллерам пула (параметры из settings),
+    иначе бросает ValueError."""
+    if not isinstance(snapshot, dict):
+        raise ValueError("snapshot must be an object")
+    for key in ("tick", "ram", "caches"):
+        if key not in snapshot:
+            raise ValueError(f"snapshot has no {key!r}")
+    if not _is_int(snapshot["tick"]) or snapshot["tick"] < 0:
+        raise ValueError("tick must be a non-negative integer")
+
+    _check_list(snapshot["ram"], settings.RAM_SIZE, "ram")
+    if not all(_is_int(value) for value in snapshot["ram"]):
+        raise ValueError("ram values must be integers")
+
+    _check_list(snapshot["caches"], settings.CPU_COUNT, "caches")
+    for cpu_index, cache in enumerate(snapshot["caches"]):
+        name = f"caches[{cpu_index}]"
+        _check_list(cache, settings.CACH_CHANNELS_COUNT, name)
+        for channel_index, channel in enumerate(cache):
+            channel_name = f"{name}[{channel_index}]"
+            _check_list(channel, settings.CACH_CACHLINES_COUNT, channel_name)
+            for line_index, line in enumerate(channel):
+                _check_line(line, f"{channel_name}[{line_index}]")
+
+    # У контроллеров пула нет буфера вытесненных строк
+    victims = snapshot.get("victims", [[]] * settings.CPU_COUNT)
+    _check_list(victims, settings.CPU_COUNT, "victims")
+    for cpu_index, victim_lines in enumerate(victims):
+        _check_list(victim_lines, 0, f"victims[{cpu_index}]")
+
+
+def parse_ops(ops):
+    """Переводит [[cpu, op, address], ...] в массивы для run_batch. Бросает
+    ValueError, если запрос неверен или выходит за пределы системы."""
+    if not isinstance(ops, list):
+        raise ValueError("ops must be a list")
+    cpu_indexes = array("b")
+    operations = array("b")
+    addresses = array("q")
+    for op in ops:
+        if not isinstance(op, list) or len(op) != 3:
+            raise ValueError("each op must be [cpu, op, address]")
+        cpu_index, operation, address = op
+        if not _is_int(cpu_index) or not 0 <= cpu_index < settings.CPU_COUNT:
+            raise ValueError(f"cpu out of range: {cpu_index!r}")
+        if not (_is_int(operation) or isinstance(operation, str)) or (
+            operation not in OPERATION_CODES
+        ):
+            raise ValueError(f"unknown op: {operation!r}")
+        if not _is_int(address) or not 0 <= address < settings.RAM_SIZE:
+            raise ValueError(f"address out of range: {address!r}")
+        cpu_indexes.append(cpu_index)
+        operations.append(OPERATION_CODES[operation])
+        addresses.append(address)
+    return cpu_indexes, operations, addresses
+
+
+class SessionBusy(Exception):
+    """Сессию уже обрабатывает другой запрос."""
+
+
+class Session:
+    def __init__(self, cache_controller: CacheController):
+        self.cache_controller = cache_controller
+        # Держится всё время обработки запроса к сессии
+        self.lock = threading.Lock()
+        self.last_used = time.monotonic()
+
+
+class SimulatorPool:
+    """Пул готовых к работе кэш контроллеров с параметрами из settings."""
+
+    def __init__(self, size: int = 4, idle_timeout: float = SESSION_IDLE_TIMEOUT):
+        self.free = queue.Queue()
+        for _ in range(size):
+            ram = RAM(settings.RAM_SIZE)
+            cpus = [CPU(cpu_index) for cpu_index in range(settings.CPU_COUNT)]
+            self.free.put(
+                CacheController(
+                    ram,
+                    cpus,
+                    settings.CACH_CACHLINES_COUNT,
+                    settings.CACH_CHANNELS_COUNT,
+                )
+            )
+
+        self.idle_timeout = idle_timeout
+        self.sessions: Dict[str, Session] = {}
+        self.lock = threading.Lock()
+
+    def acquire(self, snapshot: Dict = None, timeout: float = 10) -> str:
+        """Выдаёт контроллер из пула. Бросает queue.Empty, если свободных нет,
+        и ValueError, если снимок не подходит (контроллер при этом остаётся
+        в пуле)."""
+        if snapshot is not None:
+            validate_snapshot(snapshot)
+
+        self.expire_idle()
+        cache_controller = self.free.get(timeout=timeout)
+        if snapshot is not None:
+            try:
+                cache_controller.restore(snapshot)
+            except Exception as error:
+                # Снимок мог восстановиться частично
+                cache_controller.reset()
+                self.free.put(cache_controller)
+                raise ValueError(f"invalid snapshot: {error}") from error
+
+        session = uuid.uuid4().hex
+        with self.lock:
+            self.sessions[session] = Session(cache_controller)
+        return session
+
+    def checkout(self, session: str) -> Session:
+        """Занимает сессию на время запроса, после него нужен checkin. Бросает
+        KeyError, если сессии нет, и SessionBusy, если её уже обрабатывает
+        другой запрос."""
+        with self.lock:
+            entry = self.sessions[session]
+            if not entry.lock.acquire(blocking=False):
+                raise SessionBusy(session)
+        return entry
+
+    def checkin(self, entry: Session):
+        entry.last_used = time.monotonic()
+        entry.lock.release()
+
+    def release(self, session: str):
+        """Возвращает контроллер сессии в пул. Бросает KeyError и SessionBusy,
+        как checkout."""
+        with self.lock:
+            entry = self.sessions[session]
+            # Блокировка удалённой сессии так и остаётся захваченной
+            if not entry.lock.acquire(blocking=False):
+                raise SessionBusy(session)
+            del self.sessions[session]
+        self._put_back(entry.cache_controller)
+
+    def expire_idle(self):
+        """Возвращает в пул контроллеры сессий, к которым давно не обращались
+        и которые сейчас не заняты."""
+        deadline = time.monotonic() - self.idle_timeout
+        expired = []
+        with self.lock:
+            for session, entry in list(self.sessions.items()):
+                if entry.last_used < deadline and entry.lock.acquire(blocking=False):
+                    del self.sessions[session]
+                    expired.append(entry.cache_controller)
+        for cache_controller in expired:
+            self._put_back(cache_controller)
+
+    def _put_back(self, cache_controller: CacheController):
+        cache_controller.reset()
+        self.free.put(cache_controller)
+
+
+class SimulationRequestHandler(BaseHTTPRequestHandler):
+    # Потоковый ответ с Transfer-Encoding: chunked есть только в HTTP/1.1
+    protocol_version = "HTTP/1.1"
+    pool: SimulatorPool = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_json(self) -> Dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def _send_json(self, value, status: int = 200):
+        body = json.dumps(value).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_chunk(self, value):
+        line = json.dumps(value).encode() + b"\n"
+        self.wfile.write(f"{len(line):x}\r\n".encode() + line + b"\r\n")
+
+    def _route(self):
+        """Разбирает путь вида /sessions/<id>/<action>."""
+        parts = self.path.strip("/").split("/")
+        if not parts or parts[0] != "sessions":
+            return None, None
+        session = parts[1] if len(parts) > 1 else None
+        action = parts[2] if len(parts) > 2 else None
+        return session, action
+
+    def do_POST(self):
+        session, action = self._route()
+        try:
+            request = self._read_json()
+        except ValueError:
+            return self._send_json({"error": "invalid JSON"}, 400)
+        if not isinstance(request, dict):
+            return self._send_json({"error": "request must be an object"}, 400)
+
+        if self.path.strip("/") == "sessions":
+            try:
+                session = self.pool.acquire(request.get("snapshot"))
+            except queue.Empty:
+                return self._send_json({"error": "no free simulators"}, 503)
+            except ValueError as error:
+                return self._send_json({"error": str(error)}, 400)
+            return self._send_json({"session": session})
+
+        if action == "run":
+            try:
+                cpu_indexes, operations, addresses = parse_ops(request["ops"])
+            except KeyError:
+                return self._send_json({"error": "invalid ops"}, 400)
+            except ValueError as error:
+                return self._send_json({"error": str(error)}, 400)
+            try:
+                entry = self.pool.checkout(session)
+            except KeyError:
+                return self._send_json({"error": "unknown session"}, 404)
+            except SessionBusy:
+                return self._send_json({"error": "session is busy"}, 409)
+            try:
+                return self._run(
+                    entry.cache_controller, cpu_indexes, operations, addresses
+                )
+            finally:
+                self.pool.checkin(entry)
+
+        self._send_json({"error": "not found"}, 404)
+
+    def _run(self, cache_controller, cpu_indexes, operations, addresses):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        summary = Counter()
+        for start in range(0, len(addresses), CHUNK_SIZE):
+            end = start + CHUNK_SIZE
+            result = cache_controller.run_batch(
+                cpu_indexes[start:end], operations[start:end], addresses[start:end]
+            )
+            summary.update(result.summary())
+            self._send_chunk(
+                {
+                    "hits": result.hits.tolist(),
+                    "sources": result.sources.tolist(),
+                    "states": result.states.tolist(),
+                }
+            )
+
+        self._send_chunk({"tick": cache_controller.tick, "summary": dict(summary)})
+        self.wfile.write(b"0\r\n\r\n")
+
+    def do_GET(self):
+        session, action = self._route()
+        if action == "snapshot":
+            try:
+                entry = self.pool.checkout(session)
+            except KeyError:
+                return self._send_json({"error": "unknown session"}, 404)
+            except SessionBusy:
+                return self._send_json({"error": "session is busy"}, 409)
+            try:
+                snapshot = entry.cache_controller.snapshot()
+            finally:
+                self.pool.checkin(entry)
+            return self._send_json(snapshot)
+        self._send_json({"error": "not found"}, 404)
+
+    def do_DELETE(self):
+        session, action = self._route()
+        try:
+            self.pool.release(session)
+        except KeyError:
+            return self._send_json({"error": "unknown session"}, 404)
+        except SessionBusy:
+            return self._send_json({"error": "session is busy"}, 409)
+        self._send_json({"released": session})
+
+
+def make_server(
+    host: str = "127.0.0.1", port: int = 8765, pool_size: int = 4
+) -> ThreadingHTTPServer:
+    handler = type(
+        "BoundSimulationRequestHandler",
+        (SimulationRequestHandler,),
+        {"pool": SimulatorPool(pool_size)},
+    )
+    return ThreadingHTTPServer((host, port), handler)
+
+
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8765
+    server = make_server(port=port)
+    print(f"Listening on http://127.0.0.1:{port}")
+    server.serve_forever()
@@ -21,5 +21,55 @@ BUSES_Y_COORDS = [
     TOP_LEFT_CORNER[1] + 130,
 ]
 CPU_Y_COORD = TOP_LEFT_CORNER[1] + 180
-CPU_X_COORDS = [TOP_LEFT_CORNER[0] + 125 + 250 * i for i in range(CPU_COUNT)]
 RAM_Y_COORD = TOP_LEFT_CORNER[1] + 180
+CPU_COLUMN_WIDTH = 250
+# Сколько столбцов процессоров помещается левее памяти, остальные - прокруткой
+VISIBLE_CPU_COUNT = min(
+    CPU_COUNT,
+    (BOTTOM_RIGHT_CORNER[0] - 300 - TOP_LEFT_CORNER[0] - 125) // CPU_COLUMN_WIDTH,
+)
+CPU_X_COORDS = [
+    TOP_LEFT_CORNER[0] + 125 + CPU_COLUMN_WIDTH * i for i in range(VISIBLE_CPU_COUNT)
+]
+# Тепловая карта обращений под столбцами процессоров
+HEATMAP_Y_COORD = BOTTOM_RIGHT_CORNER[1] - 290
+HEATMAP_SIZE = (BOTTOM_RIGHT_CORNER[0] - 340 - TOP_LEFT_CORNER[0], 250)
+HEATMAP_REDRAW_MS = 250
+
+# Задержки в тактах для модели стоимости обращений (latency.py)
+LATENCY_L1_HIT = 1
+LATENCY_SHARED_INTERVENTION = 20  # данные из чужого кэша в состоянии E или R
+LATENCY_DIRTY_INTERVENTION = 30  # данные из чужого кэша в состоянии M или T
+LATENCY_RAM_READ = 100
+LATENCY_COPY_BACK = 100
+LATENCY_INVALIDATION = 15  # рассылка инвалидации и ожидание подтверждений
+
+# Неблокирующие кэши и шина с расщеплёнными транзакциями (nonblocking.py)
+MSHR_COUNT = 4  # регистров незавершённых промахов на кэш
+BUS_REQUEST_CYCLES = 2  # занятость шины адреса запросом
+BUS_RESPONSE_CYCLES = 4  # занятость шины данных ответом
+
+# Строк в буфере вытесненных строк каждого кэша, 0 - буфера нет
+CACH_VICTIM_LINES_COUNT = 0
+
+# Размер кэш строки в байтах для импорта трасс реальных программ (traces.py):
+# байты одной строки попадают в один адрес модели
+TRACE_LINE_SIZE = 64
+
+# Несколько узлов памяти (numa.py)
+NUMA_NODES_COUNT = 2
+NUMA_INTERLEAVE = "page"  # "line", "page" или "first_touch"
+NUMA_PAGE_SIZE = 4  # адресов на страницу
+LATENCY_NUMA_HOP = 80  # добавка к задержке узла при обращении с чужого узла
+
+# Журнал отмены (journal.py): ключевой кадр каждые JOURNAL_KEYFRAME_INTERVAL тактов,
+# назад можно вернуться не больше чем на JOURNAL_MAX_HISTORY тактов
+JOURNAL_KEYFRAME_INTERVAL = 1000
+JOURNAL_MAX_HISTORY = 100000
+
+# Профилирование (profiling.py): префикс файлов отчёта или None - выключено.
+# Время замеряется у каждого PROFILE_SAMPLE_EVERY-го запроса, с PROFILE_CPROFILE
+# рабочий процесс дополнительно пишет статистику cProfile
+PROFILE_OUTPUT = None
+PROFILE_SAMPLE_EVERY = 16
+PROFILE_CPROFILE = False
@@ -0,0 +1,178 @@
+"""Параллельная симуляция трассы по наборам кэша. Когерентность и замещение в модели
+целиком локальны внутри набора (address % lines_count), поэтому трассу можно
+разрезать по номеру набора и прогнать каждую часть в отдельном процессе - результат
+будет тем же, что и при последовательном прогоне.
+
+Демо:
+python sharding.py 1000000
+"""
+
+from __future__ import annotations
+import random
+import sys
+import time
+from array import array
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Dict, List, Sequence
+
+import settings
+from protocol import CPU, RAM, BatchResult, CacheController
+
+
+class ShardedRun:
+    """Результат шардированного прогона: результаты запросов в исходном порядке,
+    итоговое содержимое оперативной памяти и объединённая статистика."""
+
+    def __init__(self, result: BatchResult, ram_data: List[int], shards: List[Dict]):
+        self.result = result
+        self.ram_data = ram_data
+        self.shards = shards
+        self.summary: Dict[str, int] = dict(sum((Counter(s) for s in shards), Counter()))
+
+
+def split_by_set(
+    cpu_indexes: Sequence[int],
+    operations: Sequence[int],
+    addresses: Sequence[int],
+    lines_count: int,
+    shards_count: int,
+):
+    """Разбивает трассу на shards_count частей по номеру набора. Для каждой части
+    возвращает позиции запросов в исходной трассе и сами запросы."""
+    shards = [
+        (array("q"), array("b"), array("b"), array("q")) for _ in range(shards_count)
+    ]
+
+    for position, (cpu_index, operation, address) in enumerate(
+        zip(cpu_indexes, operations, addresses)
+    ):
+        positions, shard_cpus, shard_operations, shard_addresses = shards[
+            address % lines_count % shards_count
+        ]
+        positions.append(position)
+        shard_cpus.append(cpu_index)
+        shard_operations.append(operation)
+        shard_addresses.append(address)
+
+    return shards
+
+
+def _run_shard(
+    shard_index,
+    shards_count,
+    shard,
+    shared_memory_name,
+    operations_count,
+    cpu_count,
+    lines_count,
+    channels_count,
+    ram_size,
+):
+    """Прогоняет одну часть трассы на новой системе и пишет результаты в общую
+    память по исходным позициям запросов."""
+    positions, cpu_indexes, operations, addresses = shard
+
+    ram = RAM(ram_size)
+    cpus = [CPU(cpu_index) for cpu_index in range(cpu_count)]
+    cache_controller = CacheController(ram, cpus, lines_count, channels_count)
+    result = cache_controller.run_batch(cpu_indexes, operations, addresses)
+
+    block = shared_memory.SharedMemory(name=shared_memory_name)
+    try:
+        buffer = block.buf
+        hits = buffer[:operations_count]
+        sources = buffer[operations_count : operations_count * 2]
+        states = buffer[operations_count * 2 : operations_count * 3]
+        ram_data = buffer[operations_count * 3 :].cast("q")
+
+        for i, position in enumerate(positions):
+            hits[position] = result.hits[i]
+            sources[position] = result.sources[i]
+            states[position] = result.states[i]
+
+        for address in range(ram_size):
+            if address % lines_count % shards_count == shard_index:
+                ram_data[address] = ram.data[address]
+
+        del hits, sources, states, ram_data, buffer
+    finally:
+        block.close()
+
+    return result.summary()
+
+
+def run_sharded(
+    cpu_indexes: Sequence[int],
+    operations: Sequence[int],
+    addresses: Sequence[int],
+    shards_count: int = None,
+    processes: int = None,
+    cpu_count: int = settings.CPU_COUNT,
+    lines_count: int = settings.CACH_CACHLINES_COUNT,
+    channels_count: int = settings.CACH_CHANNELS_COUNT,
+    ram_size: int = settings.RAM_SIZE,
+) -> ShardedRun:
+    """Прогоняет трассу в пуле процессов, разрезав её по наборам кэша. Частей
+    не может быть больше, чем наборов. Результаты запросов собираются в блоке
+    multiprocessing.shared_memory, поэтому обратно из процессов передаётся только
+    статистика."""
+    if shards_count is None:
+        shards_count = processes or lines_count
+    shards_count = max(1, min(shards_count, lines_count))
+
+    operations_count = len(addresses)
+    shards = split_by_set(cpu_indexes, operations, addresses, lines_count, shards_count)
+
+    block = shared_memory.SharedMemory(
+        create=True, size=max(1, operations_count * 3 + ram_size * 8)
+    )
+    try:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            futures = [
+                executor.submit(
+                    _run_shard,
+                    shard_index,
+                    shards_count,
+                    shard,
+                    block.name,
+                    operations_count,
+                    cpu_count,
+                    lines_count,
+                    channels_count,
+                    ram_size,
+                )
+                for shard_index, shard in enumerate(shards)
+            ]
+            summaries = [future.result() for future in futures]
+
+        result = BatchResult(0)
+        buffer = block.buf
+        result.hits.frombytes(buffer[:operations_count])
+        result.sources.frombytes(buffer[operations_count : operations_count * 2])
+        result.states.frombytes(buffer[operations_count * 2 : operations_count * 3])
+        ram_view = buffer[operations_count * 3 : operations_count * 3 + ram_size * 8]
+        ram_data = ram_view.cast("q").tolist()
+        del ram_view, buffer
+    finally:
+        block.close()
+        block.unlink()
+
+    return ShardedRun(result, ram_data, summaries)
+
+
+if __name__ == "__main__":
+    operations_count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    generator = random.Random(0)
+    cpu_indexes = array(
+        "b", (generator.randrange(settings.CPU_COUNT) for _ in range(operations_count))
+    )
+    operations = array("b", (generator.randrange(2) for _ in range(operations_count)))
+    addresses = array(
+        "q", (generator.randrange(settings.RAM_SIZE) for _ in range(operations_count))
+    )
+
+    start = time.perf_counter()
+    sharded_run = run_sharded(cpu_indexes, operations, addresses)
+    print(f"{time.perf_counter() - start:.2f} s", sharded_run.summary)
@@ -0,0 +1,213 @@
+"""Классификация промахов по трассе обращений с учётом размера кэш строки.
+
+В модели протокола строка хранит один адрес, поэтому ложного разделения в ней не
+бывает. Здесь адреса трассы считаются словами, а строка объединяет line_size
+соседних слов. Кэш каждого процессора моделируется отдельно (наборы с LRU
+замещением), запись одного процессора инвалидирует строку у остальных, а для
+каждой строки копятся маски слов, к которым обращался каждый процессор.
+
+Каждый промах относится к одному из видов:
+    cold      - процессор обращается к строке впервые;
+    true      - строку инвалидировали, и после этого другие процессоры записали
+                именно то слово, к которому идёт обращение (истинное разделение);
+    false     - строку инвалидировали записью в другие слова (ложное разделение);
+    capacity  - строку вытеснили, и полностью ассоциативный кэш того же объёма
+                тоже её не удержал бы;
+    conflict  - строку вытеснили, хотя полностью ассоциативный кэш её бы удержал.
+
+Демо:
+python sharing.py 100000
+"""
+
+from __future__ import annotations
+import random
+import sys
+from collections import Counter, OrderedDict
+from typing import Dict, Iterable, List, Set, Tuple
+
+import settings
+from protocol import OP_WRITE
+
+MISS_KINDS = ("cold", "true", "false", "capacity", "conflict")
+
+
+class _CPUCache:
+    """Теги строк в кэше одного процессора и теневой полностью ассоциативный кэш
+    того же объёма для отделения промахов ёмкости от конфликтных."""
+
+    def __init__(self, sets_count: int, associativity: int):
+        self.sets_count = sets_count
+        self.associativity = associativity
+        self.sets = [OrderedDict() for _ in range(sets_count)]
+        self.shadow = OrderedDict()
+        self.capacity = sets_count * associativity
+
+    def access(self, line: int) -> Tuple[bool, int, bool]:
+        """Обращается к строке. Возвращает признак попадания, вытесненную строку
+        (-1, если вытеснения не было) и признак попадания в теневой кэш."""
+        shadow_hit = line in self.shadow
+        self.shadow[line] = None
+        self.shadow.move_to_end(line)
+        if len(self.shadow) > self.capacity:
+            self.shadow.popitem(last=False)
+
+        cache_set = self.sets[line % self.sets_count]
+        if line in cache_set:
+            cache_set.move_to_end(line)
+            return True, -1, shadow_hit
+
+        cache_set[line] = None
+        if len(cache_set) > self.associativity:
+            return False, cache_set.popitem(last=False)[0], shadow_hit
+        return False, -1, shadow_hit
+
+    def invalidate(self, line: int) -> bool:
+        """Убирает строку из кэша. Возвращает True, если она там была."""
+        self.shadow.pop(line, None)
+        return self.sets[line % self.sets_count].pop(line, False) is None
+
+
+class SharingReport:
+    """Результат classify_sharing.
+
+    misses[cpu_index][kind] - число промахов каждого вида;
+    false_sharing_lines[line] и true_sharing_lines[line] - число промахов
+    когерентности по строкам (номер строки = адрес // line_size);
+    false_sharing_pairs[(cpu_index, writer_cpu_index)] - сколько раз запись
+    writer_cpu_index привела к ложному промаху у cpu_index;
+    word_masks[line][cpu_index] - маска слов строки, к которым обращался процессор.
+    """
+
+    def __init__(self, cpu_count: int, line_size: int):
+        self.line_size = line_size
+        self.accesses = [0] * cpu_count
+        self.misses: List[Counter] = [Counter() for _ in range(cpu_count)]
+        self.false_sharing_lines: Counter = Counter()
+        self.true_sharing_lines: Counter = Counter()
+        self.false_sharing_pairs: Counter = Counter()
+        self.word_masks: Dict[int, Dict[int, int]] = {}
+
+    def total(self) -> Counter:
+        """Число промахов каждого вида по всем процессорам."""
+        return sum(self.misses, Counter())
+
+    def top_false_sharing_lines(self, count: int = 10) -> List[Dict]:
+        """Строки с наибольшим числом ложных промахов. Для каждой указаны адреса
+        слов, к которым обращался каждый процессор: их стоит разнести по разным
+        строкам."""
+        top = []
+        for line, misses in self.false_sharing_lines.most_common(count):
+            base = line * self.line_size
+            words = {
+                cpu_index: [
+                    base + word
+                    for word in range(self.line_size)
+                    if mask & (1 << word)
+                ]
+                for cpu_index, mask in sorted(self.word_masks[line].items())
+            }
+            top.append({"address": base, "misses": misses, "words": words})
+        return top
+
+    def top_false_sharing_pairs(self, count: int = 10) -> List[Tuple]:
+        """Пары (процессор с промахом, процессор-писатель) с наибольшим числом
+        ложных промахов."""
+        return self.false_sharing_pairs.most_common(count)
+
+
+def classify_sharing(
+    cpu_indexes: Iterable[int],
+    operations: Iterable[int],
+    addresses: Iterable[int],
+    line_size: int = 4,
+    sets_count: int = settings.CACH_CACHLINES_COUNT,
+    associativity: int = settings.CACH_CHANNELS_COUNT,
+    cpu_count: int = settings.CPU_COUNT,
+) -> SharingReport:
+    """Один проход по трассе. Запись, как и в CPU.increment, - это чтение строки
+    с последующей записью, после которой строка остаётся только у писателя."""
+    report = SharingReport(cpu_count, line_size)
+    caches = [_CPUCache(sets_count, associativity) for _ in range(cpu_count)]
+    # Строки, которые процессор когда-либо загружал
+    seen: List[Set[int]] = [set() for _ in range(cpu_count)]
+    # Для инвалидированных строк: маска записанных с тех пор слов и писатели
+    invalidated: List[Dict[int, List]] = [{} for _ in range(cpu_count)]
+    # Процессоры, у которых строка может лежать в кэше
+    sharers: Dict[int, Set[int]] = {}
+    # Процессоры с незакрытой записью в invalidated по строке
+    pending: Dict[int, Set[int]] = {}
+
+    for cpu_index, operation, address in zip(cpu_indexes, operations, addresses):
+        line, word = divmod(address, line_size)
+        word_bit = 1 << word
+        report.accesses[cpu_index] += 1
+
+        line_masks = report.word_masks.setdefault(line, {})
+        line_masks[cpu_index] = line_masks.get(cpu_index, 0) | word_bit
+
+        hit, victim, shadow_hit = caches[cpu_index].access(line)
+        if victim >= 0:
+            sharers[victim].discard(cpu_index)
+
+        if not hit:
+            lost = invalidated[cpu_index].pop(line, None)
+            if line not in seen[cpu_index]:
+                kind = "cold"
+                seen[cpu_index].add(line)
+            elif lost is not None:
+                pending[line].discard(cpu_index)
+                mask, writers = lost
+                if mask & word_bit:
+                    kind = "true"
+                    report.true_sharing_lines[line] += 1
+                else:
+                    kind = "false"
+                    report.false_sharing_lines[line] += 1
+                    for writer in writers:
+                        report.false_sharing_pairs[cpu_index, writer] += 1
+            else:
+                # Строку вытеснило замещение
+                kind = "conflict" if shadow_hit else "capacity"
+            report.misses[cpu_index][kind] += 1
+
+        line_sharers = sharers.setdefault(line, set())
+        line_sharers.add(cpu_index)
+
+        if operation != OP_WRITE:
+            continue
+
+        # Уже инвалидированные копии копят записанные слова до следующего промаха
+        for other in pending.get(line, ()):
+            lost = invalidated[other][line]
+            lost[0] |= word_bit
+            lost[1].add(cpu_index)
+
+        for other in line_sharers:
+            if other != cpu_index and caches[other].invalidate(line):
+                invalidated[other][line] = [word_bit, {cpu_index}]
+                pending.setdefault(line, set()).add(other)
+        line_sharers.intersection_update((cpu_index,))
+
+    return report
+
+
+if __name__ == "__main__":
+    operations_count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    generator = random.Random(0)
+
+    # Каждый процессор пишет свой счётчик, а счётчики лежат подряд в одной строке
+    trace = []
+    for _ in range(operations_count):
+        cpu_index = generator.randrange(settings.CPU_COUNT)
+        if generator.random() < 0.5:
+            trace.append((cpu_index, OP_WRITE, cpu_index))
+        else:
+            address = generator.randrange(settings.CPU_COUNT, settings.RAM_SIZE)
+            trace.append((cpu_index, 0, address))
+    cpu_indexes, operations, addresses = zip(*trace)
+
+    report = classify_sharing(cpu_indexes, operations, addresses)
+    print(dict(report.total()))
+    for line in report.top_false_sharing_lines(3):
+        print(line)
+    print(report.top_false_sharing_pairs(5))
@@ -0,0 +1,610 @@
+"""Симуляция в отдельном процессе. Рабочий процесс владеет кэш контроллером,
+а состояние памяти, кэшей и счётчиков обращений публикует в блок общей памяти.
+Интерфейс только читает этот блок, поэтому окно не подвисает, даже когда рабочий
+процесс прогоняет миллионы запросов.
+
+Раскладка общей памяти (все поля int64, кроме счётчиков AccessCounters):
+
+    header   HEADER_FIELDS полей и число обращений к кэшу каждого процессора
+    ram      значения всех адресов
+    lines    по LINE_FIELDS поля на кэш строку: код состояния, адрес, данные и
+             счётчик MRU за вычетом числа обращений к кэшу (-1 - пустая строка)
+    sequences счётчик записей каждого набора каждого кэша
+    ring     кольцо изменений: адрес памяти (>= 0) или -(набор кэшей + 1)
+    counters массивы AccessCounters
+
+Кольцо пишет только рабочий процесс, а читает только интерфейс, поэтому блокировки
+не нужны: рабочий процесс сначала обновляет данные, потом записывает элемент кольца
+и только затем увеличивает HEAD. Если читатель отстал больше, чем на размер кольца,
+он перечитывает всё состояние целиком. Запросы пользователя публикуются сразу,
+а пакеты - каждые PUBLISH_INTERVAL запросов.
+
+Строку интерфейс может читать, пока рабочий процесс её переписывает, поэтому
+наборы защищены счётчиком записей (seqlock): рабочий процесс увеличивает его до
+и после записи набора, так что во время записи он нечётный. Читатель повторяет
+чтение строки, пока счётчик до и после чтения не совпадёт и не будет чётным, но
+не больше SEQLOCK_RETRIES раз: если рабочий процесс остановился посреди записи,
+счётчик останется нечётным навсегда.
+
+Рабочий процесс ведёт журнал отмены (journal.py), поэтому можно откатиться на
+такт назад или перейти к любому такту в пределах истории. Счётчики обращений
+при этом не откатываются.
+
+Если задан profile_output, рабочий процесс профилирует модель (profiling.py)
+и при завершении пишет отчёт в файлы с этим префиксом.
+
+Демо:
+python simulation_worker.py 1000000
+python simulation_worker.py 1000000 profile  - с профилированием
+"""
+
+from __future__ import annotations
+import multiprocessing
+import queue
+import sys
+import time
+from array import array
+from multiprocessing import shared_memory
+from typing import List, Sequence, Set, Tuple
+
+import settings
+from access_counters import AccessCounters, split_counters
+from events import EventBus, EventKind
+from journal import UndoJournal
+from profiling import Profiler
+from protocol import CPU, OP_WRITE, RAM, STATE_CODES, STATES, CacheController
+
+RING_SIZE = 1 << 16
+# Через сколько запросов пакета публиковать накопленные изменения
+PUBLISH_INTERVAL = 1024
+# Сколько раз читатель повторяет чтение строки, которую переписывает рабочий процесс
+SEQLOCK_RETRIES = 10000
+
+# Поля заголовка
+HEAD = 0  # сколько всего элементов записано в кольцо
+GENERATION = 1  # растёт при сбросе, читатель перечитывает всё
+TICK = 2  # CacheController.tick
+OPERATIONS = 3  # сколько запросов обработано
+COMPLETED = 4  # сколько команд с запросами выполнено с момента запуска
+COUNTERS_VERSION = 5  # AccessCounters.version
+HEADER_FIELDS = 8
+
+LINE_FIELDS = 4
+
+
+class SharedLayout:
+    """Смещения частей общей памяти в элементах int64."""
+
+    def __init__(
+        self,
+        ram_size: int,
+        cpu_count: int,
+        lines_count: int,
+        channels_count: int,
+        ring_size: int = RING_SIZE,
+    ):
+        self.ram_size = ram_size
+        self.cpu_count = cpu_count
+        self.lines_count = lines_count
+        self.channels_count = channels_count
+        self.ring_size = ring_size
+
+        self.cache_size = channels_count * lines_count
+        self.ram_offset = HEADER_FIELDS + cpu_count
+        self.lines_offset = self.ram_offset + ram_size
+        self.sequences_offset = (
+            self.lines_offset + cpu_count * self.cache_size * LINE_FIELDS
+        )
+        self.ring_offset = self.sequences_offset + cpu_count * lines_count
+        self.counters_offset = (self.ring_offset + ring_size) * 8
+        self.size = self.counters_offset + AccessCounters.memory_size(
+            ram_size, cpu_count, lines_count
+        )
+
+    def arguments(self) -> Tuple:
+        return (
+            self.ram_size,
+            self.cpu_count,
+            self.lines_count,
+            self.channels_count,
+            self.ring_size,
+        )
+
+
+class _Publisher:
+    """Часть рабочего процесса: копит изменившиеся строки кэшей и адреса памяти
+    и по вызову publish() переносит их в общую память."""
+
+    def __init__(self, cache_controller: CacheController, layout: SharedLayout, buffer):
+        self.cache_controller = cache_controller
+        self.layout = layout
+        self.values = buffer[: layout.counters_offset].cast("q")
+        self.counters = AccessCounters(
+            cache_controller, buffer[layout.counters_offset : layout.size]
+        )
+        self.accesses = [0] * layout.cpu_count
+        self.ram_addresses: Set[int] = set()
+        self.set_indexes: Set[int] = set()
+        self.operations = 0
+
+        events = cache_controller.events
+        events.subscribe(EventKind.CACHE_READ, self._on_cache_access)
+        events.subscribe(EventKind.CACHE_WRITE, self._on_cache_access)
+        events.subscribe(EventKind.RAM_WRITE, self._on_ram_write)
+        events.subscribe(EventKind.OPERATION, self._on_operation)
+
+    def _on_cache_access(self, cpu_index, address):
+        self.accesses[cpu_index] += 1
+
+    def _on_ram_write(self, address, data):
+        # Событие приходит до записи, поэтому значение берётся после запроса
+        self.ram_addresses.add(address)
+
+    def _push(self, entry: int):
+        values = self.values
+        head = values[HEAD]
+        values[self.layout.ring_offset + head % self.layout.ring_size] = entry
+        values[HEAD] = head + 1
+
+    def _publish_set(self, cpu: CPU, set_index: int):
+        layout = self.layout
+        values = self.values
+        accesses = self.accesses[cpu.index]
+        cache_set = cpu.index * layout.lines_count + set_index
+        # Строки набора лежат в разных каналах, через lines_count строк
+        position = (
+            layout.lines_offset
+            + (cpu.index * layout.cache_size + set_index) * LINE_FIELDS
+        )
+        step = layout.lines_count * LINE_FIELDS
+        sequence_position = layout.sequences_offset + cache_set
+
+        # Нечётный счётчик говорит читателю, что набор сейчас переписывается
+        values[sequence_position] += 1
+        for cache_line in cpu.cache.sets[set_index]:
+            if cache_line.state is None:
+                values[position] = -1
+            else:
+                values[position] = STATE_CODES[cache_line.state]
+                values[position + 1] = cache_line.address
+                values[position + 2] = cache_line.data
+                values[position + 3] = cache_line.not_used_counter - accesses
+            position += step
+        values[sequence_position] += 1
+
+        self._push(-(cache_set + 1))
+
+    def _on_operation(self, cpu_index, address, is_write):
+        # Запрос меняет строки только в наборе своего адреса (во всех кэшах)
+        self.set_indexes.add(address % self.layout.lines_count)
+        self.operations += 1
+
+    def publish(self):
+        """Переносит в общую память всё, что изменилось с прошлого вызова."""
+        values = self.values
+        ram = self.cache_controller.ram
+
+        for address in self.ram_addresses:
+            values[self.layout.ram_offset + address] = ram.data[address]
+            self._push(address)
+        self.ram_addresses.clear()
+
+        for set_index in self.set_indexes:
+            for cpu in self.cache_controller.cpus:
+                self._publish_set(cpu, set_index)
+        self.set_indexes.clear()
+
+        for cpu_index, accesses in enumerate(self.accesses):
+            values[HEADER_FIELDS + cpu_index] = accesses
+        values[TICK] = self.cache_controller.tick
+        values[OPERATIONS] = self.operations
+        values[COUNTERS_VERSION] = self.counters.version
+
+    def publish_all(self):
+        """Публикует всё состояние и просит читателя перечитать его."""
+        values = self.values
+        for address, value in enumerate(self.cache_controller.ram.data):
+            values[self.layout.ram_offset + address] = value
+        for cpu in self.cache_controller.cpus:
+            for set_index in range(self.layout.lines_count):
+                self._publish_set(cpu, set_index)
+        for cpu_index, accesses in enumerate(self.accesses):
+            values[HEADER_FIELDS + cpu_index] = accesses
+        values[TICK] = self.cache_controller.tick
+        values[OPERATIONS] = self.operations
+        values[COUNTERS_VERSION] = self.counters.version
+        values[GENERATION] += 1
+
+    def close(self):
+        events = self.cache_controller.events
+        events.unsubscribe(EventKind.CACHE_READ, self._on_cache_access)
+        events.unsubscribe(EventKind.CACHE_WRITE, self._on_cache_access)
+        events.unsubscribe(EventKind.RAM_WRITE, self._on_ram_write)
+        events.unsubscribe(EventKind.OPERATION, self._on_operation)
+        self.counters.close()
+        self.values.release()
+
+    def reset(self):
+        self.cache_controller.reset()
+        self.counters.reset()
+        self.accesses = [0] * self.layout.cpu_count
+        self.ram_addresses.clear()
+        self.set_indexes.clear()
+        self.operations = 0
+        self.publish_all()
+
+
+class _EventRecorder:
+    """Записывает все события одного запроса, чтобы интерфейс мог проиграть их
+    у себя (анимация шин)."""
+
+    def __init__(self, events: EventBus):
+        self.events = events
+        self.records = []
+        self.handlers = [self._make_handler(kind) for kind in EventKind]
+
+    def _make_handler(self, kind):
+        return lambda *args: self.records.append((kind, args))
+
+    def __enter__(self):
+        for kind, handler in zip(EventKind, self.handlers):
+            self.events.subscribe(kind, handler)
+        return self
+
+    def __exit__(self, *exc_info):
+        for kind, handler in zip(EventKind, self.handlers):
+            self.events.unsubscribe(kind, handler)
+
+
+def _worker_main(
+    shared_memory_name,
+    layout_arguments,
+    victim_lines_count,
+    commands: multiprocessing.Queue,
+    results: multiprocessing.Queue,
+    profile_output: str = None,
+):
+    """Цикл рабочего процесса. Команды:
+
+    ("read" | "increment", cpu_index, address) - запрос пользователя, события
+        которого отправляются обратно в results;
+    ("batch", cpu_indexes, operations, addresses) - пакет без событий;
+    ("step_back",) - откат последнего такта;
+    ("jump", tick) - переход к такту tick в пределах журнала;
+    ("reset",) - сброс системы;
+    ("stop",) - завершение.
+    """
+    layout = SharedLayout(*layout_arguments)
+    memory = shared_memory.SharedMemory(name=shared_memory_name)
+
+    events = EventBus()
+    ram = RAM(layout.ram_size, events=events)
+    cpus = [CPU(cpu_index, events=events) for cpu_index in range(layout.cpu_count)]
+    cache_controller = CacheController(
+        ram,
+        cpus,
+        layout.lines_count,
+        layout.channels_count,
+        events=events,
+        victim_lines_count=victim_lines_count,
+    )
+    publisher = _Publisher(cache_controller, layout, memory.buf)
+    publisher.reset()
+    journal = UndoJournal(cache_controller)
+    values = publisher.values
+
+    profiler = None
+    if profile_output is not None:
+        profiler = Profiler(cprofile=settings.PROFILE_CPROFILE)
+        profiler.install()
+
+    try:
+        while True:
+            command = commands.get()
+            name = command[0]
+
+            if name == "stop":
+                break
+
+            if name == "reset":
+                publisher.reset()
+                journal.clear()
+
+            elif name in {"step_back", "jump"}:
+                if name == "step_back":
+                    journal.step_back()
+                else:
+                    journal.jump_to(command[1])
+                publisher.publish_all()
+
+            elif name in {"read", "increment"}:
+                _, cpu_index, address = command
+                with _EventRecorder(events) as recorder:
+                    if name == "read":
+                        cpus[cpu_index].read(address)
+                    else:
+                        cpus[cpu_index].increment(address)
+                publisher.publish()
+                results.put(recorder.records)
+                values[COMPLETED] += 1
+
+            elif name == "batch":
+                _, cpu_indexes, operations, addresses = command
+                for position, (cpu_index, operation, address) in enumerate(
+                    zip(cpu_indexes, operations, addresses), start=1
+                ):
+                    if operation == OP_WRITE:
+                        cpus[cpu_index].increment(address)
+                    else:
+                        cpus[cpu_index].read(address)
+                    if position % PUBLISH_INTERVAL == 0:
+                        publisher.publish()
+                        values[COMPLETED] += PUBLISH_INTERVAL
+                publisher.publish()
+                values[COMPLETED] += len(addresses) % PUBLISH_INTERVAL
+    finally:
+        if profiler is not None:
+            profiler.uninstall()
+            profiler.dump(profile_output)
+        del values
+        journal.close()
+        publisher.close()
+        # Общую память удаляет создавший её процесс
+        memory.close()
+
+
+class SharedCounters:
+    """Счётчики обращений из общей памяти с тем же интерфейсом, что у AccessCounters
+    (нужен HeatmapPanel)."""
+
+    def __init__(self, worker: SimulationWorker):
+        layout = worker.layout
+        self.values = worker.values
+        self.ram_size = layout.ram_size
+        self.cpu_count = layout.cpu_count
+        self.lines_count = layout.lines_count
+        self.ram, self.sets = split_counters(
+            worker.memory.buf[layout.counters_offset : layout.size],
+            layout.ram_size,
+            layout.cpu_count,
+            layout.lines_count,
+        )
+
+    @property
+    def version(self) -> int:
+        return self.values[COUNTERS_VERSION]
+
+    def release(self):
+        """Освобождает представления общей памяти, чтобы её можно было закрыть."""
+        for view in list(self.ram.values()) + list(self.sets.values()):
+            view.release()
+
+
+class SimulationWorker:
+    """Запускает рабочий процесс и читает опубликованное им состояние."""
+
+    def __init__(
+        self,
+        ram_size: int,
+        cpu_count: int,
+        lines_count: int,
+        channels_count: int,
+        victim_lines_count: int = 0,
+        ring_size: int = RING_SIZE,
+        profile_output: str = None,
+    ):
+        self.layout = SharedLayout(
+            ram_size, cpu_count, lines_count, channels_count, ring_size
+        )
+        self.memory = shared_memory.SharedMemory(create=True, size=self.layout.size)
+        self.values = self.memory.buf[: self.layout.counters_offset].cast("q")
+        self.counters = SharedCounters(self)
+
+        self.commands = multiprocessing.Queue()
+        self.results = multiprocessing.Queue()
+        self.process = multiprocessing.Process(
+            target=_worker_main,
+            args=(
+                self.memory.name,
+                self.layout.arguments(),
+                victim_lines_count,
+                self.commands,
+                self.results,
+                profile_output,
+            ),
+            daemon=True,
+        )
+
+        self.closed = False
+        self.submitted = 0
+        self.tail = 0
+        self.generation = 0
+        self.accesses = [0] * cpu_count
+
+    def start(self):
+        self.process.start()
+
+    def close(self):
+        self.closed = True
+        if self.process.is_alive():
+            self.commands.put(("stop",))
+            self.process.join(timeout=5)
+        self.counters.release()
+        self.values.release()
+        self.memory.close()
+        self.memory.unlink()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def read(self, cpu_index: int, address: int):
+        self.submitted += 1
+        self.commands.put(("read", cpu_index, address))
+
+    def increment(self, cpu_index: int, address: int):
+        self.submitted += 1
+        self.commands.put(("increment", cpu_index, address))
+
+    def run_batch(
+        self,
+        cpu_indexes: Sequence[int],
+        operations: Sequence[int],
+        addresses: Sequence[int],
+    ):
+        """Отправляет пакет запросов (OP_READ или OP_WRITE) и сразу возвращается."""
+        self.submitted += len(addresses)
+        self.commands.put(
+            (
+                "batch",
+                array("b", cpu_indexes),
+                array("b", operations),
+                array("q", addresses),
+            )
+        )
+
+    def reset(self):
+        self.commands.put(("reset",))
+
+    def step_back(self):
+        """Откатывает последний такт, если он ещё есть в журнале."""
+        self.commands.put(("step_back",))
+
+    def jump_to(self, tick: int):
+        """Переходит к такту tick. Такты за пределами журнала заменяются
+        ближайшими доступными."""
+        self.commands.put(("jump", tick))
+
+    @property
+    def tick(self) -> int:
+        return self.values[TICK]
+
+    @property
+    def operations(self) -> int:
+        return self.values[OPERATIONS]
+
+    @property
+    def pending(self) -> int:
+        """Сколько отправленных запросов ещё не выполнено."""
+        return self.submitted - self.values[COMPLETED]
+
+    def poll_events(self) -> List[Tuple]:
+        """События запросов пользователя, выполненных с прошлого вызова, в виде
+        пар (вид события, аргументы)."""
+        records = []
+        while True:
+            try:
+                records.extend(self.results.get_nowait())
+            except queue.Empty:
+                return records
+
+    def get_ram(self, address: int) -> int:
+        return self.values[self.layout.ram_offset + address]
+
+    def get_line(self, cpu_index: int, row: int) -> None | Tuple:
+        """Строка row (channel_index * lines_count + cache_line_index) кэша
+        процессора: (состояние, адрес, данные, счётчик MRU) или None. Бросает
+        RuntimeError, если согласованно прочитать строку не удалось, потому что
+        рабочий процесс остановился посреди её записи."""
+        layout = self.layout
+        position = (
+            layout.lines_offset + (cpu_index * layout.cache_size + row) * LINE_FIELDS
+        )
+        sequence_position = (
+            layout.sequences_offset
+            + cpu_index * layout.lines_count
+            + row % layout.lines_count
+        )
+        values = self.values
+        for _ in range(SEQLOCK_RETRIES):
+            sequence = values[sequence_position]
+            if sequence % 2 == 0:
+                fields = values[position : position + LINE_FIELDS]
+                state_code, address, data, counter = fields
+                if values[sequence_position] == sequence:
+                    break
+            elif self.closed or not self.process.is_alive():
+                break
+            else:
+                # Рабочий процесс как раз переписывает набор
+                time.sleep(0)
+        else:
+            raise RuntimeError(f"cache {cpu_index} row {row} is never consistent")
+        if sequence % 2:
+            raise RuntimeError("simulation worker stopped while writing a cache set")
+
+        if state_code < 0:
+            return None
+        return (
+            STATES[state_code],
+            address,
+            data,
+            counter + values[HEADER_FIELDS + cpu_index],
+        )
+
+    def read_changes(self) -> Tuple[Set[int], Set[Tuple[int, int]]]:
+        """Возвращает адреса памяти и пары (процессор, строка кэша), изменившиеся
+        с прошлого вызова. Счётчики MRU меняются у всех строк кэша при каждом
+        обращении, поэтому для процессоров, к кэшам которых обращались, в ответ
+        попадают все строки."""
+        layout = self.layout
+        values = self.values
+        head = values[HEAD]
+        generation = values[GENERATION]
+
+        ram_addresses: Set[int] = set()
+        lines: Set[Tuple[int, int]] = set()
+
+        if generation != self.generation or head - self.tail > layout.ring_size:
+            self.generation = generation
+            ram_addresses.update(range(layout.ram_size))
+            cpu_indexes = range(layout.cpu_count)
+        else:
+            for position in range(self.tail, head):
+                entry = values[layout.ring_offset + position % layout.ring_size]
+                if entry >= 0:
+                    ram_addresses.add(entry)
+                else:
+                    cpu_index, set_index = divmod(-entry - 1, layout.lines_count)
+                    for channel_index in range(layout.channels_count):
+                        lines.add(
+                            (cpu_index, channel_index * layout.lines_count + set_index)
+                        )
+            cpu_indexes = [
+                cpu_index
+                for cpu_index in range(layout.cpu_count)
+                if values[HEADER_FIELDS + cpu_index] != self.accesses[cpu_index]
+            ]
+        self.tail = head
+
+        for cpu_index in cpu_indexes:
+            self.accesses[cpu_index] = values[HEADER_FIELDS + cpu_index]
+            lines.update((cpu_index, row) for row in range(layout.cache_size))
+
+        return ram_addresses, lines
+
+
+if __name__ == "__main__":
+    import random
+
+    operations_count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    profile_output = sys.argv[2] if len(sys.argv) > 2 else None
+    generator = random.Random(0)
+    cpu_indexes = [generator.randrange(4) for _ in range(operations_count)]
+    operations = [generator.randrange(2) for _ in range(operations_count)]
+    addresses = [generator.randrange(64) for _ in range(operations_count)]
+
+    with SimulationWorker(64, 4, 4, 4, profile_output=profile_output) as worker:
+        worker.run_batch(cpu_indexes, operations, addresses)
+        while worker.pending:
+            # Интерфейс в это время свободен: читаем только изменения
+            ram_addresses, lines = worker.read_changes()
+            print(
+                f"done {worker.operations}, pending {worker.pending}, "
+                f"changed {len(ram_addresses)} addresses and {len(lines)} lines"
+            )
+            time.sleep(1 / 30)
+        print("RAM:", [worker.get_ram(address) for address in range(8)], "...")
@@ -0,0 +1,223 @@
+"""Спин-блокировки на атомарных операциях и трафик когерентности на один захват.
+
+Каждый процессор выполняет программу-генератор, которая отдаёт управление после
+каждого обращения к памяти, а планировщик по очереди (или в случайном порядке,
+если задан seed) продвигает программы на одно обращение. Так ожидающие процессоры
+крутятся в цикле, пока владелец блокировки выполняет критическую секцию.
+
+Блокировки:
+    tas    - test-and-set в цикле: каждая попытка - атомарная операция, которая
+             забирает строку блокировки в M и инвалидирует её у остальных;
+    ttas   - test-and-test-and-set: пока блокировка занята, процессор читает
+             свою копию в S, и test-and-set выполняется только после освобождения;
+    ticket - билетная блокировка: fetch-and-add выдаёт номер билета, процессор
+             ждёт, пока now_serving не станет равным ему, и обслуживание идёт
+             строго по очереди.
+
+В критической секции процессор увеличивает общий счётчик. Программы отмечают
+вход в критическую секцию и выход из неё в Occupancy, и если в секции
+оказываются два процессора сразу, прогон прерывается с RuntimeError.
+
+Демо:
+python spinlocks.py 100 8
+"""
+
+from __future__ import annotations
+import random
+import sys
+from collections import Counter
+from typing import Callable, Dict, Generator, List
+
+import settings
+from events import EventBus, EventKind
+from protocol import CPU, RAM, CacheController
+
+LOCK_ADDRESS = 0
+# Для билетной блокировки LOCK_ADDRESS - следующий билет
+NOW_SERVING_ADDRESS = 1
+COUNTER_ADDRESS = 2
+
+# События шины, которые считаются трафиком когерентности
+TRAFFIC_EVENTS = {
+    "transactions": EventKind.ADDRESS_BUS,
+    "invalidations": EventKind.INVALIDATION,
+    "interventions": EventKind.INTERVENTION,
+    "data_transfers": EventKind.DATA_BUS,
+    "copy_backs": EventKind.COPY_BACK,
+    "requests": EventKind.OPERATION,
+}
+
+Program = Generator[None, None, None]
+
+
+class Occupancy:
+    """Сколько процессоров сейчас находится в критической секции блокировки."""
+
+    def __init__(self, lock: str):
+        self.lock = lock
+        self.count = 0
+
+    def enter(self, cpu: CPU):
+        self.count += 1
+        if self.count > 1:
+            raise RuntimeError(
+                f"{self.lock}: CPU {cpu.index} entered a critical section "
+                f"occupied by another CPU"
+            )
+
+    def leave(self):
+        self.count -= 1
+
+
+def _critical_section(cpu: CPU, length: int, occupancy: Occupancy) -> Program:
+    # Процессор остаётся в секции между шагами, пока остальные крутятся
+    occupancy.enter(cpu)
+    for _ in range(length):
+        cpu.increment(COUNTER_ADDRESS)
+        yield
+    occupancy.leave()
+
+
+def tas_lock(
+    cpu: CPU, acquisitions: int, critical_section: int, occupancy: Occupancy
+) -> Program:
+    for _ in range(acquisitions):
+        while True:
+            old = cpu.test_and_set(LOCK_ADDRESS)
+            yield
+            if old == 0:
+                break
+        yield from _critical_section(cpu, critical_section, occupancy)
+        cpu.exchange(LOCK_ADDRESS, 0)
+        yield
+
+
+def ttas_lock(
+    cpu: CPU, acquisitions: int, critical_section: int, occupancy: Occupancy
+) -> Program:
+    for _ in range(acquisitions):
+        while True:
+            # Пока блокировка занята, чтения попадают в свою копию строки
+            while True:
+                value = cpu.read(LOCK_ADDRESS)
+                yield
+                if value == 0:
+                    break
+            old = cpu.test_and_set(LOCK_ADDRESS)
+            yield
+            if old == 0:
+                break
+        yield from _critical_section(cpu, critical_section, occupancy)
+        cpu.exchange(LOCK_ADDRESS, 0)
+        yield
+
+
+def ticket_lock(
+    cpu: CPU, acquisitions: int, critical_section: int, occupancy: Occupancy
+) -> Program:
+    for _ in range(acquisitions):
+        ticket = cpu.fetch_and_add(LOCK_ADDRESS)
+        yield
+        while True:
+            now_serving = cpu.read(NOW_SERVING_ADDRESS)
+            yield
+            if now_serving == ticket:
+                break
+        yield from _critical_section(cpu, critical_section, occupancy)
+        cpu.fetch_and_add(NOW_SERVING_ADDRESS)
+        yield
+
+
+LOCK_WORKLOADS: Dict[str, Callable[[CPU, int, int, Occupancy], Program]] = {
+    "tas": tas_lock,
+    "ttas": ttas_lock,
+    "ticket": ticket_lock,
+}
+
+
+class LockStats:
+    """Трафик когерентности за прогон нагрузки: traffic[вид] - число событий
+    шины из TRAFFIC_EVENTS, acquisitions - число захватов блокировки."""
+
+    def __init__(self, lock: str, cpu_count: int, acquisitions: int):
+        self.lock = lock
+        self.cpu_count = cpu_count
+        self.acquisitions = acquisitions
+        self.traffic: Counter = Counter()
+
+    def per_acquisition(self) -> Dict[str, float]:
+        return {
+            kind: self.traffic[kind] / self.acquisitions for kind in TRAFFIC_EVENTS
+        }
+
+    def summary(self) -> Dict:
+        return {
+            "lock": self.lock,
+            "cpus": self.cpu_count,
+            "acquisitions": self.acquisitions,
+            **{kind: round(value, 2) for kind, value in self.per_acquisition().items()},
+        }
+
+
+def run_lock_workload(
+    lock: str,
+    cpu_count: int,
+    acquisitions: int = 100,
+    critical_section: int = 1,
+    seed=None,
+    lines_count: int = settings.CACH_CACHLINES_COUNT,
+    channels_count: int = settings.CACH_CHANNELS_COUNT,
+    ram_size: int = settings.RAM_SIZE,
+) -> LockStats:
+    """Каждый из cpu_count процессоров захватывает блокировку lock (ключ
+    LOCK_WORKLOADS) acquisitions раз и выполняет critical_section инкрементов
+    общего счётчика. Бросает RuntimeError, как только в критической секции
+    оказываются два процессора."""
+    events = EventBus()
+    ram = RAM(ram_size, events=events)
+    cpus = [CPU(cpu_index, events=events) for cpu_index in range(cpu_count)]
+    CacheController(ram, cpus, lines_count, channels_count, events=events)
+
+    stats = LockStats(lock, cpu_count, cpu_count * acquisitions)
+    handlers = {}
+    for kind, event_kind in TRAFFIC_EVENTS.items():
+        handlers[event_kind] = lambda *args, kind=kind: stats.traffic.update((kind,))
+        events.subscribe(event_kind, handlers[event_kind])
+
+    workload = LOCK_WORKLOADS[lock]
+    occupancy = Occupancy(lock)
+    programs: List[Program] = [
+        workload(cpu, acquisitions, critical_section, occupancy) for cpu in cpus
+    ]
+    generator = random.Random(seed) if seed is not None else None
+    while programs:
+        if generator is not None:
+            order = [generator.choice(programs)]
+        else:
+            order = list(programs)
+        for program in order:
+            try:
+                next(program)
+            except StopIteration:
+                programs.remove(program)
+
+    for event_kind, handler in handlers.items():
+        events.unsubscribe(event_kind, handler)
+
+    return stats
+
+
+if __name__ == "__main__":
+    acquisitions = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    # С короткой критической секцией ожидающие tas успевают сделать лишь
+    # несколько попыток, и разница между блокировками почти не видна
+    critical_section = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+
+    columns = ["lock", "cpus", "transactions", "invalidations", "interventions"]
+    print("".join(f"{column:>15}" for column in columns))
+    for lock in LOCK_WORKLOADS:
+        for cpu_count in (1, 2, 4, 8, 16):
+            summary = run_lock_workload(
+                lock, cpu_count, acquisitions, critical_section
+            ).summary()
+            print("".join(f"{summary[column]:>15}" for column in columns))
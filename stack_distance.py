@@ -0,0 +1,271 @@
+"""Кривые доли промахов для всех размеров кэша за один проход по трассе.
+
+Для каждого процессора и каждого числа наборов считаются стековые расстояния
+(сколько разных адресов того же набора было запрошено между двумя обращениями
+к адресу). Обращение с расстоянием d попадает в кэш с LRU замещением при
+ассоциативности больше d, поэтому одна гистограмма расстояний даёт долю промахов
+сразу для всех ассоциативностей. Модель использует MRU, так что для неё это
+приближение. Расстояния считаются деревом Фенвика по номерам обращений к набору.
+Когда номера доходят до размера дерева, а живых адресов в наборе не больше
+половины, номера последних обращений переписываются подряд с нуля, поэтому
+память и время запроса зависят от числа адресов набора, а не от длины трассы.
+
+Инвалидации учитываются отдельно: обращение к адресу, который после прошлого
+обращения записал другой процессор, считается промахом когерентности при любом
+размере кэша.
+
+Демо:
+python stack_distance.py 100000
+"""
+
+from __future__ import annotations
+import random
+import sys
+from collections import Counter
+from typing import Dict, Iterable, List, Sequence
+
+import settings
+from protocol import OP_WRITE
+
+
+class _FenwickTree:
+    """Дерево Фенвика по отметкам 0/1, которое само увеличивается вдвое, когда
+    индекс выходит за его размер."""
+
+    def __init__(self, size: int = 64):
+        self.size = size
+        self.tree = [0] * (size + 1)
+        self.marks = bytearray(size)
+
+    def _grow(self, index: int):
+        size = self.size
+        while size <= index:
+            size *= 2
+
+        self.size = size
+        self.marks.extend(bytes(size - len(self.marks)))
+        self._rebuild()
+
+    def fill(self, count: int, size: int):
+        """Заменяет отметки на count единиц с индексами от 0 и размер на size."""
+        self.size = size
+        self.marks = bytearray(b"\1" * count + bytes(size - count))
+        self._rebuild()
+
+    def _rebuild(self):
+        # Пересобираем дерево за линейное время
+        size = self.size
+        tree = [0] * (size + 1)
+        for i, mark in enumerate(self.marks, start=1):
+            tree[i] += mark
+            parent = i + (i & -i)
+            if parent <= size:
+                tree[parent] += tree[i]
+        self.tree = tree
+
+    def add(self, index: int, delta: int):
+        if index >= self.size:
+            self._grow(index)
+
+        self.marks[index] += delta
+        tree = self.tree
+        size = self.size
+        i = index + 1
+        while i <= size:
+            tree[i] += delta
+            i += i & -i
+
+    def prefix_sum(self, index: int) -> int:
+        """Сумма отметок с индексами меньше index."""
+        tree = self.tree
+        total = 0
+        i = min(index, self.size)
+        while i > 0:
+            total += tree[i]
+            i -= i & -i
+        return total
+
+
+class _SetStack:
+    """LRU стек одного набора: время последнего обращения к каждому адресу
+    и отметки последних обращений в дереве Фенвика."""
+
+    def __init__(self):
+        self.time = 0
+        self.last_access: Dict[int, int] = {}
+        self.tree = _FenwickTree()
+
+    def access(self, address: int) -> int:
+        """Регистрирует обращение и возвращает стековое расстояние, либо -1 при
+        первом обращении к адресу."""
+        time = self.time
+        if time == self.tree.size and 2 * len(self.last_access) <= time:
+            time = self._compact()
+        self.time = time + 1
+        previous = self.last_access.get(address)
+
+        if previous is None:
+            distance = -1
+        else:
+            distance = self.tree.prefix_sum(time) - self.tree.prefix_sum(previous + 1)
+            self.tree.add(previous, -1)
+
+        self.tree.add(time, 1)
+        self.last_access[address] = time
+        return distance
+
+    def _compact(self) -> int:
+        """Нумерует последние обращения подряд с нуля в прежнем порядке и
+        возвращает следующий свободный номер."""
+        last_access = self.last_access
+        order = sorted(last_access, key=last_access.__getitem__)
+        self.last_access = {address: time for time, address in enumerate(order)}
+        self.tree.fill(len(order), max(64, 2 * len(order)))
+        return len(order)
+
+
+class _Histogram:
+    def __init__(self):
+        self.accesses = 0
+        self.cold = 0
+        self.distances = Counter()
+        # Расстояния обращений, перед которыми адрес инвалидировал другой процессор
+        self.invalidated_distances = Counter()
+
+
+class MissRatioCurves:
+    """Гистограммы стековых расстояний для каждой пары (процессор, число наборов)
+    и построенные по ним доли промахов."""
+
+    def __init__(self, cpu_count: int, sets_counts: List[int]):
+        self.cpu_count = cpu_count
+        self.sets_counts = sets_counts
+        self.histograms = {
+            (cpu_index, sets_count): _Histogram()
+            for cpu_index in range(cpu_count)
+            for sets_count in sets_counts
+        }
+
+    def misses(
+        self, cpu_index: int, sets_count: int, associativity: int, coherence=True
+    ) -> int:
+        histogram = self.histograms[cpu_index, sets_count]
+        misses = histogram.cold
+        for distance, count in histogram.distances.items():
+            if distance >= associativity:
+                misses += count
+        if coherence:
+            for distance, count in histogram.invalidated_distances.items():
+                if distance < associativity:
+                    misses += count
+        return misses
+
+    def miss_ratio(
+        self,
+        sets_count: int,
+        associativity: int,
+        cpu_index: int = None,
+        coherence=True,
+    ) -> float:
+        """Доля промахов кэша из sets_count наборов с заданной ассоциативностью для
+        одного процессора или для всех вместе. coherence=False даёт кривую без
+        учёта инвалидаций."""
+        cpu_indexes = range(self.cpu_count) if cpu_index is None else [cpu_index]
+        accesses = sum(
+            self.histograms[i, sets_count].accesses for i in cpu_indexes
+        )
+        if accesses == 0:
+            return 0.0
+
+        misses = sum(
+            self.misses(i, sets_count, associativity, coherence) for i in cpu_indexes
+        )
+        return misses / accesses
+
+    def curves(
+        self, max_associativity: int, cpu_index: int = None, coherence=True
+    ) -> Dict[int, List[float]]:
+        """Для каждого числа наборов - список долей промахов при ассоциативности
+        от 1 до max_associativity."""
+        return {
+            sets_count: [
+                self.miss_ratio(sets_count, associativity, cpu_index, coherence)
+                for associativity in range(1, max_associativity + 1)
+            ]
+            for sets_count in self.sets_counts
+        }
+
+
+def compute_miss_ratio_curves(
+    cpu_indexes: Iterable[int],
+    operations: Iterable[int],
+    addresses: Iterable[int],
+    sets_counts: Sequence[int] = None,
+    cpu_count: int = settings.CPU_COUNT,
+) -> MissRatioCurves:
+    """Один проход по трассе. Подходят любые итерируемые последовательности, в том
+    числе генераторы. По умолчанию число наборов перебирается по степеням двойки
+    до RAM_SIZE."""
+    if sets_counts is None:
+        sets_counts = []
+        sets_count = 1
+        while sets_count <= settings.RAM_SIZE:
+            sets_counts.append(sets_count)
+            sets_count *= 2
+
+    curves = MissRatioCurves(cpu_count, list(sets_counts))
+    stacks = {
+        (cpu_index, sets_count): [_SetStack() for _ in range(sets_count)]
+        for cpu_index in range(cpu_count)
+        for sets_count in sets_counts
+    }
+    # Адреса, которые другие процессоры записали после последнего обращения
+    invalidated = [set() for _ in range(cpu_count)]
+    # Процессоры, у которых адрес может лежать в кэше
+    sharers: Dict[int, set] = {}
+
+    for cpu_index, operation, address in zip(cpu_indexes, operations, addresses):
+        was_invalidated = address in invalidated[cpu_index]
+        if was_invalidated:
+            invalidated[cpu_index].discard(address)
+
+        for sets_count in sets_counts:
+            distance = stacks[cpu_index, sets_count][address % sets_count].access(
+                address
+            )
+            histogram = curves.histograms[cpu_index, sets_count]
+            histogram.accesses += 1
+            if distance < 0:
+                histogram.cold += 1
+            else:
+                histogram.distances[distance] += 1
+                if was_invalidated:
+                    histogram.invalidated_distances[distance] += 1
+
+        address_sharers = sharers.setdefault(address, set())
+        if operation == OP_WRITE:
+            for sharer in address_sharers:
+                if sharer != cpu_index:
+                    invalidated[sharer].add(address)
+            address_sharers.clear()
+        address_sharers.add(cpu_index)
+
+    return curves
+
+
+if __name__ == "__main__":
+    operations_count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    generator = random.Random(0)
+    trace = [
+        (
+            generator.randrange(settings.CPU_COUNT),
+            generator.randrange(2),
+            generator.randrange(settings.RAM_SIZE),
+        )
+        for _ in range(operations_count)
+    ]
+    cpu_indexes, operations, addresses = zip(*trace)
+
+    curves = compute_miss_ratio_curves(cpu_indexes, operations, addresses)
+    for sets_count, ratios in curves.curves(settings.RAM_SIZE).items():
+        print(sets_count, " ".join(f"{ratio:.3f}" for ratio in ratios))
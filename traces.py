@@ -0,0 +1,199 @@
+"""Потоковый импорт трасс обращений к памяти реальных программ.
+
+Поддерживаются форматы:
+    lackey - вывод valgrind --tool=lackey --trace-mem=yes: строки
+             "I  addr,size", " L addr,size", " S addr,size", " M addr,size";
+    csv    - строки "tid op addr size" через пробелы или запятые, op - R/W
+             (или L/S/M, 0/1), адрес десятичный или шестнадцатеричный с 0x.
+Сжатые gzip файлы распознаются по сигнатуре в первых байтах, а не по расширению,
+и распаковываются на лету.
+
+Записи разбираются по одной и сразу отдаются дальше, промежуточных списков нет.
+Потоки программы отображаются на процессоры по порядку появления (по кругу), а
+адреса сворачиваются в модель: номер строки (address // line_size) по модулю
+размера памяти. Обращение, которое пересекает границу строки, даёт по записи
+на каждую затронутую строку. Чтение - OP_READ, запись и модификация - OP_WRITE
+(в модели запись всегда чтение с последующей записью).
+
+Демо:
+python traces.py trace.out.gz
+"""
+
+from __future__ import annotations
+import gzip
+import io
+import sys
+from array import array
+from collections import Counter
+from typing import Dict, Iterable, Iterator, TextIO, Tuple
+
+import settings
+from protocol import OP_READ, OP_WRITE, CacheController
+
+OPERATION_CODES = {
+    "R": OP_READ,
+    "L": OP_READ,
+    "0": OP_READ,
+    "W": OP_WRITE,
+    "S": OP_WRITE,
+    "M": OP_WRITE,
+    "1": OP_WRITE,
+}
+
+# Запись сырой трассы: (поток, операция, адрес в байтах, размер в байтах)
+RawRecord = Tuple[int, int, int, int]
+
+
+def open_trace(path: str) -> TextIO:
+    """Открывает текстовую трассу, при необходимости распаковывая gzip."""
+    with open(path, "rb") as file:
+        compressed = file.read(2) == b"\x1f\x8b"
+    if compressed:
+        return io.TextIOWrapper(gzip.open(path, "rb"), errors="replace")
+    return open(path, errors="replace")
+
+
+def parse_lackey(
+    lines: Iterable[str], instructions: bool = False
+) -> Iterator[RawRecord]:
+    """Разбирает вывод Lackey. Lackey не различает потоки, поэтому поток всегда 0.
+    Выборка инструкций (I) пропускается, если не задано instructions."""
+    for line in lines:
+        kind = line[:2].strip()
+        if kind not in {"L", "S", "M"} and not (instructions and kind == "I"):
+            # Служебные строки valgrind (==pid==) и выборка инструкций
+            continue
+        address, _, size = line[2:].strip().partition(",")
+        try:
+            yield 0, OPERATION_CODES.get(kind, OP_READ), int(address, 16), int(size)
+        except ValueError:
+            continue
+
+
+def parse_csv(lines: Iterable[str]) -> Iterator[RawRecord]:
+    """Разбирает строки "tid op addr size". Пустые строки, комментарии (#) и
+    заголовок пропускаются."""
+    for line in lines:
+        fields = line.replace(",", " ").split()
+        if len(fields) < 3 or fields[0].startswith("#"):
+            continue
+        operation = OPERATION_CODES.get(fields[1].upper())
+        if operation is None:
+            continue
+        try:
+            yield (
+                int(fields[0]),
+                operation,
+                int(fields[2], 0),
+                int(fields[3]) if len(fields) > 3 else 1,
+            )
+        except ValueError:
+            continue
+
+
+PARSERS = {"lackey": parse_lackey, "csv": parse_csv}
+
+
+def detect_format(path: str) -> str:
+    """Определяет формат по первой строке с данными."""
+    with open_trace(path) as file:
+        for line in file:
+            if line.startswith("==") or not line.strip():
+                continue
+            kind = line[:2].strip()
+            if kind in {"I", "L", "S", "M"} and "," in line:
+                return "lackey"
+            return "csv"
+    return "csv"
+
+
+class TraceMapper:
+    """Переводит записи сырой трассы в запросы модели (cpu_index, операция, адрес)."""
+
+    def __init__(
+        self,
+        cpu_count: int = settings.CPU_COUNT,
+        ram_size: int = settings.RAM_SIZE,
+        line_size: int = settings.TRACE_LINE_SIZE,
+    ):
+        self.cpu_count = cpu_count
+        self.ram_size = ram_size
+        self.line_size = line_size
+        # Поток программы -> процессор
+        self.cpus: Dict[int, int] = {}
+
+    def map(self, records: Iterable[RawRecord]) -> Iterator[Tuple[int, int, int]]:
+        cpus = self.cpus
+        line_size = self.line_size
+        ram_size = self.ram_size
+
+        for tid, operation, address, size in records:
+            cpu_index = cpus.get(tid)
+            if cpu_index is None:
+                cpu_index = cpus[tid] = len(cpus) % self.cpu_count
+
+            first_line = address // line_size
+            last_line = (address + max(size, 1) - 1) // line_size
+            yield cpu_index, operation, first_line % ram_size
+            for line in range(first_line + 1, last_line + 1):
+                yield cpu_index, operation, line % ram_size
+
+
+def import_trace(
+    path: str,
+    trace_format: str = None,
+    mapper: TraceMapper = None,
+) -> Iterator[Tuple[int, int, int]]:
+    """Лениво читает трассу из файла и отдаёт запросы (cpu_index, операция, адрес).
+    Формат определяется автоматически, если не указан."""
+    if trace_format is None:
+        trace_format = detect_format(path)
+    if mapper is None:
+        mapper = TraceMapper()
+
+    with open_trace(path) as file:
+        yield from mapper.map(PARSERS[trace_format](file))
+
+
+def batches(
+    requests: Iterable[Tuple[int, int, int]], batch_size: int = 1 << 16
+) -> Iterator[Tuple[array, array, array]]:
+    """Собирает запросы в массивы для CacheController.run_batch по batch_size штук.
+    В памяти одновременно находится только один пакет."""
+    cpu_indexes, operations, addresses = array("b"), array("b"), array("q")
+    for cpu_index, operation, address in requests:
+        cpu_indexes.append(cpu_index)
+        operations.append(operation)
+        addresses.append(address)
+        if len(addresses) >= batch_size:
+            yield cpu_indexes, operations, addresses
+            cpu_indexes, operations, addresses = array("b"), array("b"), array("q")
+    if addresses:
+        yield cpu_indexes, operations, addresses
+
+
+def run_trace(
+    cache_controller: CacheController,
+    requests: Iterable[Tuple[int, int, int]],
+    batch_size: int = 1 << 16,
+) -> Dict[str, int]:
+    """Прогоняет запросы через кэш контроллер пакетами и возвращает сводку."""
+    summary = Counter()
+    for batch in batches(requests, batch_size):
+        summary.update(cache_controller.run_batch(*batch).summary())
+    return dict(summary)
+
+
+if __name__ == "__main__":
+    from protocol import CPU, RAM
+
+    ram = RAM(settings.RAM_SIZE)
+    cpus = [CPU(cpu_index) for cpu_index in range(settings.CPU_COUNT)]
+    cache_controller = CacheController(
+        ram, cpus, settings.CACH_CACHLINES_COUNT, settings.CACH_CHANNELS_COUNT
+    )
+
+    mapper = TraceMapper()
+    summary = run_trace(cache_controller, import_trace(sys.argv[1], mapper=mapper))
+    print(summary)
+    print("threads -> CPUs:", mapper.cpus)
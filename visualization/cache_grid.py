@@ -1,11 +1,16 @@
-"""Визуализация кэша процессора.
+"""Визуализация кэша процессора. Метки создаются только для видимых кэш строк,
+остальные доступны прокруткой.
 
 Демо:
-python cache_grid.py
+python -m visualization.cache_grid
 """
 
 import tkinter as tk
 
+from .virtual_rows import VirtualRows
+
+ROW_HEIGHT = 20
+
 
 class CacheGrid:
     def __init__(
@@ -21,68 +26,62 @@ class CacheGrid:
         self.default_state = "I"
         self.default_empty = "--"
 
+        # Содержимое строк отображаемого кэша, None - пустая строка
+        self.lines = [None] * (channels_count * cache_lines_count)
+
         self.frame = tk.LabelFrame(parent, text=" " + name + " ")
         self.frame.place(x=x, y=y, width=width, height=height)
 
-        for i in range(channels_count):
-            tk.Label(self.frame, text=str(i), borderwidth=1, relief="solid").grid(
-                row=i * cache_lines_count,
-                column=0,
-                rowspan=cache_lines_count,
-                sticky="nsew",
+        self.rows = VirtualRows(
+            self.frame,
+            rows_count=len(self.lines),
+            visible_rows_count=max(1, (height - 20) // ROW_HEIGHT),
+            column_weights=(2, 3, 6, 6, 6),
+            get_row=self._get_row,
+        )
+
+    def _get_row(self, row):
+        channel_index = row // self.cache_lines_count
+        line = self.lines[row]
+        if line is None:
+            return (
+                channel_index,
+                self.default_state,
+                self.default_empty,
+                self.default_empty,
+                self.default_empty,
             )
+        return (channel_index,) + line
 
-        self.labels = []
+    def set_name(self, name):
+        self.frame.config(text=" " + name + " ")
 
-        for row in range(channels_count * cache_lines_count):
-            self.labels.append([])
-            for col in range(1, 5):
-                text = self.default_state if col == 1 else self.default_empty
-                label = tk.Label(self.frame, text=text, borderwidth=1, relief="solid")
-                label.grid(
-                    row=row, column=col, rowspan=1, sticky="nsew", padx=0, pady=0
-                )
-                self.labels[row].append(label)
-
-        # Конфигурация веса строк и столбцов для растягивания
-        for i in range(channels_count * cache_lines_count):
-            self.frame.rowconfigure(i, weight=1)
-
-        self.frame.columnconfigure(0, weight=2)
-        self.frame.columnconfigure(1, weight=3)
-        self.frame.columnconfigure(2, weight=6)
-        self.frame.columnconfigure(3, weight=6)
-        self.frame.columnconfigure(4, weight=6)
+    def show(self, lines):
+        """Показывает другой набор строк, например кэш другого процессора."""
+        self.lines = lines
+        self.rows.refresh()
 
     def reset(self):
-        for state_label, address_label, data_label, counter_label in self.labels:
-            state_label.config(text=self.default_state)
-            address_label.config(text=self.default_empty)
-            data_label.config(text=self.default_empty)
-            counter_label.config(text=self.default_empty)
+        self.lines[:] = [None] * len(self.lines)
+        self.rows.refresh()
 
     def update_cache_line(
         self, channel_index, cache_line_index, state, address, data, policy_counter
     ):
-        state_label, address_label, data_label, policy_counter_label = self.labels[
-            channel_index * self.cache_lines_count + cache_line_index
-        ]
-
-        state_label.config(text=str(state))
-        address_label.config(text=str(address))
-        data_label.config(text=str(data))
-        policy_counter_label.config(text=str(policy_counter))
+        row = channel_index * self.cache_lines_count + cache_line_index
+        self.lines[row] = (state, address, data, policy_counter)
+        self.rows.refresh_row(row)
 
 
 if __name__ == "__main__":
     # Пример использования
     root = tk.Tk()
     root.geometry("400x400")
-    grid = CacheGrid(root, "Cache", 20, 20, 200, 150, 2, 2)
+    grid = CacheGrid(root, "Cache", 20, 20, 200, 150, 4, 4)
 
     root.after(3000, lambda: grid.update_cache_line(0, 1, "E", "a1", "00", 1))
 
-    root.after(5000, lambda: grid.update_cache_line(1, 0, "S", "a0", "11", 1))
+    root.after(5000, lambda: grid.update_cache_line(3, 3, "S", "a0", "11", 1))
 
     root.after(7000, grid.reset)
 
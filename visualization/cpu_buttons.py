@@ -1,4 +1,6 @@
-"""Интерфейс для взаимодействия пользователя и процессора.
+"""Интерфейс для взаимодействия пользователя и процессора: поле для адреса и кнопки
+чтения и записи. Кнопки не создаются на каждый адрес, поэтому размер интерфейса
+не зависит от объёма памяти.
 
 Демо:
 python cpu_buttons.py
@@ -8,10 +10,19 @@ import tkinter as tk
 
 
 class CPUButtons:
-    def __init__(self, root, name, x, y, rows, read_callback=None, write_callback=None):
+    def __init__(
+        self,
+        root,
+        name,
+        x,
+        y,
+        addresses_count,
+        read_callback=None,
+        write_callback=None,
+    ):
         self.x = x
         self.y = y
-        self.rows = rows
+        self.addresses_count = addresses_count
         self.read_callback = read_callback
         self.write_callback = write_callback
 
@@ -21,23 +32,52 @@ class CPUButtons:
         self.create_buttons()
 
     def create_buttons(self):
-        for i in range(self.rows):
-            pady = (0, 3) if i == self.rows - 1 else 0
-            read_button = tk.Button(
-                self.frame,
-                text=f"read #{i}",
-                width=10,
-                command=lambda i=i: self.read_callback(i),
-            )
-            read_button.grid(row=i, column=0, padx=(2, 0), pady=pady)
-
-            write_button = tk.Button(
-                self.frame,
-                text=f"write #{i}",
-                width=10,
-                command=lambda i=i: self.write_callback(i),
-            )
-            write_button.grid(row=i, column=1, padx=(0, 3), pady=pady)
+        self.address_entry = tk.Spinbox(
+            self.frame, from_=0, to=self.addresses_count - 1, width=8
+        )
+        self.address_entry.grid(row=0, column=0, columnspan=2, padx=3, pady=(0, 3))
+        self.address_entry.bind("<Return>", lambda event: self._on_click(True))
+
+        read_button = tk.Button(
+            self.frame,
+            text="read",
+            width=10,
+            command=lambda: self._on_click(True),
+        )
+        read_button.grid(row=1, column=0, padx=(2, 0), pady=(0, 3))
+
+        write_button = tk.Button(
+            self.frame,
+            text="write",
+            width=10,
+            command=lambda: self._on_click(False),
+        )
+        write_button.grid(row=1, column=1, padx=(0, 3), pady=(0, 3))
+
+    def set_name(self, name):
+        self.frame.config(text=" " + name + " ")
+
+    def get_address(self):
+        """Возвращает введённый адрес или None, если он не число или вне памяти."""
+        try:
+            address = int(self.address_entry.get())
+        except ValueError:
+            return None
+
+        if 0 <= address < self.addresses_count:
+            return address
+        return None
+
+    def _on_click(self, read: bool):
+        address = self.get_address()
+        if address is None:
+            self.address_entry.config(fg="red")
+            return
+
+        self.address_entry.config(fg="black")
+        callback = self.read_callback if read else self.write_callback
+        if callback is not None:
+            callback(address)
 
 
 if __name__ == "__main__":
@@ -51,6 +91,6 @@ if __name__ == "__main__":
     def write_callback(index):
         print(f"Write button pressed for index {index}")
 
-    CPUButtons(root, "CPU 0", 100, 100, 5, read_callback, write_callback)
+    CPUButtons(root, "CPU 0", 100, 100, 16, read_callback, write_callback)
 
     root.mainloop()
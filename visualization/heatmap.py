@@ -0,0 +1,139 @@
+"""Тепловая карта обращений к памяти и наборам кэшей. Цвет клетки показывает
+значение выбранной метрики из AccessCounters относительно максимума. Карта
+перерисовывается не чаще, чем раз в interval_ms, и только если счётчики изменились.
+
+Демо:
+python -m visualization.heatmap
+"""
+
+import math
+import tkinter as tk
+
+from access_counters import METRICS, AccessCounters
+
+# Больше клеток на карте памяти не рисуем, соседние адреса суммируются
+MAX_RAM_CELLS = 1024
+
+
+def _heat_color(value, maximum):
+    """От белого (0) к красному (максимум)."""
+    if maximum == 0 or value == 0:
+        return "#ffffff"
+    level = int(255 * (1 - value / maximum))
+    return "#ff%02x%02x" % (level, level)
+
+
+class HeatmapPanel:
+    def __init__(
+        self, parent, x, y, width, height, counters: AccessCounters, interval_ms=250
+    ):
+        self.counters = counters
+        self.interval_ms = interval_ms
+        self.drawn_version = None
+
+        self.frame = tk.LabelFrame(parent, text=" HEATMAP ")
+        self.frame.place(x=x, y=y, width=width, height=height)
+
+        self.metric = tk.StringVar(self.frame, value=METRICS[0])
+        selector = tk.OptionMenu(
+            self.frame, self.metric, *METRICS, command=lambda _: self.redraw()
+        )
+        selector.place(x=5, y=0)
+
+        self.max_label = tk.Label(self.frame, text="")
+        self.max_label.place(x=160, y=5)
+
+        self.canvas = tk.Canvas(self.frame, width=width - 10, height=height - 60)
+        self.canvas.place(x=5, y=35)
+
+        canvas_width = width - 20
+        canvas_height = height - 70
+
+        # Карта памяти - левая половина, карта наборов (процессоры x наборы) - правая
+        self.ram_cells_count = min(counters.ram_size, MAX_RAM_CELLS)
+        self.addresses_per_cell = math.ceil(counters.ram_size / self.ram_cells_count)
+        self.ram_rects = self._create_grid(
+            0, 0, canvas_width // 2 - 10, canvas_height, self.ram_cells_count, None
+        )
+        self.set_rects = self._create_grid(
+            canvas_width // 2 + 10,
+            0,
+            canvas_width // 2 - 10,
+            canvas_height,
+            counters.cpu_count * counters.lines_count,
+            counters.lines_count,
+        )
+
+    def _create_grid(self, x, y, width, height, cells_count, columns):
+        if columns is None:
+            columns = math.ceil(math.sqrt(cells_count * width / max(1, height)))
+        rows = math.ceil(cells_count / columns)
+        cell_width = width / columns
+        cell_height = height / rows
+
+        rects = []
+        for i in range(cells_count):
+            column, row = i % columns, i // columns
+            rects.append(
+                self.canvas.create_rectangle(
+                    x + column * cell_width,
+                    y + row * cell_height,
+                    x + (column + 1) * cell_width,
+                    y + (row + 1) * cell_height,
+                    fill="#ffffff",
+                    outline="#c0c0c0",
+                )
+            )
+        return rects
+
+    def start(self):
+        """Запускает периодическую перерисовку."""
+        if self.drawn_version != self.counters.version:
+            self.redraw()
+        self.frame.after(self.interval_ms, self.start)
+
+    def redraw(self):
+        metric = self.metric.get()
+        self.drawn_version = self.counters.version
+
+        ram_values = self.counters.ram[metric]
+        if self.addresses_per_cell > 1:
+            step = self.addresses_per_cell
+            ram_values = [
+                sum(ram_values[i : i + step]) for i in range(0, len(ram_values), step)
+            ]
+        set_values = self.counters.sets[metric]
+
+        ram_maximum = max(ram_values, default=0)
+        set_maximum = max(set_values, default=0)
+        self.max_label.config(text=f"max: address {ram_maximum}, set {set_maximum}")
+
+        for rect, value in zip(self.ram_rects, ram_values):
+            self.canvas.itemconfig(rect, fill=_heat_color(value, ram_maximum))
+        for rect, value in zip(self.set_rects, set_values):
+            self.canvas.itemconfig(rect, fill=_heat_color(value, set_maximum))
+
+
+if __name__ == "__main__":
+    import random
+
+    from protocol import CPU, RAM, CacheController
+
+    ram = RAM(256)
+    cpus = [CPU(cpu_index) for cpu_index in range(4)]
+    cache_controller = CacheController(ram, cpus, 4, 4)
+    counters = AccessCounters(cache_controller)
+
+    root = tk.Tk()
+    root.geometry("700x400")
+    panel = HeatmapPanel(root, 10, 10, 680, 380, counters)
+    panel.start()
+
+    def run():
+        for _ in range(100):
+            address = min(int(random.paretovariate(1)), 255)
+            cpus[random.randrange(4)].increment(address)
+        root.after(50, run)
+
+    run()
+    root.mainloop()
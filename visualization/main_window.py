@@ -4,6 +4,7 @@ from typing import List
 import settings
 
 from .arrows import Color, HorizontalArrow, VerticalArrow
+from .cache_grid import ROW_HEIGHT as CACHE_GRID_ROW_HEIGHT
 from .cache_grid import CacheGrid
 from .cpu_buttons import CPUButtons
 from .ram_grid import RAMGrid
@@ -25,6 +26,9 @@ class MainWindow:
         self.counter_label = tk.Label(self.root, text="BUS CYCLES: 0")
         self.counter_label.place(x=1350, y=45)  # Указываем координаты для размещения
 
+        self.tick_label = tk.Label(self.root, text="TICK: 0")
+        self.tick_label.place(x=1350, y=65)
+
         self._draw_buses()
         self._draw_ram()
         self._draw_cpus()
@@ -40,9 +44,40 @@ class MainWindow:
             y=settings.BOTTOM_RIGHT_CORNER[1] - 85,
         )
 
+        self.step_back_btn = tk.Button(self.root, text="Step back", width=9)
+        self.step_back_btn.place(
+            x=settings.BOTTOM_RIGHT_CORNER[0] - 300,
+            y=settings.BOTTOM_RIGHT_CORNER[1] - 55,
+        )
+        self.jump_entry = tk.Entry(self.root, width=8)
+        self.jump_entry.place(
+            x=settings.BOTTOM_RIGHT_CORNER[0] - 215,
+            y=settings.BOTTOM_RIGHT_CORNER[1] - 52,
+        )
+        self.jump_btn = tk.Button(self.root, text="Jump", width=5)
+        self.jump_btn.place(
+            x=settings.BOTTOM_RIGHT_CORNER[0] - 150,
+            y=settings.BOTTOM_RIGHT_CORNER[1] - 55,
+        )
+
     def set_reset_callback(self, callback):
         self.reset_btn.config(command=callback)
 
+    def set_journal_callbacks(self, step_back_callback, jump_callback):
+        """jump_callback получает номер такта, введённый пользователем."""
+        self.step_back_btn.config(command=step_back_callback)
+
+        def on_jump(event=None):
+            text = self.jump_entry.get().strip()
+            if text.isdigit():
+                jump_callback(int(text))
+
+        self.jump_btn.config(command=on_jump)
+        self.jump_entry.bind("<Return>", on_jump)
+
+    def set_tick(self, tick: int):
+        self.tick_label.config(text=f"TICK: {tick}")
+
     def mainloop(self):
         self.root.mainloop()
 
@@ -59,13 +94,8 @@ class MainWindow:
         self.ram_to_data_bus.reset()
         self.activation_counter = 0
 
-        for cpu_index in range(settings.CPU_COUNT):
-            self.cache_to_address_buses[cpu_index].reset()
-            self.cache_to_data_buses[cpu_index].reset()
-            self.cache_to_shared_buses[cpu_index].reset()
-
-            self.cpu_to_cache_read_buses[cpu_index].reset()
-            self.cpu_to_cache_write_buses[cpu_index].reset()
+        for column in self.cpu_columns:
+            column.reset_buses()
 
     def reset(self):
         global activation_counter
@@ -75,8 +105,55 @@ class MainWindow:
         self.reset_buses()
         self.ram_grid.reset()
 
-        for cpu_index in range(settings.CPU_COUNT):
-            self.cache_grids[cpu_index].reset()
+        self.cache_lines.clear()
+        for column in self.cpu_columns:
+            column.bind(column.cpu_index, self._get_cache_lines(column.cpu_index))
+
+    def set_cpu_callbacks(self, read_callback, write_callback):
+        """Колбэки вызываются с индексом процессора и адресом, который ввёл
+        пользователь."""
+        self.cpu_read_callback = read_callback
+        self.cpu_write_callback = write_callback
+
+    def _get_cache_lines(self, cpu_index):
+        """Содержимое кэша процессора для CacheGrid. Создаётся при первом
+        обращении, так что для невидимых процессоров память не тратится."""
+        lines = self.cache_lines.get(cpu_index)
+        if lines is None:
+            lines = [None] * (
+                settings.CACH_CHANNELS_COUNT * settings.CACH_CACHLINES_COUNT
+            )
+            self.cache_lines[cpu_index] = lines
+        return lines
+
+    def _get_column(self, cpu_index):
+        """Возвращает столбец, в котором сейчас показан процессор, или None."""
+        slot = cpu_index - self.first_cpu
+        if 0 <= slot < len(self.cpu_columns):
+            return self.cpu_columns[slot]
+        return None
+
+    def scroll_to_cpu(self, cpu_index):
+        cpu_index = max(0, min(cpu_index, settings.CPU_COUNT - len(self.cpu_columns)))
+        if cpu_index == self.first_cpu:
+            return
+
+        self.first_cpu = cpu_index
+        for slot, column in enumerate(self.cpu_columns):
+            column.bind(cpu_index + slot, self._get_cache_lines(cpu_index + slot))
+
+        if self.cpu_scrollbar is not None:
+            self.cpu_scrollbar.set(
+                self.first_cpu / settings.CPU_COUNT,
+                (self.first_cpu + len(self.cpu_columns)) / settings.CPU_COUNT,
+            )
+
+    def _on_cpu_scroll(self, action, value, units=None):
+        if action == tk.MOVETO:
+            self.scroll_to_cpu(round(float(value) * settings.CPU_COUNT))
+        elif action == tk.SCROLL:
+            step = len(self.cpu_columns) if units == tk.PAGES else 1
+            self.scroll_to_cpu(self.first_cpu + int(value) * step)
 
     def _draw_buses(self):
         self.data_bus = HorizontalArrow(
@@ -132,87 +209,190 @@ class MainWindow:
         )
 
     def _draw_cpus(self):
-        self.cache_grids: List[CacheGrid] = []
-        self.cpu_btns: List[CPUButtons] = []
-
-        self.cache_to_data_buses: List[VerticalArrow] = []
-        self.cache_to_address_buses: List[VerticalArrow] = []
-        self.cache_to_shared_buses: List[VerticalArrow] = []
-
-        self.cpu_to_cache_read_buses: List[VerticalArrow] = []
-        self.cpu_to_cache_write_buses: List[VerticalArrow] = []
-
-        for cpu_index in range(settings.CPU_COUNT):
-            self.cache_to_data_buses.append(
-                VerticalArrow(
-                    self.canvas,
-                    x=settings.CPU_X_COORDS[cpu_index] + 105,
-                    y=settings.BUSES_Y_COORDS[0] + 5,
-                    length=settings.CPU_Y_COORD - settings.BUSES_Y_COORDS[0] - 5,
-                    active_color=Color.RED,
-                )
-            )
+        self.cpu_read_callback = None
+        self.cpu_write_callback = None
+        self.cache_lines = {}
+        self.first_cpu = 0
 
-            self.cache_to_address_buses.append(
-                VerticalArrow(
-                    self.canvas,
-                    x=settings.CPU_X_COORDS[cpu_index] + 63,
-                    y=settings.BUSES_Y_COORDS[1] + 5,
-                    length=settings.CPU_Y_COORD - settings.BUSES_Y_COORDS[1] - 5,
-                    active_color=Color.BLUE,
-                )
+        # Виджеты создаются только для видимых столбцов и переиспользуются
+        # при прокрутке
+        self.cpu_columns: List[_CPUColumn] = [
+            _CPUColumn(self, slot) for slot in range(settings.VISIBLE_CPU_COUNT)
+        ]
+        for slot, column in enumerate(self.cpu_columns):
+            column.bind(slot, self._get_cache_lines(slot))
+
+        self.cpu_scrollbar = None
+        if settings.CPU_COUNT > settings.VISIBLE_CPU_COUNT:
+            self.cpu_scrollbar = tk.Scrollbar(
+                self.root, orient=tk.HORIZONTAL, command=self._on_cpu_scroll
             )
-            self.cache_to_shared_buses.append(
-                VerticalArrow(
-                    self.canvas,
-                    x=settings.CPU_X_COORDS[cpu_index] + 31,
-                    y=settings.BUSES_Y_COORDS[2] + 5,
-                    length=settings.CPU_Y_COORD - settings.BUSES_Y_COORDS[2] - 5,
-                    active_color=Color.PINK,
-                )
+            self.cpu_scrollbar.place(
+                x=settings.TOP_LEFT_CORNER[0],
+                y=settings.BOTTOM_RIGHT_CORNER[1] - 20,
+                width=settings.BOTTOM_RIGHT_CORNER[0] - 320,
             )
+            self.cpu_scrollbar.set(0, settings.VISIBLE_CPU_COUNT / settings.CPU_COUNT)
 
-            self.cache_grids.append(
-                CacheGrid(
-                    self.root,
-                    f"CACHE {cpu_index}",
-                    x=settings.CPU_X_COORDS[cpu_index],
-                    y=settings.CPU_Y_COORD,
-                    width=170,
-                    height=100,
-                    channels_count=settings.CACH_CHANNELS_COUNT,
-                    cache_lines_count=settings.CACH_CACHLINES_COUNT,
-                )
-            )
+        # Доступ к виджетам по индексу процессора, как будто созданы все столбцы
+        self.cache_grids = _ColumnItems(self, "cache_grid", _HiddenCacheGrid)
+        self.cache_to_data_buses = _ColumnItems(self, "cache_to_data_bus")
+        self.cache_to_address_buses = _ColumnItems(self, "cache_to_address_bus")
+        self.cache_to_shared_buses = _ColumnItems(self, "cache_to_shared_bus")
+        self.cpu_to_cache_read_buses = _ColumnItems(self, "cpu_to_cache_read_bus")
+        self.cpu_to_cache_write_buses = _ColumnItems(self, "cpu_to_cache_write_bus")
 
-            self.cpu_to_cache_read_buses.append(
-                VerticalArrow(
-                    self.canvas,
-                    x=settings.CPU_X_COORDS[cpu_index] + 63,
-                    y=settings.CPU_Y_COORD + self.cache_grids[-1].height,
-                    length=settings.CPU_TO_CACHE_BUSES_LENGTH,
-                    active_color=Color.BLUE,
-                )
-            )
 
-            self.cpu_to_cache_write_buses.append(
-                VerticalArrow(
-                    self.canvas,
-                    x=settings.CPU_X_COORDS[cpu_index] + 105,
-                    y=settings.CPU_Y_COORD + self.cache_grids[-1].height,
-                    length=settings.CPU_TO_CACHE_BUSES_LENGTH,
-                    active_color=Color.RED,
-                )
-            )
+class _NullArrow:
+    """Стрелка процессора, который сейчас прокручен за пределы окна."""
 
-            self.cpu_btns.append(
-                CPUButtons(
-                    self.root,
-                    f"CPU {cpu_index}",
-                    x=settings.CPU_X_COORDS[cpu_index],
-                    y=settings.CPU_Y_COORD
-                    + self.cache_grids[-1].height
-                    + settings.CPU_TO_CACHE_BUSES_LENGTH,
-                    rows=16,
-                )
-            )
+    def reset(self):
+        pass
+
+    def run_arrow_up(self):
+        pass
+
+    def run_arrow_down(self):
+        pass
+
+
+class _HiddenCacheGrid:
+    """Кэш процессора, который сейчас не виден: обновления только запоминаются."""
+
+    def __init__(self, window: MainWindow, cpu_index):
+        self.lines = window._get_cache_lines(cpu_index)
+
+    def update_cache_line(
+        self, channel_index, cache_line_index, state, address, data, policy_counter
+    ):
+        row = channel_index * settings.CACH_CACHLINES_COUNT + cache_line_index
+        self.lines[row] = (state, address, data, policy_counter)
+
+    def reset(self):
+        self.lines[:] = [None] * len(self.lines)
+
+
+class _ColumnItems:
+    """Последовательность виджетов одного вида, индексируемая номером процессора.
+    Для видимых процессоров возвращает виджет столбца, для остальных - заглушку."""
+
+    def __init__(self, window: MainWindow, attribute, hidden_factory=None):
+        self.window = window
+        self.attribute = attribute
+        self.hidden_factory = hidden_factory
+
+    def __len__(self):
+        return settings.CPU_COUNT
+
+    def __getitem__(self, cpu_index):
+        if not 0 <= cpu_index < settings.CPU_COUNT:
+            raise IndexError(cpu_index)
+
+        column = self.window._get_column(cpu_index)
+        if column is not None:
+            return getattr(column, self.attribute)
+        if self.hidden_factory is not None:
+            return self.hidden_factory(self.window, cpu_index)
+        return _NULL_ARROW
+
+    def __iter__(self):
+        for cpu_index in range(len(self)):
+            yield self[cpu_index]
+
+
+_NULL_ARROW = _NullArrow()
+
+
+class _CPUColumn:
+    """Виджеты столбца процессора: стрелки к шинам, кэш и поле ввода адреса.
+    При прокрутке столбец показывает другой процессор."""
+
+    def __init__(self, window: MainWindow, slot):
+        self.window = window
+        self.cpu_index = slot
+        x = settings.CPU_X_COORDS[slot]
+        lines_count = settings.CACH_CHANNELS_COUNT * settings.CACH_CACHLINES_COUNT
+        cache_grid_height = 20 + CACHE_GRID_ROW_HEIGHT * min(lines_count, 16)
+
+        self.cache_to_data_bus = VerticalArrow(
+            window.canvas,
+            x=x + 105,
+            y=settings.BUSES_Y_COORDS[0] + 5,
+            length=settings.CPU_Y_COORD - settings.BUSES_Y_COORDS[0] - 5,
+            active_color=Color.RED,
+        )
+        self.cache_to_address_bus = VerticalArrow(
+            window.canvas,
+            x=x + 63,
+            y=settings.BUSES_Y_COORDS[1] + 5,
+            length=settings.CPU_Y_COORD - settings.BUSES_Y_COORDS[1] - 5,
+            active_color=Color.BLUE,
+        )
+        self.cache_to_shared_bus = VerticalArrow(
+            window.canvas,
+            x=x + 31,
+            y=settings.BUSES_Y_COORDS[2] + 5,
+            length=settings.CPU_Y_COORD - settings.BUSES_Y_COORDS[2] - 5,
+            active_color=Color.PINK,
+        )
+
+        self.cache_grid = CacheGrid(
+            window.root,
+            f"CACHE {slot}",
+            x=x,
+            y=settings.CPU_Y_COORD,
+            width=170,
+            height=cache_grid_height,
+            channels_count=settings.CACH_CHANNELS_COUNT,
+            cache_lines_count=settings.CACH_CACHLINES_COUNT,
+        )
+
+        self.cpu_to_cache_read_bus = VerticalArrow(
+            window.canvas,
+            x=x + 63,
+            y=settings.CPU_Y_COORD + self.cache_grid.height,
+            length=settings.CPU_TO_CACHE_BUSES_LENGTH,
+            active_color=Color.BLUE,
+        )
+        self.cpu_to_cache_write_bus = VerticalArrow(
+            window.canvas,
+            x=x + 105,
+            y=settings.CPU_Y_COORD + self.cache_grid.height,
+            length=settings.CPU_TO_CACHE_BUSES_LENGTH,
+            active_color=Color.RED,
+        )
+
+        self.cpu_btns = CPUButtons(
+            window.root,
+            f"CPU {slot}",
+            x=x,
+            y=settings.CPU_Y_COORD
+            + self.cache_grid.height
+            + settings.CPU_TO_CACHE_BUSES_LENGTH,
+            addresses_count=settings.RAM_SIZE,
+            read_callback=self._on_read,
+            write_callback=self._on_write,
+        )
+
+    def _on_read(self, address):
+        if self.window.cpu_read_callback is not None:
+            self.window.cpu_read_callback(self.cpu_index, address)
+
+    def _on_write(self, address):
+        if self.window.cpu_write_callback is not None:
+            self.window.cpu_write_callback(self.cpu_index, address)
+
+    def bind(self, cpu_index, cache_lines):
+        """Показывает в столбце указанный процессор."""
+        self.cpu_index = cpu_index
+        self.cache_grid.set_name(f"CACHE {cpu_index}")
+        self.cpu_btns.set_name(f"CPU {cpu_index}")
+        self.cache_grid.show(cache_lines)
+        self.reset_buses()
+
+    def reset_buses(self):
+        self.cache_to_address_bus.reset()
+        self.cache_to_data_bus.reset()
+        self.cache_to_shared_bus.reset()
+        self.cpu_to_cache_read_bus.reset()
+        self.cpu_to_cache_write_bus.reset()
@@ -0,0 +1,330 @@
+"""Отрисовка без окна: кадры состояния системы в той же раскладке, что и MainWindow,
+и временная диаграмма занятости шин по процессорам. Пишет SVG и PNG напрямую,
+без Tk, поэтому работает на машинах без дисплея.
+
+Демо:
+python -m visualization.offscreen out_dir 10000
+"""
+
+from __future__ import annotations
+import os
+import random
+import struct
+import sys
+import zlib
+from html import escape
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+import settings
+from events import EventKind
+
+# Те же цвета, что и у visualization.arrows.Color
+BACKGROUND = (240, 240, 240)
+BLACK = (32, 32, 32)
+RED = (255, 0, 0)
+BLUE = (0, 0, 255)
+PINK = (255, 0, 255)
+
+# Дорожки временной диаграммы: название и цвет
+LANES = (("ADDRESS BUS", BLUE), ("DATA BUS", RED), ("SHARED", PINK))
+ADDRESS_LANE, DATA_LANE, SHARED_LANE = range(len(LANES))
+
+# Строка диаграммы для оперативной памяти
+RAM_ROW = -1
+
+
+def _hex(color: Tuple[int, int, int]) -> str:
+    return "#%02x%02x%02x" % color
+
+
+def bus_occupancy(records: Iterable[Tuple]) -> Dict[Tuple[int, int], List[int]]:
+    """Раскладывает записи журнала (см. event_log.read_event_log) по дорожкам:
+    для пары (процессор или RAM_ROW, дорожка) - отсортированный список тактов,
+    в которые этот участник занимал шину."""
+    occupancy: Dict[Tuple[int, int], List[int]] = {}
+
+    def mark(row, lane, tick):
+        ticks = occupancy.setdefault((row, lane), [])
+        if not ticks or ticks[-1] != tick:
+            ticks.append(tick)
+
+    for tick, kind, cpu_index, source, address, data in records:
+        if kind == EventKind.ADDRESS_BUS or kind == EventKind.INVALIDATION:
+            mark(cpu_index, ADDRESS_LANE, tick)
+        elif kind == EventKind.DATA_BUS:
+            mark(cpu_index, DATA_LANE, tick)
+            mark(source if source >= 0 else RAM_ROW, DATA_LANE, tick)
+        elif kind == EventKind.INTERVENTION:
+            mark(cpu_index, DATA_LANE, tick)
+        elif kind == EventKind.COPY_BACK:
+            mark(cpu_index, DATA_LANE, tick)
+            mark(RAM_ROW, DATA_LANE, tick)
+        elif kind == EventKind.SHARED_LINE:
+            mark(cpu_index, SHARED_LANE, tick)
+
+    return occupancy
+
+
+def _runs(ticks: List[int]):
+    """Склеивает подряд идущие такты в отрезки [начало, конец)."""
+    start = previous = None
+    for tick in ticks:
+        if previous is not None and tick == previous + 1:
+            previous = tick
+            continue
+        if start is not None:
+            yield start, previous + 1
+        start = previous = tick
+    if start is not None:
+        yield start, previous + 1
+
+
+def _timeline_rows(cpu_count: int):
+    rows = []
+    for row in list(range(cpu_count)) + [RAM_ROW]:
+        for lane in range(len(LANES)):
+            if row == RAM_ROW and lane != DATA_LANE:
+                continue
+            rows.append((row, lane))
+    return rows
+
+
+def render_timeline_svg(
+    records: Iterable[Tuple],
+    path: str,
+    cpu_count: int = settings.CPU_COUNT,
+    tick_width: float = None,
+    max_width: int = 4000,
+    row_height: int = 14,
+):
+    """Рисует диаграмму Ганта занятости шин. Подряд идущие такты одной дорожки
+    рисуются одним прямоугольником, так что размер файла растёт с числом
+    переключений, а не с числом тактов."""
+    occupancy = bus_occupancy(records)
+    rows = _timeline_rows(cpu_count)
+    last_tick = max((ticks[-1] for ticks in occupancy.values()), default=0)
+    first_tick = min((ticks[0] for ticks in occupancy.values()), default=0)
+    span = last_tick - first_tick + 1
+    if tick_width is None:
+        tick_width = min(10.0, max_width / span)
+
+    label_width = 140
+    width = label_width + span * tick_width + 10
+    height = (len(rows) + 2) * row_height
+
+    with open(path, "w") as file:
+        file.write(
+            f'<svg xmlns="http://www.w3.org/2000/svg" width="{width:.0f}" '
+            f'height="{height}" font-family="sans-serif" font-size="10">\n'
+            f'<rect width="100%" height="100%" fill="{_hex(BACKGROUND)}"/>\n'
+        )
+
+        for i, (row, lane) in enumerate(rows):
+            y = (i + 1) * row_height
+            name = "RAM" if row == RAM_ROW else f"CPU {row}"
+            lane_name, color = LANES[lane]
+            file.write(
+                f'<text x="4" y="{y + row_height - 3}">{name} {lane_name}</text>\n'
+                f'<g fill="{_hex(color)}">'
+            )
+            for start, end in _runs(occupancy.get((row, lane), [])):
+                x = label_width + (start - first_tick) * tick_width
+                file.write(
+                    f'<rect x="{x:.2f}" y="{y + 1}" '
+                    f'width="{max((end - start) * tick_width, 0.5):.2f}" '
+                    f'height="{row_height - 2}"/>'
+                )
+            file.write("</g>\n")
+
+        y = (len(rows) + 2) * row_height - 3
+        file.write(
+            f'<text x="{label_width}" y="{y}">tick {first_tick}</text>\n'
+            f'<text x="{width - 10}" y="{y}" text-anchor="end">'
+            f"tick {last_tick}</text>\n</svg>\n"
+        )
+
+
+def write_png(path: str, width: int, height: int, pixels: bytes):
+    """Пишет RGB изображение в PNG. pixels - строки по width * 3 байт подряд."""
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return (
+            struct.pack(">I", len(data))
+            + kind
+            + data
+            + struct.pack(">I", zlib.crc32(kind + data))
+        )
+
+    stride = width * 3
+    raw = b"".join(
+        b"\x00" + pixels[y * stride : (y + 1) * stride] for y in range(height)
+    )
+
+    with open(path, "wb") as file:
+        file.write(b"\x89PNG\r\n\x1a\n")
+        header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+        file.write(chunk(b"IHDR", header))
+        file.write(chunk(b"IDAT", zlib.compress(raw, 6)))
+        file.write(chunk(b"IEND", b""))
+
+
+def render_timeline_png(
+    records: Iterable[Tuple],
+    path: str,
+    cpu_count: int = settings.CPU_COUNT,
+    max_width: int = 4000,
+    row_height: int = 8,
+):
+    """Та же диаграмма, что и render_timeline_svg, но растровая и без подписей.
+    Если тактов больше max_width, несколько тактов попадают в один пиксель."""
+    occupancy = bus_occupancy(records)
+    rows = _timeline_rows(cpu_count)
+    last_tick = max((ticks[-1] for ticks in occupancy.values()), default=0)
+    first_tick = min((ticks[0] for ticks in occupancy.values()), default=0)
+    span = last_tick - first_tick + 1
+    width = min(span, max_width)
+    height = len(rows) * row_height
+    background = bytes(BACKGROUND)
+
+    bands = []
+    for row, lane in rows:
+        line = bytearray(background * width)
+        color = bytes(LANES[lane][1])
+        for tick in occupancy.get((row, lane), []):
+            x = (tick - first_tick) * width // span
+            line[x * 3 : x * 3 + 3] = color
+        separator = bytes(BLACK) * width
+        bands.append(bytes(line) * (row_height - 1) + separator)
+
+    write_png(path, width, height, b"".join(bands))
+
+
+def render_state_svg(snapshot: Dict, path: str):
+    """Рисует кадр состояния системы из CacheController.snapshot() в раскладке
+    MainWindow: шины сверху, под ними кэши процессоров и оперативная память."""
+    width, height = settings.WINDOW_SIZE
+    cell_height = 18
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+        f'font-family="sans-serif" font-size="12">',
+        f'<rect width="100%" height="100%" fill="{_hex(BACKGROUND)}"/>',
+        f'<text x="1350" y="60">BUS CYCLES: {snapshot["tick"]}</text>',
+    ]
+
+    for (name, color), y in zip(
+        (LANES[DATA_LANE], LANES[ADDRESS_LANE], LANES[SHARED_LANE]),
+        settings.BUSES_Y_COORDS,
+    ):
+        x = settings.TOP_LEFT_CORNER[0]
+        parts.append(
+            f'<line x1="{x}" y1="{y}" x2="{x + settings.BUS_LENGTH}" y2="{y}" '
+            f'stroke="{_hex(BLACK)}" stroke-width="10"/>'
+            f'<text x="{x + 20}" y="{y - 10}" fill="{_hex(color)}">{name}</text>'
+        )
+
+    for cpu_index, cache in enumerate(snapshot["caches"]):
+        if cpu_index >= len(settings.CPU_X_COORDS):
+            break
+        x = settings.CPU_X_COORDS[cpu_index]
+        y = settings.CPU_Y_COORD
+        parts.append(f'<text x="{x}" y="{y - 4}">CACHE {cpu_index}</text>')
+        row = 0
+        for channel_index, channel in enumerate(cache):
+            for state, address, data, counter in channel:
+                cells = (
+                    channel_index,
+                    state or "I",
+                    "--" if address is None else bin(address)[2:],
+                    "--" if data is None else data,
+                    "--" if state is None else counter,
+                )
+                for column, (cell, cell_width) in enumerate(
+                    zip(cells, (20, 25, 45, 40, 40))
+                ):
+                    cell_x = x + sum((20, 25, 45, 40, 40)[:column])
+                    cell_y = y + row * cell_height
+                    parts.append(
+                        f'<rect x="{cell_x}" y="{cell_y}" width="{cell_width}" '
+                        f'height="{cell_height}" fill="none" stroke="black"/>'
+                        f'<text x="{cell_x + 3}" y="{cell_y + 13}">'
+                        f"{escape(str(cell))}</text>"
+                    )
+                row += 1
+
+    ram_x = settings.BOTTOM_RIGHT_CORNER[0] - 300
+    parts.append(f'<text x="{ram_x}" y="{settings.RAM_Y_COORD - 4}">RAM</text>')
+    ram_cell_height = min(cell_height, 500 // max(1, len(snapshot["ram"])))
+    for address, value in enumerate(snapshot["ram"]):
+        y = settings.RAM_Y_COORD + address * ram_cell_height
+        parts.append(
+            f'<rect x="{ram_x}" y="{y}" width="200" height="{ram_cell_height}" '
+            f'fill="none" stroke="black"/>'
+            f'<text x="{ram_x + 3}" y="{y + ram_cell_height - 4}">#{address}</text>'
+            f'<text x="{ram_x + 70}" y="{y + ram_cell_height - 4}">{value}</text>'
+        )
+
+    parts.append("</svg>\n")
+    with open(path, "w") as file:
+        file.write("\n".join(parts))
+
+
+def render_state_frames(
+    cache_controller,
+    cpu_indexes: Sequence[int],
+    operations: Sequence[int],
+    addresses: Sequence[int],
+    directory: str,
+    every: int = 1000,
+):
+    """Прогоняет трассу через run_batch и каждые every запросов сохраняет кадр
+    состояния frame_<такт>.svg в указанную папку."""
+    os.makedirs(directory, exist_ok=True)
+    for start in range(0, len(addresses), every):
+        end = start + every
+        cache_controller.run_batch(
+            cpu_indexes[start:end], operations[start:end], addresses[start:end]
+        )
+        render_state_svg(
+            cache_controller.snapshot(),
+            os.path.join(directory, f"frame_{cache_controller.tick:08d}.svg"),
+        )
+
+
+if __name__ == "__main__":
+    from array import array
+
+    from event_log import EventLogWriter, read_event_log
+    from protocol import CPU, RAM, CacheController
+
+    directory = sys.argv[1] if len(sys.argv) > 1 else "render"
+    operations_count = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+    os.makedirs(directory, exist_ok=True)
+
+    generator = random.Random(0)
+    cpu_indexes = array(
+        "b", (generator.randrange(settings.CPU_COUNT) for _ in range(operations_count))
+    )
+    operations = array("b", (generator.randrange(2) for _ in range(operations_count)))
+    addresses = array(
+        "q", (generator.randrange(settings.RAM_SIZE) for _ in range(operations_count))
+    )
+
+    ram = RAM(settings.RAM_SIZE)
+    cpus = [CPU(cpu_index) for cpu_index in range(settings.CPU_COUNT)]
+    cache_controller = CacheController(
+        ram, cpus, settings.CACH_CACHLINES_COUNT, settings.CACH_CHANNELS_COUNT
+    )
+
+    log_path = os.path.join(directory, "events.bin")
+    with EventLogWriter(log_path, cache_controller):
+        render_state_frames(
+            cache_controller,
+            cpu_indexes,
+            operations,
+            addresses,
+            directory,
+            every=max(1, operations_count // 10),
+        )
+
+    render_timeline_svg(read_event_log(log_path), os.path.join(directory, "bus.svg"))
+    render_timeline_png(read_event_log(log_path), os.path.join(directory, "bus.png"))
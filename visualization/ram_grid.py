@@ -1,59 +1,60 @@
-"""Визуализация оперативной памяти.
+"""Визуализация оперативной памяти. Метки создаются только для видимых ячеек,
+остальные доступны прокруткой.
 
 Демо:
-python ram_grid.py
+python -m visualization.ram_grid
 """
 
 import tkinter as tk
 
+from .virtual_rows import VirtualRows
+
+ROW_HEIGHT = 25
+
 
 class RAMGrid:
     def __init__(self, parent, name, x, y, width, height, size):
         self.size = size
 
         self.default_empty = "0"
+        # Храним только ячейки, отличные от значения по умолчанию
+        self.values = {}
 
         self.frame = tk.LabelFrame(parent, text=" " + name + " ")
         self.frame.place(x=x, y=y, width=width, height=height)
 
-        self.labels = []
-
-        for row in range(self.size):
-            address_label = tk.Label(
-                self.frame, text=f"#{row}", borderwidth=1, relief="solid"
-            )
-            address_label.grid(row=row, column=0, sticky="nsew", padx=0, pady=0)
+        self.rows = VirtualRows(
+            self.frame,
+            rows_count=self.size,
+            visible_rows_count=max(1, (height - 20) // ROW_HEIGHT),
+            column_weights=(1, 2),
+            get_row=self._get_row,
+        )
 
-            label = tk.Label(
-                self.frame, text=self.default_empty, borderwidth=1, relief="solid"
-            )
-            label.grid(row=row, column=1, rowspan=1, sticky="nsew", padx=0, pady=0)
-            self.labels.append(label)
-
-        # Конфигурация веса строк и столбцов для растягивания
-        for i in range(self.size):
-            self.frame.rowconfigure(i, weight=1)
-
-        self.frame.columnconfigure(0, weight=1)
-        self.frame.columnconfigure(1, weight=2)
+    def _get_row(self, address):
+        return f"#{address}", self.values.get(address, self.default_empty)
 
     def reset(self):
-        for label in self.labels:
-            label.config(text=self.default_empty)
+        self.values.clear()
+        self.rows.refresh()
 
     def write(self, value, address):
-        self.labels[address].config(text=str(value))
+        if self.values.get(address, self.default_empty) == value:
+            return
+
+        self.values[address] = value
+        self.rows.refresh_row(address)
 
 
 if __name__ == "__main__":
     # Пример использования
     root = tk.Tk()
     root.geometry("400x400")
-    grid = RAMGrid(root, "RAM", 20, 20, 200, 300, 16)
+    grid = RAMGrid(root, "RAM", 20, 20, 200, 300, 1024)
 
     root.after(2000, lambda: grid.write(10, 0))
 
-    root.after(4000, lambda: grid.write(20, 1))
+    root.after(4000, lambda: grid.write(20, 1000))
 
     root.after(7000, grid.reset)
 
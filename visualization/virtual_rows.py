@@ -0,0 +1,119 @@
+"""Таблица, которая создаёт метки только для видимых строк. При прокрутке те же
+метки показывают другие строки, поэтому число виджетов не зависит от числа строк.
+
+Демо:
+python virtual_rows.py
+"""
+
+import tkinter as tk
+from typing import Callable, List, Sequence
+
+
+class VirtualRows:
+    def __init__(
+        self,
+        frame,
+        rows_count: int,
+        visible_rows_count: int,
+        column_weights: Sequence[int],
+        get_row: Callable[[int], Sequence],
+    ):
+        """get_row(index) должна возвращать тексты ячеек строки с номером index."""
+        self.frame = frame
+        self.rows_count = rows_count
+        self.visible_rows_count = min(rows_count, visible_rows_count)
+        self.get_row = get_row
+        self.first_row = 0
+
+        self.labels: List[List[tk.Label]] = []
+
+        for row in range(self.visible_rows_count):
+            self.labels.append([])
+            for column in range(len(column_weights)):
+                label = tk.Label(self.frame, borderwidth=1, relief="solid")
+                label.grid(row=row, column=column, sticky="nsew", padx=0, pady=0)
+                self.labels[row].append(label)
+
+        # Конфигурация веса строк и столбцов для растягивания
+        for row in range(self.visible_rows_count):
+            self.frame.rowconfigure(row, weight=1)
+
+        for column, weight in enumerate(column_weights):
+            self.frame.columnconfigure(column, weight=weight)
+
+        self.scrollbar = None
+        if self.visible_rows_count < rows_count:
+            self.scrollbar = tk.Scrollbar(
+                self.frame, orient=tk.VERTICAL, command=self._on_scroll
+            )
+            self.scrollbar.grid(
+                row=0,
+                column=len(column_weights),
+                rowspan=self.visible_rows_count,
+                sticky="ns",
+            )
+            widgets = [label for row_labels in self.labels for label in row_labels]
+            for widget in [self.frame] + widgets:
+                # <MouseWheel> - Windows и macOS, <Button-4/5> - X11
+                widget.bind("<MouseWheel>", self._on_mouse_wheel)
+                widget.bind("<Button-4>", self._on_mouse_wheel)
+                widget.bind("<Button-5>", self._on_mouse_wheel)
+
+        self.refresh()
+
+    def _on_scroll(self, action, value, units=None):
+        if action == tk.MOVETO:
+            self.scroll_to_row(round(float(value) * self.rows_count))
+        elif action == tk.SCROLL:
+            step = self.visible_rows_count if units == tk.PAGES else 1
+            self.scroll_to_row(self.first_row + int(value) * step)
+
+    def _on_mouse_wheel(self, event):
+        up = event.num == 4 or event.delta > 0
+        self.scroll_to_row(self.first_row - 1 if up else self.first_row + 1)
+
+    def scroll_to_row(self, row: int):
+        row = max(0, min(row, self.rows_count - self.visible_rows_count))
+        if row != self.first_row:
+            self.first_row = row
+            self.refresh()
+
+    def refresh(self):
+        """Перерисовывает все видимые строки."""
+        for visible_row in range(self.visible_rows_count):
+            self._draw(visible_row)
+
+        if self.scrollbar is not None:
+            self.scrollbar.set(
+                self.first_row / self.rows_count,
+                (self.first_row + self.visible_rows_count) / self.rows_count,
+            )
+
+    def refresh_row(self, row: int):
+        """Перерисовывает строку, если она сейчас видна."""
+        visible_row = row - self.first_row
+        if 0 <= visible_row < self.visible_rows_count:
+            self._draw(visible_row)
+
+    def _draw(self, visible_row: int):
+        texts = self.get_row(self.first_row + visible_row)
+        for label, text in zip(self.labels[visible_row], texts):
+            label.config(text=str(text))
+
+
+if __name__ == "__main__":
+    root = tk.Tk()
+    root.geometry("300x300")
+    frame = tk.LabelFrame(root, text=" Rows ")
+    frame.place(x=20, y=20, width=200, height=200)
+
+    values = [0] * 1000
+    rows = VirtualRows(frame, 1000, 8, (1, 2), lambda i: (f"#{i}", values[i]))
+
+    def increment():
+        values[3] += 1
+        rows.refresh_row(3)
+        root.after(1000, increment)
+
+    increment()
+    root.mainloop()